@@ -0,0 +1,3 @@
+from .command import heyfastq_main
+
+heyfastq_main()
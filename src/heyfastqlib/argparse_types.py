@@ -6,6 +6,29 @@ import shutil
 import subprocess as sp
 import sys
 
+from .bgzf import is_bgzf, open_bgzf
+
+try:
+    from compression import zstd
+except ImportError:
+    zstd = None
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def zstd_threads(threads=None) -> int:
+    """Threads to compress zstd files with, where 0 means one per core
+
+    HFQ_ZSTD_THREADS overrides threads, if set.
+    """
+    default = str(threads or 0)
+    value = os.environ.get("HFQ_ZSTD_THREADS", default)
+    if not value.isdigit():
+        print(f"Invalid HFQ_ZSTD_THREADS value {value}, using default {default}")
+        value = default
+    return int(value)
+
 
 class GzipFileType(object):
     """Factory for creating optionally gzipped file object types
@@ -24,87 +47,119 @@ class GzipFileType(object):
             builtin open() function.
         - errors -- A string indicating how encoding and decoding errors are to
             be handled. Accepts the same value as the builtin open() function.
+        - threads -- The number of threads to (de)compress BGZF and zstd files
+            with in this process, rather than one per core. pigz and the zstd
+            program choose their own.
     """
 
-    def __init__(self, mode="r", bufsize=-1, encoding=None, errors=None):
+    def __init__(self, mode="r", bufsize=-1, encoding=None, errors=None, threads=None):
         self._mode = mode
         self._bufsize = bufsize
         self._encoding = encoding
         self._errors = errors
+        self._threads = threads
 
-    def open_gzip(self, filename):
-        compression = os.environ.get("HFQ_GZIP_COMPRESSION", "4")
-        if not compression.isdigit() or not (0 <= int(compression) <= 9):
-            print(f"Invalid HFQ_GZIP_COMPRESSION value{(compression)}, using default 4")
-            compression = "4"
-        pigz = shutil.which("pigz")
+    def _open_pipe(self, name, read_cmd, write_cmd, filename):
+        """Read or write through an external (de)compression program"""
+        binary_mode = "b" in self._mode
 
-        if pigz is not None:
-            binary_mode = "b" in self._mode
+        if "r" in self._mode:
+            p = sp.Popen(
+                read_cmd + [filename],
+                stdout=sp.PIPE,
+                bufsize=self._bufsize,
+            )
 
-            if "r" in self._mode:
-                p = sp.Popen(
-                    [pigz, f"-{compression}", "-dc", filename],
-                    stdout=sp.PIPE,
-                    bufsize=self._bufsize,
-                )
+            raw_stdout = p.stdout
+            if raw_stdout is None:
+                raise ValueError(f"{name} stdout unavailable")
 
-                raw_stdout = p.stdout
-                if raw_stdout is None:
-                    raise ValueError("pigz stdout unavailable")
+            if binary_mode:
+                stream = raw_stdout
+            else:
+                stream = io.TextIOWrapper(
+                    raw_stdout,
+                    encoding=self._encoding,
+                    errors=self._errors,
+                )
 
+            def close():
                 if binary_mode:
-                    stream = raw_stdout
+                    raw_stdout.close()
                 else:
-                    stream = io.TextIOWrapper(
-                        raw_stdout,
-                        encoding=self._encoding,
-                        errors=self._errors,
-                    )
-
-                def close():
-                    if binary_mode:
-                        raw_stdout.close()
-                    else:
-                        stream.close()
-                    p.wait()
-
-                return stream, close
-            elif any(c in self._mode for c in "wax"):
-                p = sp.Popen(
-                    [pigz, f"-{compression}", "-c"],
-                    stdin=sp.PIPE,
-                    stdout=open(
-                        filename,
-                        "wb",
-                        self._bufsize,
-                    ),
-                    bufsize=self._bufsize,
-                )
+                    stream.close()
+                p.wait()
+
+            return stream, close
+        elif any(c in self._mode for c in "wax"):
+            p = sp.Popen(
+                write_cmd,
+                stdin=sp.PIPE,
+                stdout=open(
+                    filename,
+                    "wb",
+                    self._bufsize,
+                ),
+                bufsize=self._bufsize,
+            )
 
-                raw_stdin = p.stdin
-                if raw_stdin is None:
-                    raise ValueError("pigz stdin unavailable")
+            raw_stdin = p.stdin
+            if raw_stdin is None:
+                raise ValueError(f"{name} stdin unavailable")
 
+            if binary_mode:
+                stream = raw_stdin
+            else:
+                stream = io.TextIOWrapper(
+                    raw_stdin,
+                    encoding=self._encoding,
+                    errors=self._errors,
+                )
+
+            def close():
                 if binary_mode:
-                    stream = raw_stdin
+                    raw_stdin.close()
                 else:
-                    stream = io.TextIOWrapper(
-                        raw_stdin,
-                        encoding=self._encoding,
-                        errors=self._errors,
-                    )
-
-                def close():
-                    if binary_mode:
-                        raw_stdin.close()
-                    else:
-                        stream.close()
-                    p.wait()
-
-                return stream, close
-            else:
-                raise ValueError(f"invalid mode for gzip file: {self._mode}")
+                    stream.close()
+                p.wait()
+
+            return stream, close
+        else:
+            raise ValueError(f"invalid mode for {name} file: {self._mode}")
+
+    def open_gzip(self, filename):
+        compression = os.environ.get("HFQ_GZIP_COMPRESSION", "4")
+        if not compression.isdigit() or not (0 <= int(compression) <= 9):
+            print(f"Invalid HFQ_GZIP_COMPRESSION value{(compression)}, using default 4")
+            compression = "4"
+        pigz = shutil.which("pigz")
+
+        if pigz is not None:
+            return self._open_pipe(
+                "gzip",
+                [pigz, f"-{compression}", "-dc"],
+                [pigz, f"-{compression}", "-c"],
+                filename,
+            )
+        elif "r" in self._mode and is_bgzf(filename):
+            # Without pigz, BGZF blocks can still be inflated in parallel
+            f = open_bgzf(
+                filename, self._mode, self._threads, self._encoding, self._errors
+            )
+
+            return f, f.close
+        elif any(c in self._mode for c in "wax"):
+            # Without pigz, write BGZF so that blocks are deflated in parallel
+            f = open_bgzf(
+                filename,
+                self._mode,
+                self._threads,
+                self._encoding,
+                self._errors,
+                int(compression),
+            )
+
+            return f, f.close
         else:
             f = gzip.open(
                 filename,
@@ -116,17 +171,56 @@ class GzipFileType(object):
 
             return f, f.close
 
+    def open_zstd(self, filename):
+        compression = os.environ.get("HFQ_ZSTD_COMPRESSION", "3")
+        if not compression.isdigit() or not (1 <= int(compression) <= 19):
+            print(f"Invalid HFQ_ZSTD_COMPRESSION value {compression}, using default 3")
+            compression = "3"
+
+        if zstd is not None:
+            mode = self._mode if "b" in self._mode else self._mode.rstrip("t") + "t"
+            options = None
+            if "r" not in self._mode:
+                options = {
+                    zstd.CompressionParameter.compression_level: int(compression),
+                    zstd.CompressionParameter.nb_workers: (
+                        zstd_threads(self._threads) or os.cpu_count() or 1
+                    ),
+                }
+            f = zstd.open(
+                filename,
+                mode,
+                options=options,
+                encoding=self._encoding,
+                errors=self._errors,
+            )
+            return f, f.close
+
+        zstd_program = shutil.which("zstd")
+        if zstd_program is None:
+            raise argparse.ArgumentTypeError(
+                f"can't open {filename}: zstd files need Python 3.14 or the "
+                "zstd program"
+            )
+        return self._open_pipe(
+            "zstd",
+            [zstd_program, "-dcq"],
+            [
+                zstd_program,
+                f"-{compression}",
+                f"-T{zstd_threads(self._threads)}",
+                "-cq",
+            ],
+            filename,
+        )
+
     def __call__(self, string):
         # the special argument "-" means sys.std{in,out}
         if string == "-":
             if "r" in self._mode:
-                return sys.stdin.buffer, None if "b" in self._mode else sys.stdin, None
+                return (sys.stdin.buffer if "b" in self._mode else sys.stdin), None
             elif any(c in self._mode for c in "wax"):
-                return (
-                    sys.stdout.buffer,
-                    None if "b" in self._mode else sys.stdout,
-                    None,
-                )
+                return (sys.stdout.buffer if "b" in self._mode else sys.stdout), None
             else:
                 msg = f'argument "-" with mode {self._mode}'
                 raise ValueError(msg)
@@ -135,12 +229,17 @@ class GzipFileType(object):
         try:
             try:
                 with open(string, "rb") as test_f:
-                    gzipped = test_f.read(2) == b"\x1f\x8b"
+                    magic = test_f.read(4)
+                gzipped = magic[:2] == GZIP_MAGIC
+                zstd_compressed = magic == ZSTD_MAGIC
             except FileNotFoundError:
                 gzipped = string.endswith(".gz")
+                zstd_compressed = string.endswith(".zst")
 
             if gzipped:
                 f, close = self.open_gzip(string)
+            elif zstd_compressed:
+                f, close = self.open_zstd(string)
             else:
                 f = open(
                     string, self._mode, self._bufsize, self._encoding, self._errors
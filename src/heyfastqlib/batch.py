@@ -0,0 +1,217 @@
+from array import array
+from dataclasses import dataclass
+from itertools import accumulate, pairwise
+import operator
+from typing import Callable, Container, Iterable, Sequence
+
+from .idindex import SeqIdIndex
+from .read import R, Read, kscore_ok, length_ok, seq_id_ok, trim
+from .seqs import kscore
+
+
+def _offsets(xs: Iterable[str]) -> array:
+    return array("I", accumulate(map(len, xs), initial=0))
+
+
+def _split(buf: str, offsets: array) -> list[str]:
+    return [buf[start:end] for start, end in pairwise(offsets)]
+
+
+@dataclass(slots=True)
+class ReadBatch:
+    """A chunk of reads stored column-wise
+
+    The descriptions, sequences and qualities of all reads are concatenated
+    into one string each. Read i spans offsets[i]:offsets[i + 1] of the
+    corresponding string.
+    """
+
+    desc: str
+    seq: str
+    qual: str
+    desc_offsets: array
+    seq_offsets: array
+    qual_offsets: array
+
+    @classmethod
+    def from_columns(
+        cls, descs: Sequence[str], seqs: Sequence[str], quals: Sequence[str]
+    ) -> "ReadBatch":
+        return cls(
+            "".join(descs),
+            "".join(seqs),
+            "".join(quals),
+            _offsets(descs),
+            _offsets(seqs),
+            _offsets(quals),
+        )
+
+    @classmethod
+    def from_reads(cls, reads: Sequence[Read]) -> "ReadBatch":
+        return cls.from_columns(
+            [r.desc for r in reads], [r.seq for r in reads], [r.qual for r in reads]
+        )
+
+    def __len__(self) -> int:
+        return len(self.seq_offsets) - 1
+
+    def lengths(self) -> array:
+        return array("I", map(operator.sub, self.seq_offsets[1:], self.seq_offsets))
+
+    def total_bases(self) -> int:
+        return self.seq_offsets[-1]
+
+    def descs(self) -> list[str]:
+        return _split(self.desc, self.desc_offsets)
+
+    def seqs(self) -> list[str]:
+        return _split(self.seq, self.seq_offsets)
+
+    def quals(self) -> list[str]:
+        return _split(self.qual, self.qual_offsets)
+
+    def reads(self) -> list[Read]:
+        return list(map(Read, self.descs(), self.seqs(), self.quals()))
+
+    def select(self, keep: Sequence[bool]) -> "ReadBatch":
+        """Return a new batch with the reads where keep is true
+
+        Runs of consecutive kept reads are copied with a single slice.
+        """
+        runs: list[tuple[int, int]] = []
+        start = None
+        for i, k in enumerate(keep):
+            if k and start is None:
+                start = i
+            elif not k and start is not None:
+                runs.append((start, i))
+                start = None
+        if start is not None:
+            runs.append((start, len(keep)))
+        if runs == [(0, len(self))]:
+            return self
+
+        columns = []
+        for buf, offsets in (
+            (self.desc, self.desc_offsets),
+            (self.seq, self.seq_offsets),
+            (self.qual, self.qual_offsets),
+        ):
+            pieces = []
+            new_offsets = array("I", [0])
+            for start, end in runs:
+                base = new_offsets[-1] - offsets[start]
+                pieces.append(buf[offsets[start] : offsets[end]])
+                new_offsets.extend(o + base for o in offsets[start + 1 : end + 1])
+            columns.append(("".join(pieces), new_offsets))
+        (desc, desc_offsets), (seq, seq_offsets), (qual, qual_offsets) = columns
+        return ReadBatch(desc, seq, qual, desc_offsets, seq_offsets, qual_offsets)
+
+    def trim(self, start_idx: int, end_idx: int) -> "ReadBatch":
+        seqs = [s[start_idx:end_idx] for s in self.seqs()]
+        quals = [q[start_idx:end_idx] for q in self.quals()]
+        return ReadBatch(
+            self.desc,
+            "".join(seqs),
+            "".join(quals),
+            self.desc_offsets,
+            _offsets(seqs),
+            _offsets(quals),
+        )
+
+    def to_fastq(self) -> str:
+        return "".join(
+            map("@{}\n{}\n+\n{}\n".format, self.descs(), self.seqs(), self.quals())
+        )
+
+
+Batch = tuple[ReadBatch, ...]
+"""A chunk of reads as one ReadBatch per mate. This is what flows through
+batch pipelines."""
+
+
+SerializedChunk = tuple[str, ...]
+"""A chunk of reads already formatted as FASTQ text, one string per mate.
+Each string can be written to its file with a single write."""
+
+
+def serialize_batch(b: Batch) -> SerializedChunk:
+    return tuple(rb.to_fastq() for rb in b)
+
+
+def serialize_reads(rs: list[R], mates: int) -> SerializedChunk:
+    fmt = "@{0.desc}\n{0.seq}\n+\n{0.qual}\n".format
+    if mates == 1:
+        return ("".join(map(fmt, rs)),)
+    return tuple("".join(fmt(r[i]) for r in rs) for i in range(mates))
+
+
+def batch_reads(b: Batch) -> list[R]:
+    if len(b) == 1:
+        return b[0].reads()
+    return list(zip(*(rb.reads() for rb in b)))
+
+
+def reads_batch(rs: list[R], mates: int) -> Batch:
+    if mates == 1:
+        return (ReadBatch.from_reads(rs),)
+    return tuple(ReadBatch.from_reads([r[i] for r in rs]) for i in range(mates))
+
+
+def count_batch_bases(b: Batch) -> int:
+    # Like count_bases, only the first read of a pair is counted
+    return b[0].total_bases()
+
+
+def select_batch(b: Batch, keep: Sequence[bool]) -> Batch:
+    return tuple(rb.select(keep) for rb in b)
+
+
+def trim_batch(b: Batch, start_idx: int = 0, end_idx: int = 100) -> Batch:
+    return tuple(rb.trim(start_idx, end_idx) for rb in b)
+
+
+def _all_mates(oks: list[list[bool]]) -> list[bool]:
+    if len(oks) == 1:
+        return oks[0]
+    return list(map(all, zip(*oks)))
+
+
+def length_ok_batch(
+    b: Batch, threshold: int = 100, cmp: Callable = operator.ge
+) -> list[bool]:
+    return _all_mates([[cmp(n, threshold) for n in rb.lengths()] for rb in b])
+
+
+def kscore_ok_batch(b: Batch, k: int = 4, min_kscore: float = 0.55) -> list[bool]:
+    # As in kscore_ok, the second read of a pair is skipped if the first fails
+    return [
+        all(kscore(s, k=k) >= min_kscore for s in seqs)
+        for seqs in zip(*(rb.seqs() for rb in b))
+    ]
+
+
+def seq_id_ok_batch(
+    b: Batch, seq_ids: Container[str] = set(), keep: bool = False
+) -> list[bool]:
+    found = []
+    for rb in b:
+        ids = [desc.split(maxsplit=1)[0] for desc in rb.descs()]
+        if isinstance(seq_ids, SeqIdIndex):
+            found.append(seq_ids.contains_many(ids))
+        else:
+            found.append([i in seq_ids for i in ids])
+    if keep:
+        return _all_mates(found)
+    return _all_mates([[not f for f in fs] for fs in found])
+
+
+BATCH_FUNCTIONS: dict[Callable, Callable] = {
+    trim: trim_batch,
+    length_ok: length_ok_batch,
+    kscore_ok: kscore_ok_batch,
+    seq_id_ok: seq_id_ok_batch,
+}
+"""Batch versions of stage functions from heyfastqlib.read. Batch pipelines
+use these when available and fall back to calling the per-read function on
+each read otherwise."""
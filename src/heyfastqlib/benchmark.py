@@ -0,0 +1,346 @@
+"""Benchmarks of every subcommand on synthetic reads
+
+Each run is a separate heyfastq process, so that its peak memory can be
+measured on its own. Input files are generated from a fixed seed, so runs
+from different releases see the same reads. Results are written as JSON,
+one record per run, for comparing releases.
+
+Run with python -m heyfastqlib.benchmark or heyfastq-benchmark.
+"""
+
+import argparse
+import gzip
+import itertools
+import json
+import os
+from pathlib import Path
+import platform
+import subprocess as sp
+import sys
+import tempfile
+import time
+from typing import Optional
+
+from . import __version__
+from .argparse_types import HFQFormatter
+from .io import write_fastq_batches
+from .synthetic import LengthDistribution, SyntheticReads, synthetic_chunks
+
+COMMANDS = (
+    "trim-fixed",
+    "trim-qual",
+    "filter-length",
+    "filter-kscore",
+    "filter-seqids",
+    "subsample",
+)
+LAYOUTS = ("single", "paired")
+COMPRESSIONS = ("plain", "gzip")
+
+
+def _write_reads(paths: list[Path], num_reads: int, read_length: int, seed: int):
+    """Write synthetic reads with a fixed seed, with the same IDs in each file"""
+    settings = SyntheticReads(
+        num_reads,
+        paired=len(paths) == 2,
+        lengths=LengthDistribution("fixed", read_length),
+        low_complexity=0.05,
+        duplicate_rate=0.05,
+        seed=seed,
+    )
+    fs = [open(path, "w") for path in paths]
+    try:
+        write_fastq_batches(tuple(fs), synthetic_chunks(settings))
+    finally:
+        for f in fs:
+            f.close()
+
+
+def _gzip_file(src: Path, dest: Path) -> None:
+    with open(src, "rb") as f_in, gzip.open(dest, "wb", compresslevel=4) as f_out:
+        while block := f_in.read(1 << 20):
+            f_out.write(block)
+
+
+def make_inputs(
+    workdir: Path, num_reads: int, read_length: int, seed: int = 1
+) -> dict[tuple[str, str], list[Path]]:
+    """Write the input FASTQs for every layout and compression
+
+    Also writes ids.txt, with the ID of every tenth read, for filter-seqids.
+    """
+    plain = [workdir / "reads_1.fastq", workdir / "reads_2.fastq"]
+    _write_reads(plain, num_reads, read_length, seed)
+    gzipped = [workdir / "reads_1.fastq.gz", workdir / "reads_2.fastq.gz"]
+    for src, dest in zip(plain, gzipped):
+        _gzip_file(src, dest)
+    with open(workdir / "ids.txt", "w") as f:
+        f.writelines(f"read{i}\n" for i in range(0, num_reads, 10))
+    return {
+        (layout, compression): paths[: 1 if layout == "single" else 2]
+        for layout in LAYOUTS
+        for compression, paths in [("plain", plain), ("gzip", gzipped)]
+    }
+
+
+def command_args(command: str, workdir: Path, num_reads: int) -> list[str]:
+    """Arguments to give each subcommand, so that it has work to do"""
+    if command == "trim-fixed":
+        return ["--length", "100"]
+    if command == "filter-length":
+        return ["--length", "100"]
+    if command == "filter-seqids":
+        return [str(workdir / "ids.txt")]
+    if command == "subsample":
+        return ["--n", str(max(num_reads // 10, 1)), "--seed", "1"]
+    return []
+
+
+def _child_env() -> dict[str, str]:
+    # Make sure the child runs this copy of heyfastqlib
+    src = str(Path(__file__).resolve().parents[1])
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [src, env.get("PYTHONPATH")]))
+    return env
+
+
+def _max_rss_bytes(rusage) -> int:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    if sys.platform == "darwin":
+        return rusage.ru_maxrss
+    return rusage.ru_maxrss * 1024
+
+
+def run_heyfastq(args: list[str]) -> dict:
+    """Run heyfastq in a new process and measure its time and peak memory"""
+    return _run_measured([sys.executable, "-m", "heyfastqlib", *args])
+
+
+def _run_measured(cmd: list[str]) -> dict:
+    # stderr goes to a file rather than a pipe, which the child could fill
+    # while this process waits for it without reading
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        p = sp.Popen(cmd, env=_child_env(), stderr=stderr)
+        if hasattr(os, "wait4"):
+            _, status, rusage = os.wait4(p.pid, 0)
+            p.returncode = os.waitstatus_to_exitcode(status)
+        else:  # pragma: no cover
+            p.wait()
+            rusage = None
+        seconds = time.perf_counter() - start
+        if p.returncode != 0:
+            stderr.seek(0)
+            raise RuntimeError(
+                f"{' '.join(cmd)} failed with exit code {p.returncode}:\n"
+                + stderr.read().decode(errors="replace")
+            )
+    result: dict = {"seconds": seconds}
+    if rusage is not None:
+        result["cpu_seconds"] = rusage.ru_utime + rusage.ru_stime
+        result["peak_rss_bytes"] = _max_rss_bytes(rusage)
+    return result
+
+
+# Builds a set or a SeqIdIndex of the IDs in a file, for comparing the two
+_BUILD_IDS = """
+import sys
+from heyfastqlib.idindex import SeqIdIndex
+from heyfastqlib.io import parse_seq_ids
+with open(sys.argv[2]) as f:
+    if sys.argv[1] == "set":
+        ids = set(parse_seq_ids(f))
+    else:
+        ids = SeqIdIndex.from_ids(parse_seq_ids(f))
+"""
+
+
+def run_id_index_benchmark(workdir: Path, num_ids: int) -> dict:
+    """Time and peak memory to build a set and a SeqIdIndex of num_ids IDs
+
+    The IDs look like Illumina read IDs. Each is built in its own process,
+    which imports the same modules, so the peak memory of the two compares
+    directly.
+    """
+    path = workdir / "index_ids.txt"
+    with open(path, "w") as f:
+        f.writelines(
+            f"A00123:8:H5KJ2DSXY:{i % 4 + 1}:{1101 + i // 4000 % 500}:"
+            f"{i % 4000 * 7}:{i}\n"
+            for i in range(num_ids)
+        )
+    return {
+        "ids": num_ids,
+        **{
+            kind: _run_measured([sys.executable, "-c", _BUILD_IDS, kind, str(path)])
+            for kind in ["set", "index"]
+        },
+    }
+
+
+def run_benchmarks(
+    workdir: Path,
+    num_reads: int = 100000,
+    read_length: int = 150,
+    commands=COMMANDS,
+    layouts=LAYOUTS,
+    compressions=COMPRESSIONS,
+    threads=(1,),
+    chunk_sizes=(1000,),
+    repeats: int = 1,
+    seed: int = 1,
+    log=None,
+    index_ids: int = 0,
+) -> dict:
+    """Run every combination of settings and return the results
+
+    With index_ids, also compares building a SeqIdIndex of that many IDs
+    with building a set of them.
+    """
+    inputs = make_inputs(workdir, num_reads, read_length, seed)
+    runs = []
+    settings = itertools.product(
+        commands, layouts, compressions, threads, chunk_sizes, range(repeats)
+    )
+    for command, layout, compression, n_threads, chunk_size, repeat in settings:
+        input_paths = inputs[(layout, compression)]
+        suffix = ".fastq.gz" if compression == "gzip" else ".fastq"
+        outputs = [str(workdir / f"out_{i}{suffix}") for i in range(len(input_paths))]
+        report_path = workdir / "report.json"
+        args = [
+            command,
+            *command_args(command, workdir, num_reads),
+            "--input",
+            *map(str, input_paths),
+            "--output",
+            *outputs,
+            "--threads",
+            str(n_threads),
+            "--chunk-size",
+            str(chunk_size),
+            "--report",
+            str(report_path),
+        ]
+        result = run_heyfastq(args)
+        input_bases = num_reads * read_length
+        run = {
+            "command": command,
+            "layout": layout,
+            "compression": compression,
+            "threads": n_threads,
+            "chunk_size": chunk_size,
+            "repeat": repeat,
+            "reads": num_reads,
+            "bases": input_bases,
+            **result,
+            "reads_per_second": num_reads / result["seconds"],
+            "bases_per_second": input_bases / result["seconds"],
+            "report": json.loads(report_path.read_text()),
+        }
+        runs.append(run)
+        if log is not None:
+            print(
+                f"{command} {layout} {compression} threads={n_threads} "
+                f"chunk_size={chunk_size}: {run['reads_per_second']:.0f} reads/s",
+                file=log,
+            )
+    results = {
+        "heyfastq_version": __version__,
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            "reads": num_reads,
+            "read_length": read_length,
+            "seed": seed,
+            "repeats": repeats,
+        },
+        "runs": runs,
+    }
+    if index_ids:
+        results["id_index"] = run_id_index_benchmark(workdir, index_ids)
+        if log is not None:
+            print(
+                "ID index: "
+                + ", ".join(
+                    f"{kind} {results['id_index'][kind]['seconds']:.2f} s "
+                    f"{results['id_index'][kind].get('peak_rss_bytes', 0) >> 20} MiB"
+                    for kind in ["set", "index"]
+                ),
+                file=log,
+            )
+    return results
+
+
+def benchmark_main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="heyfastq-benchmark",
+        formatter_class=HFQFormatter,
+        description=(
+            "Benchmark heyfastq subcommands on synthetic reads and write the "
+            "results as JSON"
+        ),
+    )
+    parser.add_argument("--output", help="Output JSON file (default: stdout)")
+    parser.add_argument("--reads", type=int, default=100000, help="Reads per file")
+    parser.add_argument("--read-length", type=int, default=150, help="Read length")
+    parser.add_argument(
+        "--commands", nargs="+", choices=COMMANDS, default=list(COMMANDS)
+    )
+    parser.add_argument("--layouts", nargs="+", choices=LAYOUTS, default=list(LAYOUTS))
+    parser.add_argument(
+        "--compressions", nargs="+", choices=COMPRESSIONS, default=list(COMPRESSIONS)
+    )
+    parser.add_argument("--threads", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--chunk-sizes", nargs="+", type=int, default=[1000, 10000])
+    parser.add_argument(
+        "--repeats", type=int, default=1, help="Times to run each combination"
+    )
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for reads")
+    parser.add_argument(
+        "--index-ids",
+        type=int,
+        default=1000000,
+        help="IDs to compare a filter-seqids ID index with a set on, 0 to skip",
+    )
+    parser.add_argument(
+        "--workdir",
+        help="Directory for input and output files (default: a temporary one)",
+    )
+    args = parser.parse_args(argv)
+
+    workdir: Optional[tempfile.TemporaryDirectory] = None
+    if args.workdir is None:
+        workdir = tempfile.TemporaryDirectory(prefix="heyfastq-benchmark-")
+        path = Path(workdir.name)
+    else:
+        path = Path(args.workdir)
+        path.mkdir(parents=True, exist_ok=True)
+    try:
+        results = run_benchmarks(
+            path,
+            args.reads,
+            args.read_length,
+            args.commands,
+            args.layouts,
+            args.compressions,
+            args.threads,
+            args.chunk_sizes,
+            args.repeats,
+            args.seed,
+            log=sys.stderr,
+            index_ids=args.index_ids,
+        )
+    finally:
+        if workdir is not None:
+            workdir.cleanup()
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+    else:
+        json.dump(results, sys.stdout, indent=4)
+
+
+if __name__ == "__main__":
+    benchmark_main()
@@ -0,0 +1,281 @@
+"""Reading and writing BGZF files with a thread pool
+
+BGZF files are a series of small gzip members, each with a "BC" field in
+the gzip header giving the size of the member. Because the size of every
+block is known up front, blocks can be split off without decompressing
+anything and inflated in parallel. Likewise, each block is compressed on
+its own, so blocks can be deflated in parallel and written in order. zlib
+releases the GIL while working, so a thread pool is enough to use several
+cores. Any gzip reader can read BGZF files.
+"""
+
+from array import array
+from collections import deque
+from gzip import BadGzipFile
+import io
+from multiprocessing.pool import ThreadPool
+import os
+import struct
+from typing import Optional
+import zlib
+
+READ_SIZE = 1 << 22
+# Uncompressed data per block, as in htslib. Blocks can't exceed 64 KiB.
+BLOCK_DATA_SIZE = 0xFF00
+MAX_BLOCK_SIZE = 1 << 16
+BLOCKS_PER_TASK = 64
+EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+# Fixed gzip header fields plus XLEN
+_HEADER_SIZE = 12
+_FEXTRA = 4
+
+
+def _block_size(data, pos: int) -> Optional[int]:
+    """Size of the BGZF block starting at pos, or None if the header is
+    not complete yet"""
+    if len(data) - pos < _HEADER_SIZE:
+        return None
+    if data[pos] != 0x1F or data[pos + 1] != 0x8B or data[pos + 2] != 8:
+        raise BadGzipFile("Not a gzipped file")
+    if not data[pos + 3] & _FEXTRA:
+        raise BadGzipFile("Not a BGZF block: no extra field in gzip header")
+    (xlen,) = struct.unpack_from("<H", data, pos + 10)
+    extra_end = pos + _HEADER_SIZE + xlen
+    if len(data) < extra_end:
+        return None
+    i = pos + _HEADER_SIZE
+    while i + 4 <= extra_end:
+        si1, si2, slen = struct.unpack_from("<BBH", data, i)
+        if si1 == 66 and si2 == 67 and slen == 2:
+            (bsize,) = struct.unpack_from("<H", data, i + 4)
+            return bsize + 1
+        i += 4 + slen
+    raise BadGzipFile("Not a BGZF block: no BC field in gzip header")
+
+
+def is_bgzf(filename) -> bool:
+    """Check if the first block of a file has a BGZF header"""
+    with open(filename, "rb") as f:
+        header = f.read(_HEADER_SIZE + 1024)
+    try:
+        return _block_size(header, 0) is not None
+    except BadGzipFile:
+        return False
+
+
+def compress_block(data: bytes, level: int = 6) -> bytes:
+    """Compress data into a single BGZF block"""
+    c = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = c.compress(data) + c.flush()
+    size = len(cdata) + 26
+    if size > MAX_BLOCK_SIZE:
+        half = len(data) // 2
+        return compress_block(data[:half], level) + compress_block(data[half:], level)
+    header = struct.pack(
+        "<BBBBIBBHBBHH", 0x1F, 0x8B, 8, _FEXTRA, 0, 0, 255, 6, 66, 67, 2, size - 1
+    )
+    return header + cdata + struct.pack("<II", zlib.crc32(data), len(data))
+
+
+def _deflate_blocks(data: bytes, level: int) -> bytes:
+    return b"".join(
+        compress_block(data[i : i + BLOCK_DATA_SIZE], level)
+        for i in range(0, len(data), BLOCK_DATA_SIZE)
+    )
+
+
+def block_offsets(filename) -> tuple[array, array]:
+    """Compressed and uncompressed offsets of every block in a BGZF file
+
+    Only the block headers and the uncompressed sizes at the end of each
+    block are read. Both arrays end with the total size.
+    """
+    compressed = array("Q", [0])
+    uncompressed = array("Q", [0])
+    with open(filename, "rb") as f:
+        while header := f.read(_HEADER_SIZE + 1024):
+            size = _block_size(header, 0)
+            if size is None:
+                raise BadGzipFile("Compressed file ended before the end of a block")
+            f.seek(compressed[-1] + size - 4)
+            isize = f.read(4)
+            if len(isize) < 4:
+                raise BadGzipFile("Compressed file ended before the end of a block")
+            compressed.append(compressed[-1] + size)
+            uncompressed.append(uncompressed[-1] + struct.unpack("<I", isize)[0])
+            f.seek(compressed[-1])
+    return compressed, uncompressed
+
+
+def _inflate_blocks(blocks: list) -> bytes:
+    # wbits=31 reads the gzip header and checks the CRC and length
+    return b"".join(zlib.decompress(b, 31) for b in blocks)
+
+
+class BgzfReader(io.RawIOBase):
+    """Raw binary stream of the decompressed contents of a BGZF file
+
+    Compressed data is read in large pieces and split into blocks in the
+    calling thread. Each piece is inflated on a thread pool, with at most
+    two pieces per thread in flight, and handed back in order. With threads
+    set to 0, pieces are inflated in the calling thread as they're needed,
+    which is quicker to set up for short reads.
+    """
+
+    def __init__(
+        self,
+        filename,
+        threads: Optional[int] = None,
+        read_size: int = READ_SIZE,
+        start: int = 0,
+    ):
+        if threads is None:
+            threads = os.cpu_count() or 1
+        if threads < 0:
+            raise ValueError("threads must be at least 0")
+        self._file = open(filename, "rb")
+        # start must be the offset of a block
+        self._file.seek(start)
+        self._read_size = read_size
+        self._pool = ThreadPool(processes=threads) if threads else None
+        self._window = 2 * threads
+        self._pending: deque = deque()
+        self._leftover = b""
+        self._eof = False
+        self._chunk = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def _read_blocks(self) -> list:
+        blocks: list = []
+        while not blocks:
+            new_data = self._file.read(self._read_size)
+            if not new_data:
+                if self._leftover:
+                    raise BadGzipFile("Compressed file ended before the end of a block")
+                return blocks
+            data = memoryview(self._leftover + new_data)
+            pos = 0
+            while True:
+                size = _block_size(data, pos)
+                if size is None or pos + size > len(data):
+                    break
+                blocks.append(data[pos : pos + size])
+                pos += size
+            self._leftover = bytes(data[pos:])
+        return blocks
+
+    def _fill(self) -> None:
+        while not self._eof and len(self._pending) < self._window:
+            blocks = self._read_blocks()
+            if not blocks:
+                self._eof = True
+                break
+            self._pending.append(self._pool.apply_async(_inflate_blocks, (blocks,)))
+
+    def readinto(self, b) -> int:
+        while not self._chunk and self._pool is None:
+            blocks = self._read_blocks()
+            if not blocks:
+                return 0
+            self._chunk = memoryview(_inflate_blocks(blocks))
+        while not self._chunk:
+            self._fill()
+            if not self._pending:
+                return 0
+            self._chunk = memoryview(self._pending.popleft().get())
+        n = min(len(b), len(self._chunk))
+        b[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        return n
+
+    def close(self) -> None:
+        if not self.closed:
+            if self._pool is not None:
+                self._pool.terminate()
+            self._file.close()
+        super().close()
+
+
+class BgzfWriter(io.RawIOBase):
+    """Raw binary stream that writes BGZF blocks to a file
+
+    Data is collected into pieces of 64 blocks, and each piece is deflated
+    on a thread pool. Once two pieces per thread are in flight, the calling
+    thread waits for the oldest one and writes it out, so blocks are written
+    in order. The BGZF end-of-file block is written on close.
+    """
+
+    def __init__(
+        self, filename, threads: Optional[int] = None, level: int = 6, mode="wb"
+    ):
+        if threads is None:
+            threads = os.cpu_count() or 1
+        if threads < 1:
+            raise ValueError("threads must be at least 1")
+        self._file = open(filename, mode)
+        self._level = level
+        self._pool = ThreadPool(processes=threads)
+        self._window = 2 * threads
+        self._pending: deque = deque()
+        self._buf = bytearray()
+        self._task_size = BLOCK_DATA_SIZE * BLOCKS_PER_TASK
+
+    def writable(self) -> bool:
+        return True
+
+    def _submit(self, data: bytes) -> None:
+        while len(self._pending) >= self._window:
+            self._file.write(self._pending.popleft().get())
+        self._pending.append(
+            self._pool.apply_async(_deflate_blocks, (data, self._level))
+        )
+
+    def write(self, b) -> int:
+        self._buf += b
+        if len(self._buf) >= self._task_size:
+            full = len(self._buf) - len(self._buf) % self._task_size
+            for i in range(0, full, self._task_size):
+                self._submit(bytes(self._buf[i : i + self._task_size]))
+            del self._buf[:full]
+        return len(b)
+
+    def close(self) -> None:
+        if not self.closed:
+            try:
+                if self._buf:
+                    self._submit(bytes(self._buf))
+                    self._buf.clear()
+                while self._pending:
+                    self._file.write(self._pending.popleft().get())
+                self._file.write(EOF_BLOCK)
+            finally:
+                self._pool.terminate()
+                self._file.close()
+        super().close()
+
+
+def open_bgzf(
+    filename,
+    mode: str = "r",
+    threads: Optional[int] = None,
+    encoding=None,
+    errors=None,
+    level: int = 6,
+):
+    """Open a BGZF file for reading or writing, in binary or text mode"""
+    if "+" in mode:
+        raise ValueError(f"invalid mode for BGZF file: {mode}")
+    if "r" in mode:
+        stream = io.BufferedReader(BgzfReader(filename, threads), READ_SIZE)
+    elif any(c in mode for c in "wax"):
+        raw_mode = next(c for c in mode if c in "wax") + "b"
+        stream = io.BufferedWriter(
+            BgzfWriter(filename, threads, level, raw_mode), READ_SIZE
+        )
+    else:
+        raise ValueError(f"invalid mode for BGZF file: {mode}")
+    if "b" in mode:
+        return stream
+    return io.TextIOWrapper(stream, encoding=encoding, errors=errors)
@@ -1,20 +1,49 @@
 import argparse
+import io
 import json
+import shlex
 import operator
 import signal
 import sys
+import time
 from contextlib import nullcontext
-from itertools import count
+from itertools import count, islice
+from typing import Iterable, Iterator, Optional
 from . import __version__
 from .argparse_types import GzipFileType, HFQFormatter
 from .io import (
-    count_reads,
+    count_fastq_reads,
     parse_fastq,
+    parse_fastq_batches,
+    parse_fastq_records,
     write_fastq,
+    write_fastq_batches,
+    write_fastq_shards,
     parse_seq_ids,
+    SHARD_MODES,
 )
-from .pipelines import filter_reads, map_reads
+from .batch import BATCH_FUNCTIONS, Batch, reads_batch
+from .fqindex import INDEX_INTERVAL, FastqIndex, build_index, index_path, load_index
+from .idindex import SeqIdIndex
+from .memory import (
+    DEFAULT_CHUNK_SIZE,
+    file_memory,
+    mean_record_size,
+    parse_memory_size,
+    plan_memory,
+)
+from .pipelines import (
+    EXECUTORS,
+    Stage,
+    run_batch_pipeline,
+    sample_reads,
+    stage_batch_function,
+)
+from .profiling import PROFILE_TOP, THREADS_PROFILABLE, Profiler
+from .progress import PROGRESS_INTERVAL, Heartbeat
+from .ranges import open_part
 from .read import (
+    count_bases,
     trim,
     kscore_ok,
     length_ok,
@@ -22,53 +51,236 @@ from .read import (
     trim_moving_average,
     trim_ends,
 )
-from .util import subsample
+from .report import merge_reports
+from .timing import (
+    TimedReader,
+    TimingDict,
+    add_timing,
+    subtract_timing,
+    sum_timings,
+    timed_iter,
+    timing_dict,
+)
+from .synthetic import (
+    QUALITY_PROFILES,
+    LengthDistribution,
+    SyntheticReads,
+    synthetic_chunks,
+)
+from .util import sample_indexes
+from .vectorized import BACKENDS, resolve_backend
+
+# Above this share of the reads, subsample scans the input rather than
+# seeking to each selected read through the index. Each read from a BGZF file
+# costs a block to inflate, so the share is much lower there.
+INDEX_SAMPLE_FRACTION = 0.5
+BGZF_INDEX_SAMPLE_FRACTION = 0.02
+
+
+def _timing(args, name: str) -> TimingDict:
+    """Timing for one part of the run, to go in the report"""
+    return args.timing.setdefault(name, timing_dict())
+
+
+def _input_timing(args) -> TimingDict:
+    return sum_timings(f.timing for f in args.input if isinstance(f, TimedReader))
+
+
+def _write_output(args, batches) -> dict:
+    """Write batches to the output files, or across shards with --shards
+
+    Returns anything to add to the report.
+    """
+    if args.shards == 1:
+        write_fastq_batches(args.output, batches, timing=_timing(args, "write"))
+        return {}
+    return {
+        "shard_counts": write_fastq_shards(
+            args.output_shards, batches, args.shard_by, timing=_timing(args, "write")
+        )
+    }
+
+
+def _timed_batches(args, batches: Iterable[Batch], timing) -> Iterator[Batch]:
+    """Time parsing and count the reads parsed"""
+    for batch in timed_iter(batches, timing):
+        args.timing["reads"] = args.timing.get("reads", 0) + len(batch[0])
+        yield batch
+
+
+def _run_stages(
+    args,
+    stages: list[Stage],
+    threads: Optional[int] = None,
+    batch_functions: Optional[dict] = None,
+    batches: Optional[Iterator[Batch]] = None,
+) -> dict:
+    """Parse the input FASTQs, run them through stages, and write the output
+
+    Pass batches to run the stages over other reads than the whole input.
+    """
+    if batches is None:
+        batches = parse_fastq_batches(args.input, args.chunk_size)
+    if args.profiler is not None:
+        functions = BATCH_FUNCTIONS if batch_functions is None else batch_functions
+        for s in stages:
+            # Steps of a run can share a function with different backends
+            fs = args.profile_functions.setdefault(s.f.__name__, [s.f])
+            batch_f = stage_batch_function(s, functions)
+            if batch_f not in fs:
+                fs.append(batch_f)
+    # Reading the input happens while parsing, so take it out afterwards
+    read_before = _input_timing(args)
+    parse = timing_dict()
+    report = _write_output(
+        args,
+        run_batch_pipeline(
+            _timed_batches(args, batches, parse),
+            stages,
+            threads=args.threads if threads is None else threads,
+            executor=args.executor,
+            batch_functions=batch_functions,
+            # Sharding splits batches up, so they can't be serialized yet
+            serialize=args.shards == 1,
+            serialize_timing=_timing(args, "serialize"),
+            profiler=args.profiler,
+            max_in_flight=args.max_in_flight,
+        ),
+    )
+    read = subtract_timing(_input_timing(args), read_before)
+    add_timing(_timing(args, "parse"), subtract_timing(parse, read))
+    return report
+
+
+def _reads_batches(reads: Iterable, mates: int, chunk_size: int) -> Iterator[Batch]:
+    it = iter(reads)
+    while chunk := list(islice(it, chunk_size)):
+        yield reads_batch(chunk, mates)
+
+
+def _input_indexes(args) -> Optional[list[FastqIndex]]:
+    """Indexes of the input files, if every one has an up to date index"""
+    if args.part is not None or "-" in args.input_names:
+        return None
+    try:
+        indexes = [load_index(name) for name in args.input_names]
+    except ValueError as e:
+        print(f"Not using index: {e}", file=sys.stderr)
+        return None
+    if any(index is None for index in indexes):
+        return None
+    if len({index.num_reads for index in indexes}) > 1:
+        return None
+    return indexes
+
+
+def _index_sample_fraction(indexes: list[FastqIndex]) -> float:
+    """Largest share of the reads to sample through the index"""
+    if any(index.virtual_offsets for index in indexes):
+        return BGZF_INDEX_SAMPLE_FRACTION
+    return INDEX_SAMPLE_FRACTION
+
+
+def _write_sample(args, sample: Iterable) -> dict:
+    if args.shards == 1:
+        write_fastq(args.output, sample, timing=_timing(args, "write"))
+        return {}
+    return _write_output(args, _reads_batches(sample, len(args.input), args.chunk_size))
 
 
 def subsample_subcommand(args):
-    num_reads = count_reads(args.input[0])
-    args.input[0].seek(0)
     counter = {
         "input_reads": 0,
         "input_bases": 0,
         "output_reads": 0,
         "output_bases": 0,
     }
-    indexes = set(subsample(list(range(num_reads)), args.n, args.seed))
-    index_counter = count()
+    args.progress_counters["subsample"] = counter
+    # With an index, the number of reads is known and the selected reads
+    # can be read directly, giving the same sample as counting reads first.
+    # For a large share of the reads, scanning the input is faster.
+    indexes = None if args.single_pass else _input_indexes(args)
+    if indexes is not None:
+        num_reads = indexes[0].num_reads
+        if args.n <= _index_sample_fraction(indexes) * num_reads:
+            counter["input_reads"] = num_reads
+            counter["input_bases"] = indexes[0].num_bases
+            selected = sample_indexes(num_reads, args.n, args.seed)
+            sample = list(parse_fastq_records(args.input_names, selected))
+            counter["output_reads"] = len(sample)
+            counter["output_bases"] = sum(map(count_bases, sample))
+            args.timing["reads"] = num_reads
+            return {"subsample": counter, **_write_sample(args, sample)}
 
-    def keep_read(_: object, *, _indexes=indexes, _counter=index_counter) -> bool:
-        return next(_counter) in _indexes
-
-    write_fastq(
-        args.output,
-        filter_reads(
+    # Counting reads first needs a second pass over the input, which isn't
+    # possible for stdin or pipes. Reads are then written in input order, as
+    # they would be after counting, unless --single-pass was asked for.
+    if indexes is None and (
+        args.single_pass or not all(f.seekable() for f in args.input)
+    ):
+        sample = sample_reads(
             parse_fastq(args.input),
-            keep_read,
+            args.n,
             counter,
-        ),
-    )
-    return {"subsample": counter}
+            seed=args.seed,
+            keep_order=args.keep_order or not args.single_pass,
+        )
+        if args.shards > 1:
+            sample = list(sample)
+        report = _write_sample(args, sample)
+        args.timing["reads"] = counter["input_reads"]
+        return {"subsample": counter, **report}
+
+    if indexes is None:
+        num_reads = count_fastq_reads(args.input)
+        for f in args.input:
+            f.seek(0)
+    # Reads come through in order, so step through the sorted indexes
+    # rather than looking each read up
+    selected = iter(sample_indexes(num_reads, args.n, args.seed))
+    next_selected = next(selected, None)
+    index_counter = count()
 
+    def keep_read(_: object) -> bool:
+        nonlocal next_selected
+        if next(index_counter) != next_selected:
+            return False
+        next_selected = next(selected, None)
+        return True
 
-def trim_fixed_subcommand(args):
+    # keep_read relies on seeing reads in order, so it must run in one thread
+    stage = Stage("filter", keep_read, counter)
+    report = _run_stages(args, [stage], threads=1)
+    args.timing["stages"] = {"subsample": stage.timing}
+    return {"subsample": counter, **report}
+
+
+def _run_named_stages(args, stages: dict[str, Stage], batch_functions=None):
+    """Run stages over the input and report each stage's counter by name"""
+    args.progress_counters.update((name, s.counter) for name, s in stages.items())
+    report = _run_stages(args, list(stages.values()), batch_functions=batch_functions)
+    args.timing["stages"] = {name: stage.timing for name, stage in stages.items()}
+    return {**{name: stage.counter for name, stage in stages.items()}, **report}
+
+
+def _backend_functions(args) -> dict:
+    return {**BATCH_FUNCTIONS, **(resolve_backend(args.backend) or {})}
+
+
+def trim_fixed_stages(args) -> dict[str, Stage]:
     counter = {"input_reads": 0, "input_bases": 0, "output_reads": 0, "output_bases": 0}
-    write_fastq(
-        args.output,
-        map_reads(
-            parse_fastq(args.input),
-            trim,
-            counter,
-            start_idx=0,
-            end_idx=args.length,
-            threads=args.threads,
-            chunk_size=args.chunk_size,
-        ),
-    )
-    return {"trim_fixed": counter}
+    return {
+        "trim_fixed": Stage(
+            "map", trim, counter, {"start_idx": 0, "end_idx": args.length}
+        )
+    }
 
 
-def trim_qual_subcommand(args):
+def trim_fixed_subcommand(args):
+    return _run_named_stages(args, trim_fixed_stages(args))
+
+
+def trim_qual_stages(args) -> dict[str, Stage]:
     length_counter = {
         "input_reads": 0,
         "input_bases": 0,
@@ -87,206 +299,360 @@ def trim_qual_subcommand(args):
         "output_reads": 0,
         "output_bases": 0,
     }
-    reads = parse_fastq(args.input)
-    reads = map_reads(
-        reads,
-        trim_moving_average,
-        trim_avg_counter,
-        k=args.window_width,
-        threshold=args.window_threshold,
-        threads=args.threads,
-        chunk_size=args.chunk_size,
-    )
-    reads = map_reads(
-        reads,
-        trim_ends,
-        trim_ends_counter,
-        threshold_start=args.start_threshold,
-        threshold_end=args.end_threshold,
-        threads=args.threads,
-        chunk_size=args.chunk_size,
-    )
-    reads = filter_reads(
-        reads,
-        length_ok,
-        length_counter,
-        threshold=args.min_length,
-        threads=args.threads,
-        chunk_size=args.chunk_size,
-    )
-    write_fastq(args.output, reads)
     return {
-        "trim_avg": trim_avg_counter,
-        "trim_ends": trim_ends_counter,
-        "filter_length": length_counter,
+        "trim_avg": Stage(
+            "map",
+            trim_moving_average,
+            trim_avg_counter,
+            {"k": args.window_width, "threshold": args.window_threshold},
+        ),
+        "trim_ends": Stage(
+            "map",
+            trim_ends,
+            trim_ends_counter,
+            {
+                "threshold_start": args.start_threshold,
+                "threshold_end": args.end_threshold,
+            },
+        ),
+        "filter_length": Stage(
+            "filter", length_ok, length_counter, {"threshold": args.min_length}
+        ),
     }
 
 
-def filter_length_subcommand(args):
+def trim_qual_subcommand(args):
+    return _run_named_stages(
+        args, trim_qual_stages(args), batch_functions=_backend_functions(args)
+    )
+
+
+def filter_length_stages(args) -> dict[str, Stage]:
     cmp = operator.lt if args.less else operator.ge
     counter = {"input_reads": 0, "input_bases": 0, "output_reads": 0, "output_bases": 0}
-    write_fastq(
-        args.output,
-        filter_reads(
-            parse_fastq(args.input),
-            length_ok,
-            counter,
-            threshold=args.length,
-            cmp=cmp,
-            threads=args.threads,
-            chunk_size=args.chunk_size,
-        ),
-    )
-    return {"filter_length": counter}
+    return {
+        "filter_length": Stage(
+            "filter", length_ok, counter, {"threshold": args.length, "cmp": cmp}
+        )
+    }
 
 
-def filter_kscore_subcommand(args):
+def filter_length_subcommand(args):
+    return _run_named_stages(args, filter_length_stages(args))
+
+
+def filter_kscore_stages(args) -> dict[str, Stage]:
     counter = {"input_reads": 0, "input_bases": 0, "output_reads": 0, "output_bases": 0}
-    write_fastq(
-        args.output,
-        filter_reads(
-            parse_fastq(args.input),
+    return {
+        "filter_kscore": Stage(
+            "filter",
             kscore_ok,
             counter,
-            k=args.kmer_size,
-            min_kscore=args.min_kscore,
-            threads=args.threads,
-            chunk_size=args.chunk_size,
-        ),
-    )
-    return {"filter_kscore": counter}
+            {"k": args.kmer_size, "min_kscore": args.min_kscore},
+        )
+    }
 
 
-def filter_seq_ids_subcommand(args):
-    with open(args.idsfile) as f:
-        seq_ids = set(parse_seq_ids(f))
+def filter_kscore_subcommand(args):
+    return _run_named_stages(args, filter_kscore_stages(args))
+
+
+def filter_seq_ids_stages(args) -> dict[str, Stage]:
+    f, close = GzipFileType("r", threads=args.threads)(args.idsfile)
+    try:
+        seq_ids = SeqIdIndex.from_ids(parse_seq_ids(f))
+    finally:
+        if close:
+            close()
     counter = {"input_reads": 0, "input_bases": 0, "output_reads": 0, "output_bases": 0}
-    write_fastq(
-        args.output,
-        filter_reads(
-            parse_fastq(args.input),
+    return {
+        "filter_seq_ids": Stage(
+            "filter",
             seq_id_ok,
             counter,
-            seq_ids=seq_ids,
-            keep=args.keep_ids,
-            threads=args.threads,
-            chunk_size=args.chunk_size,
-        ),
-    )
-    return {"filter_seq_ids": counter}
+            {"seq_ids": seq_ids, "keep": args.keep_ids},
+        )
+    }
+
+
+def filter_seq_ids_subcommand(args):
+    stages = filter_seq_ids_stages(args)
+    # To keep a few IDs, look up their reads in the index instead of reading
+    # the whole input. Each read looked up costs a partial scan of up to the
+    # index interval.
+    indexes = _input_indexes(args) if args.keep_ids else None
+    if indexes is None or not indexes[0].keys:
+        return _run_named_stages(args, stages)
+    index = indexes[0]
+    stage = stages["filter_seq_ids"]
+    seq_ids = stage.kwargs["seq_ids"]
+    if len(seq_ids) * index.interval >= index.num_reads:
+        return _run_named_stages(args, stages)
+    # The index finds reads by the key of their ID, which other IDs can
+    # share. The filter then compares each read's ID with the listed IDs,
+    # for every read of a pair, and drops the reads that only matched a key
+    args.progress_counters["filter_seq_ids"] = stage.counter
+    records = index.records_for_keys(seq_ids.keys)
+    reads = parse_fastq_records(args.input_names, records)
+    batches = _reads_batches(reads, len(args.input_names), args.chunk_size)
+    report = _run_stages(args, [stage], batches=batches)
+    stage.counter["input_reads"] = index.num_reads
+    stage.counter["input_bases"] = index.num_bases
+    args.timing["stages"] = {"filter_seq_ids": stage.timing}
+    args.timing["reads"] = index.num_reads
+    return {"filter_seq_ids": stage.counter, **report}
+
+
+def run_subcommand(args):
+    stages = []
+    report_steps = []
+    step_timings = []
+    for i, step_args in enumerate(args.step, start=1):
+        step_stages = step_args.stages_func(step_args)
+        stages.extend(step_stages.values())
+        args.progress_counters.update(
+            (f"{i}/{name}", s.counter) for name, s in step_stages.items()
+        )
+        if "backend" in step_args:
+            # Each step can have a backend of its own
+            for s in step_stages.values():
+                s.batch_functions = _backend_functions(step_args)
+        report_step = {"step": step_args.step}
+        report_step.update(_report_options(step_args))
+        report_step.update((name, s.counter) for name, s in step_stages.items())
+        report_steps.append(report_step)
+        step_timings.append({name: s.timing for name, s in step_stages.items()})
+    report = _run_stages(args, stages)
+    args.timing["steps"] = step_timings
+    return {"steps": report_steps, **report}
+
+
+def _parse_part(part: str) -> tuple[int, int]:
+    k, sep, n = part.partition("/")
+    if not (sep and k.isdigit() and n.isdigit() and 1 <= int(k) <= int(n)):
+        raise argparse.ArgumentTypeError(
+            f"invalid part {part}: must be K/N with 1 <= K <= N"
+        )
+    return int(k), int(n)
+
+
+def merge_reports_subcommand(args):
+    reports = []
+    for filename in args.reports:
+        with open(filename) as f:
+            reports.append(json.load(f))
+    try:
+        merged = merge_reports(reports)
+    except ValueError as e:
+        raise SystemExit(f"heyfastq merge-reports: error: {e}")
+    if args.output is not None:
+        output_file = open(args.output, "w")
+    else:
+        output_file = nullcontext(sys.stdout)
+    with output_file as f:
+        json.dump(merged, f, indent=4)
+
+
+def index_subcommand(args):
+    if args.interval < 1:
+        raise SystemExit("heyfastq index: error: --interval must be at least 1")
+    for filename in args.fastqs:
+        try:
+            index = build_index(filename, args.interval, args.ids, args.threads)
+        except ValueError as e:
+            raise SystemExit(f"heyfastq index: error: {e}")
+        index.write(index_path(filename))
+
+
+def generate_subcommand(args):
+    if len(args.output) not in (1, 2):
+        raise SystemExit("heyfastq generate: error: give one or two output files")
+    try:
+        settings = SyntheticReads(
+            args.n,
+            paired=len(args.output) == 2,
+            lengths=LengthDistribution.from_string(args.length),
+            quality_profile=args.quality_profile,
+            quality_start=args.quality_start,
+            quality_end=args.quality_end,
+            quality_noise=args.quality_noise,
+            low_complexity=args.low_complexity,
+            duplicate_rate=args.duplicate_rate,
+            seed=args.seed,
+            prefix=args.prefix,
+        )
+    except ValueError as e:
+        raise SystemExit(f"heyfastq generate: error: {e}")
+    output_type = GzipFileType("w")
+    outputs = [output_type(o) for o in args.output]
+    try:
+        write_fastq_batches(tuple(f for f, _ in outputs), synthetic_chunks(settings))
+    finally:
+        for _, close in outputs:
+            if close is not None:
+                close()
 
 
 fastq_io_parser = argparse.ArgumentParser(add_help=False, formatter_class=HFQFormatter)
 fastq_io_parser.add_argument(
     "--input",
-    type=GzipFileType("r"),
     nargs="*",
-    default=[sys.stdin],
+    default=["-"],
     help="Input FASTQs, can be gzipped (default: stdin)",
 )
 fastq_io_parser.add_argument(
     "--output",
-    type=GzipFileType("w"),
     nargs="*",
-    default=[sys.stdout],
+    default=["-"],
     help="Output FASTQs, can be gzipped (default: stdout)",
 )
+fastq_io_parser.add_argument(
+    "--shards",
+    type=int,
+    default=1,
+    help=(
+        "Split the output into this many sets of files. Each output file "
+        "name must then contain {shard}, which is replaced by the shard "
+        "number (default: 1)"
+    ),
+)
+fastq_io_parser.add_argument(
+    "--shard-by",
+    choices=SHARD_MODES,
+    default="chunk",
+    help=(
+        "Send whole chunks of reads to the shards in turn, or deal out "
+        "reads one at a time. Pairs always stay together (default: chunk)"
+    ),
+)
+fastq_io_parser.add_argument(
+    "--part",
+    type=_parse_part,
+    help=(
+        "Process only part K of N of the input, given as K/N, so that N "
+        "runs can split up the same files. The input must be uncompressed "
+        "or BGZF. Use merge-reports to combine the reports"
+    ),
+)
 fastq_io_parser.add_argument(
     "--report",
     help="Output report file",
 )
+fastq_io_parser.add_argument(
+    "--progress",
+    nargs="?",
+    const="-",
+    help=(
+        "Write progress as a line of JSON every --progress-interval "
+        "seconds, to this file or to stderr if no file is given"
+    ),
+)
+fastq_io_parser.add_argument(
+    "--progress-interval",
+    type=float,
+    default=PROGRESS_INTERVAL,
+    help="Seconds between progress lines (default: %(default)s)",
+)
+fastq_io_parser.add_argument(
+    "--profile",
+    help=(
+        "Profile the run, in the main thread and the workers, and write "
+        "the stats to this file for pstats. The report gets a summary."
+    ),
+)
+fastq_io_parser.add_argument(
+    "--profile-top",
+    type=int,
+    default=PROFILE_TOP,
+    help="Functions to list in the report's profile summary (default: %(default)s)",
+)
 fastq_io_parser.add_argument(
     "--threads", type=int, default=1, help="Number of threads to use (default: 1)"
 )
 fastq_io_parser.add_argument(
     "--chunk-size",
     type=int,
-    default=1000,
-    help="Number of reads processed per worker chunk (default: 1000)",
+    help=(
+        "Number of reads processed per worker chunk (default: 1000, or "
+        "sized to fit --max-memory)"
+    ),
+)
+fastq_io_parser.add_argument(
+    "--max-memory",
+    help=(
+        "Memory to stay within, such as 500M or 2G. Sets the chunk size, "
+        "at most --chunk-size or 1000, and the chunks in flight at the "
+        "workers from the mean size of the first reads in each input"
+    ),
+)
+fastq_io_parser.add_argument(
+    "--executor",
+    choices=EXECUTORS,
+    default="thread",
+    help=(
+        "Run workers as threads or as separate processes, which avoids the "
+        "GIL for CPU-bound steps (default: thread)"
+    ),
 )
 
 
-def heyfastq_main(argv=None):
-    # Ignore SIG_PIPE and don't throw exceptions on it
-    # newbebweb.blogspot.com/2012/02/python-head-ioerror-errno-32-broken.html
-    # Try/catch to not fail on Windows
-    # https://github.com/t2mune/mrtparse/issues/18
-    try:
-        signal.signal(signal.SIGPIPE, signal.SIG_DFL)
-    except AttributeError:
-        pass
-
-    main_parser = argparse.ArgumentParser()
-    main_parser.add_argument(
-        "-v",
-        "--version",
-        action="version",
-        version=f"{__version__}",
-    )
-    subparsers = main_parser.add_subparsers(title="Subcommands", required=True)
-
-    trim_fixed_parser = subparsers.add_parser(
-        "trim-fixed",
-        parents=[fastq_io_parser],
-        formatter_class=HFQFormatter,
-        help="Trim reads to fixed length",
-    )
-    trim_fixed_parser.add_argument(
+def add_trim_fixed_arguments(parser):
+    parser.add_argument(
         "--length",
         type=int,
         default=100,
         help="Length of output reads",
     )
-    trim_fixed_parser.set_defaults(func=trim_fixed_subcommand)
 
-    trim_qual_parser = subparsers.add_parser(
-        "trim-qual",
-        parents=[fastq_io_parser],
-        formatter_class=HFQFormatter,
-        help="Trim reads based on quality scores",
-    )
-    trim_qual_parser.add_argument(
+
+def add_trim_qual_arguments(parser):
+    parser.add_argument(
         "--window-width", type=int, default=4, help="Sliding window width"
     )
-    trim_qual_parser.add_argument(
+    parser.add_argument(
         "--window-threshold",
         type=float,
         default=15,
         help="Sliding window mean quality threshold",
     )
-    trim_qual_parser.add_argument(
+    parser.add_argument(
         "--start-threshold",
         type=float,
         default=3,
         help="Quality threshold for trimming start of read",
     )
-    trim_qual_parser.add_argument(
+    parser.add_argument(
         "--end-threshold",
         type=float,
         default=3,
         help="Quality threshold for trimming end of read",
     )
-    trim_qual_parser.add_argument(
+    parser.add_argument(
         "--min-length",
         type=int,
         default=36,
         help="Minimum length after quality trimming",
     )
-    trim_qual_parser.set_defaults(func=trim_qual_subcommand)
-
-    filter_length_parser = subparsers.add_parser(
-        "filter-length",
-        parents=[fastq_io_parser],
-        formatter_class=HFQFormatter,
-        help="Filter reads by length",
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="auto",
+        help=(
+            "Quality trimming implementation. numpy works on whole chunks at "
+            "once and requires NumPy; auto uses it when NumPy is installed "
+            "(default: auto)"
+        ),
     )
-    filter_length_parser.add_argument(
+
+
+def add_filter_length_arguments(parser):
+    parser.add_argument(
         "--length",
         type=int,
         default=100,
         help="Length threshold",
     )
-    filter_length_parser.add_argument(
+    parser.add_argument(
         "--less",
         action="store_true",
         help=(
@@ -294,41 +660,155 @@ def heyfastq_main(argv=None):
             "(default: keep greater than or equal to length)"
         ),
     )
-    filter_length_parser.set_defaults(func=filter_length_subcommand)
 
-    filter_kscore_parser = subparsers.add_parser(
-        "filter-kscore",
-        parents=[fastq_io_parser],
-        formatter_class=HFQFormatter,
-        help="Filter reads by komplexity score",
-    )
-    filter_kscore_parser.add_argument(
-        "--kmer-size", type=int, default=4, help="Kmer size"
-    )
-    filter_kscore_parser.add_argument(
+
+def add_filter_kscore_arguments(parser):
+    parser.add_argument("--kmer-size", type=int, default=4, help="Kmer size")
+    parser.add_argument(
         "--min-kscore",
         type=float,
         default=0.55,
         help="Minimum komplexity score",
     )
-    filter_kscore_parser.set_defaults(func=filter_kscore_subcommand)
 
-    filter_seq_ids_parser = subparsers.add_parser(
-        "filter-seqids",
-        parents=[fastq_io_parser],
-        formatter_class=HFQFormatter,
-        help="Filter reads by sequence id",
-    )
-    filter_seq_ids_parser.add_argument(
+
+def add_filter_seq_ids_arguments(parser):
+    parser.add_argument(
         "idsfile",
-        help="File containing sequence ids, one per line",
+        help="File containing sequence ids, one per line, can be gzipped",
     )
-    filter_seq_ids_parser.add_argument(
+    parser.add_argument(
         "--keep-ids",
         action="store_true",
         help="Keep, rather than remove ids in list",
     )
-    filter_seq_ids_parser.set_defaults(func=filter_seq_ids_subcommand)
+
+
+# Subcommands made of pipeline stages, which can also be chained with
+# heyfastq run. Each entry is the help text, a function to add the
+# subcommand's arguments, a function to build its stages and the function
+# for the subcommand itself.
+STEP_COMMANDS = {
+    "trim-fixed": (
+        "Trim reads to fixed length",
+        add_trim_fixed_arguments,
+        trim_fixed_stages,
+        trim_fixed_subcommand,
+    ),
+    "trim-qual": (
+        "Trim reads based on quality scores",
+        add_trim_qual_arguments,
+        trim_qual_stages,
+        trim_qual_subcommand,
+    ),
+    "filter-length": (
+        "Filter reads by length",
+        add_filter_length_arguments,
+        filter_length_stages,
+        filter_length_subcommand,
+    ),
+    "filter-kscore": (
+        "Filter reads by komplexity score",
+        add_filter_kscore_arguments,
+        filter_kscore_stages,
+        filter_kscore_subcommand,
+    ),
+    "filter-seqids": (
+        "Filter reads by sequence id",
+        add_filter_seq_ids_arguments,
+        filter_seq_ids_stages,
+        filter_seq_ids_subcommand,
+    ),
+}
+
+step_parser = argparse.ArgumentParser(
+    prog="heyfastq run --step", formatter_class=HFQFormatter
+)
+step_subparsers = step_parser.add_subparsers(title="Steps", dest="step", required=True)
+for _name, (_help, _add_arguments, _stages_func, _) in STEP_COMMANDS.items():
+    _parser = step_subparsers.add_parser(
+        _name, formatter_class=HFQFormatter, help=_help
+    )
+    _add_arguments(_parser)
+    _parser.set_defaults(stages_func=_stages_func)
+
+
+def _parse_step(step: str) -> argparse.Namespace:
+    return step_parser.parse_args(shlex.split(step))
+
+
+# Arguments that aren't copied into the report
+REPORT_EXCLUDE = (
+    "input",
+    "output",
+    "func",
+    "stages_func",
+    "idsfile",
+    "report",
+    "threads",
+    "executor",
+    "backend",
+    "step",
+    "output_shards",
+    "input_names",
+    "timing",
+    "progress",
+    "progress_interval",
+    "progress_counters",
+    "profile",
+    "profile_top",
+    "profiler",
+    "profile_functions",
+    "max_in_flight",
+)
+
+
+def _report_options(args) -> dict:
+    return {k: v for k, v in vars(args).items() if k not in REPORT_EXCLUDE}
+
+
+def _timing_report(args, total: TimingDict) -> dict:
+    timing = args.timing
+    reads = timing.pop("reads", 0)
+    report: dict = {"read": _input_timing(args)}
+    for name in ["parse", "stages", "steps", "serialize", "write"]:
+        if name in timing:
+            report[name] = timing[name]
+    report["total"] = total
+    report["reads"] = reads
+    seconds = total["wall_seconds"]
+    report["reads_per_second"] = reads / seconds if seconds > 0 else 0.0
+    return report
+
+
+def heyfastq_main(argv=None):
+    # Ignore SIG_PIPE and don't throw exceptions on it
+    # newbebweb.blogspot.com/2012/02/python-head-ioerror-errno-32-broken.html
+    # Try/catch to not fail on Windows
+    # https://github.com/t2mune/mrtparse/issues/18
+    try:
+        signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+    except AttributeError:
+        pass
+
+    main_parser = argparse.ArgumentParser()
+    main_parser.add_argument(
+        "-v",
+        "--version",
+        action="version",
+        version=f"{__version__}",
+    )
+    subparsers = main_parser.add_subparsers(title="Subcommands", required=True)
+
+    for name, (help, add_arguments, _, func) in STEP_COMMANDS.items():
+        step_parser = subparsers.add_parser(
+            name,
+            parents=[fastq_io_parser],
+            formatter_class=HFQFormatter,
+            help=help,
+        )
+        add_arguments(step_parser)
+        step_parser.set_defaults(func=func)
 
     subsample_parser = subparsers.add_parser(
         "subsample",
@@ -338,38 +818,291 @@ def heyfastq_main(argv=None):
     )
     subsample_parser.add_argument("--n", type=int, default=1000, help="Number of reads")
     subsample_parser.add_argument("--seed", type=int, help="Random seed")
+    subsample_parser.add_argument(
+        "--single-pass",
+        action="store_true",
+        help=(
+            "Read the input once, keeping a reservoir of --n reads in memory, "
+            "instead of counting reads first. Selects the same reads for a "
+            "given --seed. Always used when the input can't be rewound, e.g. "
+            "stdin"
+        ),
+    )
+    subsample_parser.add_argument(
+        "--keep-order",
+        action="store_true",
+        help=(
+            "With --single-pass, write reads in their input order rather than "
+            "in reservoir order"
+        ),
+    )
     subsample_parser.set_defaults(func=subsample_subcommand)
 
+    run_parser = subparsers.add_parser(
+        "run",
+        parents=[fastq_io_parser],
+        formatter_class=HFQFormatter,
+        help="Run several steps in a single pass",
+        description=(
+            "Run several steps on the reads in a single pass, reading and "
+            "writing the FASTQ files once. Steps run in the order given. "
+            f"Available steps: {', '.join(STEP_COMMANDS)}"
+        ),
+    )
+    run_parser.add_argument(
+        "--step",
+        action="append",
+        required=True,
+        type=_parse_step,
+        help=(
+            "A step and its arguments, quoted, as for the subcommand "
+            "of the same name, e.g. --step 'trim-fixed --length 100'. "
+            "Repeat for each step"
+        ),
+    )
+    run_parser.set_defaults(func=run_subcommand)
+
+    merge_reports_parser = subparsers.add_parser(
+        "merge-reports",
+        formatter_class=HFQFormatter,
+        help="Combine the reports from runs with --part",
+        description=(
+            "Combine the reports from runs over separate parts of the same "
+            "input, adding up the read and base counts"
+        ),
+    )
+    merge_reports_parser.add_argument("reports", nargs="+", help="Report files")
+    merge_reports_parser.add_argument(
+        "--output", help="Output report file (default: stdout)"
+    )
+    merge_reports_parser.set_defaults(func=merge_reports_subcommand)
+
+    index_parser = subparsers.add_parser(
+        "index",
+        formatter_class=HFQFormatter,
+        help="Index FASTQs for reading records by number",
+        description=(
+            "Write an index next to each FASTQ, with .fqi added to the file "
+            "name. With an index, subsample reads only the selected reads, "
+            "filter-seqids --keep-ids looks up a short list of IDs, and "
+            "--part splits the input at indexed records. The FASTQs must be "
+            "uncompressed or BGZF"
+        ),
+    )
+    index_parser.add_argument("fastqs", nargs="+", help="FASTQ files")
+    index_parser.add_argument(
+        "--interval",
+        type=int,
+        default=INDEX_INTERVAL,
+        help="Index every this many records",
+    )
+    index_parser.add_argument(
+        "--ids",
+        action="store_true",
+        help="Also index read IDs, for filter-seqids --keep-ids",
+    )
+    index_parser.add_argument(
+        "--threads",
+        type=int,
+        help="Threads for decompressing BGZF files (default: one per core)",
+    )
+    index_parser.set_defaults(func=index_subcommand)
+
+    generate_parser = subparsers.add_parser(
+        "generate",
+        formatter_class=HFQFormatter,
+        help="Write synthetic reads",
+        description=(
+            "Write random reads for load testing, with the same reads for "
+            "the same settings and seed. Give two output files for pairs"
+        ),
+    )
+    generate_parser.add_argument(
+        "--output", nargs="+", default=["-"], help="Output FASTQs, can be gzipped"
+    )
+    generate_parser.add_argument(
+        "--n", type=int, default=1000000, help="Number of reads or pairs"
+    )
+    generate_parser.add_argument(
+        "--length",
+        default="150",
+        help=(
+            "Read length: a fixed length, a uniform range as 100-150, or a "
+            "mean and standard deviation as 150~20 (default: 150)"
+        ),
+    )
+    generate_parser.add_argument(
+        "--quality-profile",
+        choices=QUALITY_PROFILES,
+        default="tail",
+        help=(
+            "How quality changes along the read: flat, falling linearly, or "
+            "falling over the last quarter (default: tail)"
+        ),
+    )
+    generate_parser.add_argument(
+        "--quality-start", type=int, default=37, help="Quality at the start"
+    )
+    generate_parser.add_argument(
+        "--quality-end", type=int, default=20, help="Quality at the end"
+    )
+    generate_parser.add_argument(
+        "--quality-noise",
+        type=float,
+        default=3.0,
+        help="Standard deviation of quality scores around the profile",
+    )
+    generate_parser.add_argument(
+        "--low-complexity",
+        type=float,
+        default=0.0,
+        help="Fraction of reads that are one- or two-base repeats",
+    )
+    generate_parser.add_argument(
+        "--duplicate-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of reads that copy an earlier read",
+    )
+    generate_parser.add_argument("--seed", type=int, help="Random seed")
+    generate_parser.add_argument(
+        "--prefix", default="read", help="Start of each read ID"
+    )
+    generate_parser.set_defaults(func=generate_subcommand)
+
     args = main_parser.parse_args(argv)
+    # These subcommands don't read FASTQ input and handle their own files
+    if args.func in (merge_reports_subcommand, index_subcommand, generate_subcommand):
+        args.func(args)
+        return
 
     # This closers list is a pretty convoluted mechanism to ensure that all opened files and pipes are closed after use
     # It handles everything from sys.stdin/out (no closing necessary) to subprocess pipes (need to close stream handlers and wait for process to end)
     # So we attach a closer function to each opened input/output file handler and call them all at the end
     closers = []
-    if args.input is None:
-        args.input = sys.stdin
-    else:
-        for i in args.input:
-            closers.append(i[1])
-        args.input = [i[0] for i in args.input]
-    if args.output is None:
-        args.output = sys.stdout
-    else:
-        for o in args.output:
-            closers.append(o[1])
-        args.output = [o[0] for o in args.output]
+    args.input_names = list(args.input)
     if args.threads is None:
         args.threads = 1
+    if args.part is not None:
+        if "-" in args.input:
+            main_parser.error("--part can't be used with stdin")
+        try:
+            parts = open_part(args.input, args.part[0] - 1, args.part[1], args.threads)
+        except (OSError, ValueError) as e:
+            main_parser.error(str(e))
+        args.input = [io.TextIOWrapper(f) for f in parts]
+        closers.extend(f.close for f in args.input)
+    else:
+        input_type = GzipFileType("r", threads=args.threads)
+        try:
+            inputs = [input_type(i) for i in args.input]
+        except argparse.ArgumentTypeError as e:
+            main_parser.error(str(e))
+        closers.extend(i[1] for i in inputs)
+        args.input = [i[0] for i in inputs]
+    args.input = [TimedReader(f) for f in args.input]
+    args.timing = {}
+    if args.shards < 1:
+        main_parser.error("--shards must be at least 1")
+    if args.shards > 1 and not all("{shard}" in o for o in args.output):
+        main_parser.error("with --shards, each --output must contain {shard}")
+    output_names = list(args.output)
+    output_type = GzipFileType("w", threads=args.threads)
+    width = len(str(args.shards - 1))
+    try:
+        args.output_shards = []
+        for shard in range(args.shards):
+            outputs = [
+                output_type(o.replace("{shard}", f"{shard:0{width}d}"))
+                for o in args.output
+            ]
+            closers.extend(o[1] for o in outputs)
+            args.output_shards.append(tuple(o[0] for o in outputs))
+    except argparse.ArgumentTypeError as e:
+        main_parser.error(str(e))
+    args.output = list(args.output_shards[0])
+    if args.chunk_size is not None and args.chunk_size < 1:
+        main_parser.error("--chunk-size must be at least 1")
+    # By default, the pipeline sets the chunks in flight from the threads
+    args.max_in_flight = None
+    if args.max_memory is not None:
+        try:
+            plan = plan_memory(
+                parse_memory_size(args.max_memory),
+                [mean_record_size(name) for name in args.input_names],
+                args.threads,
+                outputs=len(output_names) * args.shards,
+                chunk_size=args.chunk_size,
+                io_memory=sum(
+                    file_memory(name, "r", args.threads) for name in args.input_names
+                )
+                + args.shards
+                * sum(file_memory(name, "w", args.threads) for name in output_names),
+                processes=(
+                    args.threads
+                    if args.executor == "process" and args.threads > 1
+                    else 0
+                ),
+            )
+        except ValueError as e:
+            main_parser.error(f"--max-memory: {e}")
+        args.chunk_size = plan.chunk_size
+        args.max_in_flight = plan.max_in_flight
+    elif args.chunk_size is None:
+        args.chunk_size = DEFAULT_CHUNK_SIZE
+    if args.progress_interval <= 0:
+        main_parser.error("--progress-interval must be more than 0")
+    # Subcommands add the counters of their stages as they make them
+    args.progress_counters = {}
+    if args.progress is None:
+        heartbeat = nullcontext()
+    else:
+        if args.progress == "-":
+            progress_file = sys.stderr
+        else:
+            progress_file = open(args.progress, "w")
+            closers.append(progress_file.close)
+        heartbeat = Heartbeat(
+            progress_file, args.progress_counters, args.progress_interval
+        )
+
+    args.profiler = None if args.profile is None else Profiler()
+    # Stage functions, by name, with their batch versions
+    args.profile_functions = {}
+    if (
+        args.profiler is not None
+        and not THREADS_PROFILABLE
+        and args.executor == "thread"
+        and args.threads > 1
+    ):
+        print(
+            "Worker threads can't be profiled on this version of Python, "
+            "use --executor process to profile the workers",
+            file=sys.stderr,
+        )
 
     # Run the main logic
-    stats = args.func(args)
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    with heartbeat, args.profiler or nullcontext():
+        stats = args.func(args)
+    total = {
+        "wall_seconds": time.perf_counter() - start_wall,
+        "cpu_seconds": time.process_time() - start_cpu,
+    }
 
     # Construct report and write as json
     report = {"version": __version__}
-    for k, v in vars(args).items():
-        if k not in ("input", "output", "func", "idsfile", "report", "threads"):
-            report[k] = v
+    report.update(_report_options(args))
     report.update(stats)
+    report["timing"] = _timing_report(args, total)
+    if args.profiler is not None:
+        args.profiler.dump(args.profile)
+        report["profile"] = {
+            "threads_profiled": THREADS_PROFILABLE,
+            "stages": args.profiler.stage_summary(args.profile_functions),
+            "top": args.profiler.top(args.profile_top),
+        }
 
     if args.report is not None:
         report_file = open(args.report, "w")
@@ -380,4 +1113,5 @@ def heyfastq_main(argv=None):
 
     # Close all opened files/pipes
     for c in closers:
-        c()
+        if c is not None:
+            c()
@@ -0,0 +1,307 @@
+"""FASTQ index files, for reading records by number without a full scan
+
+The index of a FASTQ file is kept next to it, with ".fqi" added to the file
+name. It holds the offset of every record whose number is a multiple of the
+index interval, counting records from 0, along with the number of reads and
+bases in the file. To read record n, a reader seeks to the indexed record
+at or before n and skips the records in between.
+
+For BGZF files, the index also holds the virtual offset of each indexed
+record: the offset of its block in the compressed file, shifted left 16
+bits, plus its offset within the block. Reading starts at that block rather
+than at the start of the file.
+
+Optionally, the index can also hold the key of every read's ID, as used by
+SeqIdIndex, sorted and paired with the record number, so that reads can be
+looked up by ID.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+from itertools import accumulate, repeat
+import io
+import operator
+import os
+import struct
+import sys
+from typing import BinaryIO, Iterable, Iterator, Optional
+
+from .bgzf import BgzfReader, MAX_BLOCK_SIZE, block_offsets, is_bgzf
+from .idindex import encoded_id_keys
+from .read import Read
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+INDEX_SUFFIX = ".fqi"
+INDEX_INTERVAL = 256
+SCAN_BLOCK_SIZE = 1 << 22
+# Compressed data read at a time from BGZF files when seeking around
+SEEK_READ_SIZE = MAX_BLOCK_SIZE
+_MAGIC = b"FQI\x01"
+# Interval, reads, bases, file size, and the lengths of the arrays
+_HEADER = struct.Struct("<4s7Q")
+
+
+def _to_little_endian(a: array) -> bytes:
+    if sys.byteorder == "big":  # pragma: no cover
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes()
+
+
+def _from_little_endian(data: bytes) -> array:
+    a = array("Q", data)
+    if sys.byteorder == "big":  # pragma: no cover
+        a.byteswap()
+    return a
+
+
+def index_path(filename) -> str:
+    return os.fspath(filename) + INDEX_SUFFIX
+
+
+@dataclass
+class FastqIndex:
+    """Offsets of every interval-th record of a FASTQ file
+
+    offsets are uncompressed offsets. virtual_offsets are only filled in for
+    BGZF files, and keys and key_records only if IDs were indexed.
+    """
+
+    interval: int
+    num_reads: int
+    num_bases: int
+    file_size: int
+    offsets: array
+    virtual_offsets: array = field(default_factory=lambda: array("Q"))
+    keys: array = field(default_factory=lambda: array("Q"))
+    key_records: array = field(default_factory=lambda: array("Q"))
+
+    def write(self, filename) -> None:
+        arrays = [self.offsets, self.virtual_offsets, self.keys]
+        with open(filename, "wb") as f:
+            f.write(
+                _HEADER.pack(
+                    _MAGIC,
+                    self.interval,
+                    self.num_reads,
+                    self.num_bases,
+                    self.file_size,
+                    *map(len, arrays),
+                )
+            )
+            for a in arrays + [self.key_records]:
+                f.write(_to_little_endian(a))
+
+    @classmethod
+    def read(cls, filename) -> "FastqIndex":
+        with open(filename, "rb") as f:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size or header[:4] != _MAGIC:
+                raise ValueError(f"{filename} is not a FASTQ index file")
+            _, interval, reads, bases, size, *lengths = _HEADER.unpack(header)
+            arrays = []
+            for n in lengths + lengths[-1:]:
+                data = f.read(8 * n)
+                if len(data) < 8 * n:
+                    raise ValueError(f"FASTQ index file {filename} is truncated")
+                arrays.append(_from_little_endian(data))
+        return cls(interval, reads, bases, size, *arrays)
+
+    def records_for_keys(self, keys: Iterable[int]) -> list[int]:
+        """Sorted numbers of the records whose ID has one of the keys"""
+        records = []
+        for key in keys:
+            lo = bisect_left(self.keys, key)
+            hi = bisect_right(self.keys, key, lo)
+            records.extend(self.key_records[lo:hi])
+        return sorted(set(records))
+
+
+def _sorted_keys(keys: array) -> tuple[array, array]:
+    if np is not None:
+        keys_np = np.frombuffer(keys, dtype=np.uint64)
+        order = np.argsort(keys_np, kind="stable")
+        return (
+            array("Q", keys_np[order].tobytes()),
+            array("Q", order.astype(np.uint64).tobytes()),
+        )
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    return array("Q", (keys[i] for i in order)), array("Q", order)
+
+
+def _virtual_offsets(filename, offsets: array) -> array:
+    compressed, uncompressed = block_offsets(filename)
+    virtual_offsets = array("Q")
+    for offset in offsets:
+        block = bisect_right(uncompressed, offset) - 1
+        within = offset - uncompressed[block]
+        virtual_offsets.append(compressed[block] << 16 | within)
+    return virtual_offsets
+
+
+def _open_file(filename, threads: Optional[int] = None) -> BinaryIO:
+    with open(filename, "rb") as f:
+        magic = f.read(2)
+    if magic == b"\x1f\x8b":
+        if not is_bgzf(filename):
+            raise ValueError(f"can't index {filename}: gzip files must be BGZF")
+        return io.BufferedReader(BgzfReader(filename, threads))
+    if magic == b"\x28\xb5":
+        raise ValueError(f"can't index {filename}: zstd files aren't supported")
+    return open(filename, "rb")
+
+
+def build_index(
+    filename,
+    interval: int = INDEX_INTERVAL,
+    ids: bool = False,
+    threads: Optional[int] = None,
+) -> FastqIndex:
+    """Scan a plain or BGZF FASTQ file and index every interval-th record"""
+    if interval < 1:
+        raise ValueError("interval must be at least 1")
+    offsets = array("Q")
+    keys = array("Q")
+    num_lines = 0
+    num_bases = 0
+    # Offset of the first line in the next block
+    pos = 0
+    with _open_file(filename, threads) as f:
+        tail = b""
+        while True:
+            block = f.read(SCAN_BLOCK_SIZE)
+            data = tail + block
+            lines = data.split(b"\n")
+            # The last piece is the start of a line, or empty after a newline
+            tail = lines.pop()
+            if not block and tail:
+                lines.append(tail)
+            # Index of the first header line in this block
+            first = -num_lines % 4
+            seqs = lines[(1 - num_lines) % 4 :: 4]
+            num_bases += sum(map(len, seqs))
+            if b"\r" in data:
+                num_bases -= sum(s.endswith(b"\r") for s in seqs)
+            first_record = (num_lines + first) // 4
+            # Line number of the first indexed record in this block
+            skip = -first_record % interval
+            indexed = range(first + 4 * skip, len(lines), 4 * interval)
+            if indexed:
+                starts = list(
+                    accumulate(
+                        map(operator.add, map(len, lines), repeat(1)), initial=pos
+                    )
+                )
+                offsets.extend(starts[i] for i in indexed)
+            if ids:
+                descs = map(operator.itemgetter(slice(1, None)), lines[first::4])
+                seq_ids = map(operator.itemgetter(0), map(bytes.split, descs))
+                keys.extend(encoded_id_keys(seq_ids))
+            num_lines += len(lines)
+            pos += len(data) - len(tail)
+            if not block:
+                break
+    index = FastqIndex(
+        interval, (num_lines + 3) // 4, num_bases, os.path.getsize(filename), offsets
+    )
+    if is_bgzf(filename):
+        index.virtual_offsets = _virtual_offsets(filename, offsets)
+    if ids:
+        index.keys, index.key_records = _sorted_keys(keys)
+    return index
+
+
+def load_index(filename) -> Optional[FastqIndex]:
+    """Load the index of a FASTQ file, if there is one
+
+    Raises ValueError if the index doesn't match the file, which usually
+    means the file changed after it was indexed.
+    """
+    path = index_path(filename)
+    if not os.path.exists(path):
+        return None
+    index = FastqIndex.read(path)
+    if index.file_size != os.path.getsize(filename):
+        raise ValueError(f"index {path} is out of date, rebuild it with heyfastq index")
+    return index
+
+
+class IndexedFastq:
+    """A FASTQ file that can be read starting from any record"""
+
+    def __init__(
+        self,
+        filename,
+        index: Optional[FastqIndex] = None,
+        threads: Optional[int] = None,
+    ):
+        if index is None:
+            index = load_index(filename)
+            if index is None:
+                raise ValueError(
+                    f"{filename} has no index, make one with heyfastq index"
+                )
+        self.filename = filename
+        self.index = index
+        # Reads between seeks are short, so by default BGZF blocks are
+        # inflated in the calling thread
+        self.threads = 0 if threads is None else threads
+        self._f: Optional[BinaryIO] = None
+        # Number of the record at the current position
+        self._record = 0
+
+    def _seek(self, i: int) -> None:
+        """Move to the i-th indexed record"""
+        if not self.index.virtual_offsets:
+            if self._f is None:
+                self._f = open(self.filename, "rb")
+            self._f.seek(self.index.offsets[i])
+        else:
+            if self._f is not None:
+                self._f.close()
+            virtual_offset = self.index.virtual_offsets[i]
+            raw = BgzfReader(
+                self.filename,
+                self.threads,
+                read_size=SEEK_READ_SIZE,
+                start=virtual_offset >> 16,
+            )
+            self._f = io.BufferedReader(raw)
+            self._f.read(virtual_offset & 0xFFFF)
+        self._record = i * self.index.interval
+
+    def reads(self, records: Iterable[int], encoding: str = "utf-8") -> Iterator[Read]:
+        """Parse the records with the given numbers, in increasing order
+
+        Stops at the first record past the end of the file.
+        """
+        interval = self.index.interval
+        for n in records:
+            if n >= self.index.num_reads:
+                return
+            base = n - n % interval
+            if self._f is None or n < self._record or base > self._record:
+                self._seek(n // interval)
+            assert self._f is not None
+            for _ in range(4 * (n - self._record)):
+                self._f.readline()
+            lines = [self._f.readline() for _ in range(4)]
+            self._record = n + 1
+            desc, seq, _, qual = (line.decode(encoding).rstrip() for line in lines)
+            yield Read(desc[1:], seq, qual)
+
+    def close(self) -> None:
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def __enter__(self) -> "IndexedFastq":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
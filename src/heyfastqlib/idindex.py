@@ -0,0 +1,231 @@
+"""Compact set of sequence IDs for very large ID lists
+
+Rather than keeping every ID string in a set, SeqIdIndex keeps a sorted
+array of 64-bit keys and answers membership queries by binary search. A
+small directory of offsets, indexed by the top bits of the key, narrows the
+search to a handful of entries.
+
+The key of an ID is its CRC-32 in the high 32 bits and its Adler-32 in the
+low 32 bits. Both are computed in C, and unlike hash(), they are the same
+in every process. Different IDs can still have the same key, and Adler-32
+adds little for short IDs, so keys are only a prefilter. The IDs themselves
+are kept in the order they came, concatenated into one buffer, with the
+offset and length of each in key order, and every ID whose key matches is
+compared with the stored ID. That costs the bytes of each ID plus 20 bytes,
+less than half of a set of the same IDs. The buffer is never copied, so
+building the index takes little more than that.
+"""
+
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass
+import heapq
+from itertools import accumulate, islice, repeat
+import operator
+from typing import Iterable
+import zlib
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+# Average number of keys per directory bucket
+BUCKET_SIZE = 16
+MAX_DIRECTORY_BITS = 24
+KEY_CHUNK_SIZE = 1 << 16
+
+
+def id_key(seq_id: str) -> int:
+    b = seq_id.encode()
+    return (zlib.crc32(b) << 32) | zlib.adler32(b)
+
+
+def id_keys(seq_ids: Iterable[str]) -> array:
+    """Keys of many IDs, computed a chunk at a time without a Python loop"""
+    return encoded_id_keys(map(str.encode, seq_ids))
+
+
+def encoded_id_keys(seq_ids: Iterable[bytes]) -> array:
+    """Keys of many IDs that are already encoded"""
+    keys = array("Q")
+    it = iter(seq_ids)
+    while chunk := list(islice(it, KEY_CHUNK_SIZE)):
+        if np is not None:
+            # Shifting and combining is the slow part without NumPy
+            crcs = np.fromiter(map(zlib.crc32, chunk), np.uint64, len(chunk))
+            adlers = np.fromiter(map(zlib.adler32, chunk), np.uint64, len(chunk))
+            keys.frombytes(((crcs << np.uint64(32)) | adlers).tobytes())
+            continue
+        crcs = map(operator.lshift, map(zlib.crc32, chunk), repeat(32))
+        keys.extend(map(operator.or_, crcs, map(zlib.adler32, chunk)))
+    return keys
+
+
+def _encode_ids(seq_ids: Iterable[str]) -> tuple[bytearray, array, array]:
+    """Concatenated IDs, their lengths and their keys, in input order
+
+    IDs are encoded a chunk at a time, so that no list of all of them is
+    ever held.
+    """
+    blob = bytearray()
+    lengths = array("I")
+    keys = array("Q")
+    it = iter(seq_ids)
+    while chunk := [seq_id.encode() for seq_id in islice(it, KEY_CHUNK_SIZE)]:
+        blob += b"".join(chunk)
+        lengths.extend(map(len, chunk))
+        keys.extend(encoded_id_keys(chunk))
+    return blob, lengths, keys
+
+
+def _key_order(keys: array):
+    """Positions of keys in sorted order, keeping ties in input order"""
+    if np is not None:
+        return np.argsort(np.frombuffer(keys, dtype=np.uint64), kind="stable")
+    # Sort a chunk at a time and merge, so that only the sorted positions,
+    # not a list of them, are held for all the keys
+    chunks = [
+        array(
+            "Q",
+            sorted(range(i, min(i + KEY_CHUNK_SIZE, len(keys))), key=keys.__getitem__),
+        )
+        for i in range(0, len(keys), KEY_CHUNK_SIZE)
+    ]
+    return array("Q", heapq.merge(*chunks, key=keys.__getitem__))
+
+
+def _repeated(blob, starts, lengths, keys, order) -> list[int]:
+    """Positions in order that hold an ID already seen at an earlier one
+
+    Only positions with the same key as the one before can, so only those
+    are compared.
+    """
+    if np is not None:
+        sorted_keys = np.frombuffer(keys, dtype=np.uint64)[order]
+        candidates = (np.flatnonzero(sorted_keys[1:] == sorted_keys[:-1]) + 1).tolist()
+    else:
+        candidates = [
+            j for j in range(1, len(order)) if keys[order[j]] == keys[order[j - 1]]
+        ]
+
+    def seq_id(j):
+        i = int(order[j])
+        return blob[starts[i] : starts[i] + lengths[i]]
+
+    repeated: list[int] = []
+    for j in candidates:
+        k = j - 1
+        while k >= 0 and keys[order[k]] == keys[order[j]]:
+            if seq_id(k) == seq_id(j):
+                repeated.append(j)
+                break
+            k -= 1
+    return repeated
+
+
+def _take(values: array, order) -> array:
+    """values in the given order"""
+    taken = array(values.typecode)
+    if np is not None:
+        taken.frombytes(
+            np.frombuffer(values, dtype=values.typecode)[order].data.cast("B")
+        )
+    else:
+        taken.extend(map(values.__getitem__, order))
+    return taken
+
+
+def _directory(keys: array) -> tuple[array, int]:
+    bits = min(max((len(keys) // BUCKET_SIZE).bit_length(), 1), MAX_DIRECTORY_BITS)
+    shift = 64 - bits
+    if np is not None:
+        bounds = np.arange(1 << bits, dtype=np.uint64) << np.uint64(shift)
+        offsets = np.searchsorted(np.frombuffer(keys, dtype=np.uint64), bounds)
+        directory = array("Q", offsets.astype(np.uint64).tobytes())
+    else:
+        directory = array(
+            "Q", (bisect_left(keys, b << shift) for b in range(1 << bits))
+        )
+    directory.append(len(keys))
+    return directory, shift
+
+
+@dataclass(slots=True)
+class SeqIdIndex:
+    """Sorted 64-bit keys of sequence IDs, with the IDs and a directory
+
+    Keys in bucket b, the keys whose top bits are b, are found at
+    keys[directory[b]:directory[b + 1]]. The ID with keys[i] is the
+    id_lengths[i] bytes of ids from id_offsets[i], encoded as UTF-8. IDs
+    with the same key are next to each other.
+    """
+
+    keys: array
+    ids: bytearray
+    id_offsets: array
+    id_lengths: array
+    directory: array
+    shift: int
+
+    @classmethod
+    def from_ids(cls, seq_ids: Iterable[str]) -> "SeqIdIndex":
+        ids, lengths, keys = _encode_ids(seq_ids)
+        offsets = array("Q", accumulate(lengths, initial=0))
+        order = _key_order(keys)
+        repeated = _repeated(ids, offsets, lengths, keys, order)
+        if repeated:
+            if np is not None:
+                order = np.delete(order, repeated)
+            else:
+                skip = set(repeated)
+                order = array("Q", (i for j, i in enumerate(order) if j not in skip))
+        # Each array is put in key order in turn, so that only one is ever
+        # held twice
+        keys = _take(keys, order)
+        offsets = _take(offsets, order)
+        lengths = _take(lengths, order)
+        del order
+        directory, shift = _directory(keys)
+        return cls(keys, ids, offsets, lengths, directory, shift)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _matches(self, i: int, key: int, seq_id: bytes) -> bool:
+        """Whether seq_id is stored at or after i, among the IDs with key"""
+        keys, ids, offsets = self.keys, self.ids, self.id_offsets
+        while i < len(keys) and keys[i] == key:
+            if ids[offsets[i] : offsets[i] + self.id_lengths[i]] == seq_id:
+                return True
+            i += 1
+        return False
+
+    def __contains__(self, seq_id: str) -> bool:
+        b = seq_id.encode()
+        key = (zlib.crc32(b) << 32) | zlib.adler32(b)
+        bucket = key >> self.shift
+        i = bisect_left(
+            self.keys, key, self.directory[bucket], self.directory[bucket + 1]
+        )
+        return self._matches(i, key, b)
+
+    def contains_many(self, seq_ids: Iterable[str]) -> list[bool]:
+        """Check a whole list of IDs at once, using NumPy if available
+
+        Keys are looked up all together, and only the IDs whose key is
+        found are compared one by one.
+        """
+        if np is None or not self.keys:
+            return [seq_id in self for seq_id in seq_ids]
+        encoded = [seq_id.encode() for seq_id in seq_ids]
+        query = np.frombuffer(encoded_id_keys(encoded), dtype=np.uint64)
+        keys = np.frombuffer(self.keys, dtype=np.uint64)
+        idx = np.searchsorted(keys, query)
+        hit = np.zeros(len(query), dtype=bool)
+        has = idx < len(keys)
+        hit[has] = keys[idx[has]] == query[has]
+        found = [False] * len(query)
+        for i in np.flatnonzero(hit).tolist():
+            found[i] = self._matches(int(idx[i]), int(query[i]), encoded[i])
+        return found
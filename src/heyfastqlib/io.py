@@ -1,5 +1,37 @@
+from contextlib import contextmanager
+import io
+from itertools import chain
+from multiprocessing.pool import ThreadPool
+from queue import Queue
+from threading import Thread
+from .batch import (
+    Batch,
+    ReadBatch,
+    SerializedChunk,
+    count_batch_bases,
+    select_batch,
+    serialize_reads,
+)
+from .fqindex import IndexedFastq
 from .read import R, Read, ReadPair, ReadPipe
-from typing import Generator, Iterator, overload, TextIO, Union
+from .timing import Stopwatch, TimingDict, add_timing, timing_dict
+from typing import (
+    BinaryIO,
+    Generator,
+    Iterable,
+    Iterator,
+    Optional,
+    overload,
+    TextIO,
+    Union,
+)
+
+BLOCK_SIZE = 1 << 16
+COUNT_BLOCK_SIZE = 1 << 22
+# Chunks waiting to be written, per output file
+WRITE_QUEUE_SIZE = 2
+WRITE_CHUNK_SIZE = 1000
+SHARD_MODES = ("chunk", "read")
 
 
 def _grouper(iterable: Iterator[str], n: int) -> Iterator[tuple[str, ...]]:
@@ -9,7 +41,117 @@ def _grouper(iterable: Iterator[str], n: int) -> Iterator[tuple[str, ...]]:
     return zip(*args)
 
 
-def parse_fastq_single(f: TextIO) -> ReadPipe[Read]:
+def _binary_stream(f: Union[TextIO, BinaryIO]) -> Optional[BinaryIO]:
+    if isinstance(f, io.TextIOBase):
+        return getattr(f, "buffer", None)
+    return f
+
+
+def _record_lines(
+    f: Union[TextIO, BinaryIO], encoding: str = "utf-8", block_size: int = BLOCK_SIZE
+) -> Iterator[list[str]]:
+    """Read a stream in large blocks and yield lists of whole FASTQ records
+
+    Each block is cut at its last newline and decoded in one go. Lines that
+    don't make up a whole record are carried over to the next block. Lines
+    have trailing whitespace stripped, and every list yielded has a multiple
+    of four lines.
+    """
+    tail: Union[str, bytes] = b""
+    pending: list[str] = []
+    while True:
+        block = f.read(block_size)
+        if not block:
+            break
+        if tail:
+            block = tail + block
+        if isinstance(block, bytes):
+            cut = block.rfind(b"\n") + 1
+            text = block[:cut].decode(encoding)
+        else:
+            cut = block.rfind("\n") + 1
+            text = block[:cut]
+        tail = block[cut:]
+        lines = text.split("\n")
+        # The text ends with a newline, leaving an empty string at the end
+        lines.pop()
+        # As with text lines, trailing whitespace, such as the \r of Windows
+        # line endings, is dropped
+        lines = list(map(str.rstrip, lines))
+        if pending:
+            lines = pending + lines
+        n = len(lines) - len(lines) % 4
+        if n:
+            yield lines[:n] if n < len(lines) else lines
+        pending = lines[n:]
+    if tail:
+        if isinstance(tail, bytes):
+            tail = tail.decode(encoding)
+        pending.append(tail.rstrip())
+    if len(pending) == 4:
+        yield pending
+
+
+def parse_fastq_blocks(
+    f: BinaryIO, encoding: str = "utf-8", block_size: int = BLOCK_SIZE
+) -> ReadPipe[Read]:
+    """Parse FASTQ from a binary stream, reading it in large blocks"""
+    for lines in _record_lines(f, encoding, block_size):
+        descs = [desc[1:] for desc in lines[0::4]]
+        yield from map(Read, descs, lines[1::4], lines[3::4])
+
+
+def _lines_batch(lines: list[str], start: int, end: int) -> ReadBatch:
+    descs = [desc[1:] for desc in lines[start:end:4]]
+    return ReadBatch.from_columns(
+        descs, lines[start + 1 : end : 4], lines[start + 3 : end : 4]
+    )
+
+
+def _parse_batches_single(
+    f: Union[TextIO, BinaryIO], chunk_size: int
+) -> Iterator[ReadBatch]:
+    binary = _binary_stream(f)
+    encoding = getattr(f, "encoding", None) or "utf-8"
+    size = 4 * chunk_size
+    parts: list[list[str]] = []
+    buffered = 0
+    for lines in _record_lines(f if binary is None else binary, encoding):
+        parts.append(lines)
+        buffered += len(lines)
+        if buffered < size:
+            continue
+        lines = parts[0] if len(parts) == 1 else list(chain.from_iterable(parts))
+        n = len(lines) - len(lines) % size
+        for start in range(0, n, size):
+            yield _lines_batch(lines, start, start + size)
+        parts = [lines[n:]]
+        buffered = len(lines) - n
+    if buffered:
+        yield _lines_batch(list(chain.from_iterable(parts)), 0, buffered)
+
+
+def parse_fastq_batches(
+    fs: Union[tuple[TextIO], tuple[TextIO, TextIO]], chunk_size: int = 1000
+) -> Iterator[Batch]:
+    """Parse single or paired FASTQ files into batches of chunk_size reads"""
+    if len(fs) not in (1, 2):
+        raise ValueError("Only single or paired-end FASTQ files are supported.")
+    for b in zip(*(_parse_batches_single(f, chunk_size) for f in fs)):
+        n = min(map(len, b))
+        if any(len(rb) != n for rb in b):
+            # As with parse_fastq, stop at the end of the shorter file
+            b = select_batch(b, [True] * n + [False] * (max(map(len, b)) - n))
+        yield b
+
+
+def parse_fastq_single(f: Union[TextIO, BinaryIO]) -> ReadPipe[Read]:
+    binary = _binary_stream(f)
+    if binary is not None:
+        encoding = getattr(f, "encoding", None) or "utf-8"
+        yield from parse_fastq_blocks(binary, encoding)
+        return
+
     for desc, seq, _, qual in _grouper(f, 4):
         desc = desc.rstrip()[1:]
         seq = seq.rstrip()
@@ -27,7 +169,7 @@ def parse_fastq(
     fs: Union[tuple[TextIO], tuple[TextIO, TextIO]],
 ) -> Union[ReadPipe[Read], ReadPipe[ReadPair]]:
     if len(fs) == 1:
-        return parse_fastq_single(fs[0])
+        yield from parse_fastq_single(fs[0])
     elif len(fs) == 2:
         for rp in zip(parse_fastq_single(fs[0]), parse_fastq_single(fs[1])):
             yield rp
@@ -35,28 +177,278 @@ def parse_fastq(
         raise ValueError("Only single or paired-end FASTQ files are supported.")
 
 
+def parse_fastq_records(
+    filenames: list, records: Iterable[int], threads: Optional[int] = None
+) -> Union[ReadPipe[Read], ReadPipe[ReadPair]]:
+    """Parse only the given records, by number in increasing order
+
+    The files must be indexed with heyfastq index. Each file seeks to the
+    indexed record before each one, rather than reading every record.
+    """
+    if len(filenames) not in (1, 2):
+        raise ValueError("Only single or paired-end FASTQ files are supported.")
+    records = list(records)
+    fs = [IndexedFastq(name, threads=threads) for name in filenames]
+    try:
+        if len(fs) == 1:
+            yield from fs[0].reads(records)
+        else:
+            yield from zip(fs[0].reads(records), fs[1].reads(records))
+    finally:
+        for f in fs:
+            f.close()
+
+
 def write_fastq_record(f: TextIO, read: Read):
     f.write(f"@{read.desc}\n{read.seq}\n+\n{read.qual}\n")
 
 
+Chunk = Union[str, ReadBatch, list[Read]]
+
+
+def _format_chunk(chunk: Chunk) -> str:
+    if isinstance(chunk, str):
+        return chunk
+    if isinstance(chunk, ReadBatch):
+        return chunk.to_fastq()
+    return serialize_reads(chunk, 1)[0]
+
+
+class _BackgroundWriter:
+    """Formats and writes chunks of reads to one file in its own thread
+
+    Chunks are passed through a bounded queue, so the caller can work on
+    the next chunk while this one is written, but can't get more than
+    queue_size chunks ahead. If writing fails, the error is raised in the
+    caller on its next put() or on close().
+    """
+
+    def __init__(self, f: TextIO, queue_size: int):
+        self.f = f
+        self.queue: Queue = Queue(queue_size)
+        self.error: Optional[BaseException] = None
+        self.timing = timing_dict()
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        watch = Stopwatch(self.timing)
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                return
+            # After an error, keep taking chunks so the caller never blocks
+            if self.error is None:
+                try:
+                    with watch:
+                        self.f.write(_format_chunk(chunk))
+                except BaseException as e:
+                    self.error = e
+
+    def _check(self) -> None:
+        if self.error is not None:
+            raise self.error
+
+    def put(self, chunk: Chunk) -> None:
+        self._check()
+        self.queue.put(chunk)
+
+    def close(self) -> None:
+        self.queue.put(None)
+        self.thread.join()
+        self._check()
+
+
+class _InlineWriter:
+    def __init__(self, f: TextIO):
+        self.f = f
+        self.timing = timing_dict()
+        self._watch = Stopwatch(self.timing)
+
+    def put(self, chunk: Chunk) -> None:
+        with self._watch:
+            self.f.write(_format_chunk(chunk))
+
+    def close(self) -> None:
+        pass
+
+
+@contextmanager
+def _chunk_writers(fs, queue_size: int, timing: Optional[TimingDict] = None):
+    """One writer per file, running in the background if queue_size > 0
+
+    The time each writer spent formatting and writing is added to timing.
+    """
+    if queue_size > 0:
+        writers = [_BackgroundWriter(f, queue_size) for f in fs]
+    else:
+        writers = [_InlineWriter(f) for f in fs]
+    try:
+        yield writers
+    finally:
+        # Wait for every writer, then raise the first error from any of them
+        errors = []
+        for w in writers:
+            try:
+                w.close()
+            except BaseException as e:
+                errors.append(e)
+            if timing is not None:
+                add_timing(timing, w.timing)
+        if errors:
+            raise errors[0]
+
+
 def write_fastq(
-    fs: Union[tuple[TextIO], tuple[TextIO, TextIO]], reads: ReadPipe[R]
+    fs: Union[tuple[TextIO], tuple[TextIO, TextIO]],
+    reads: ReadPipe[R],
+    queue_size: int = WRITE_QUEUE_SIZE,
+    chunk_size: int = WRITE_CHUNK_SIZE,
+    timing: Optional[TimingDict] = None,
 ) -> None:
-    for r in reads:
-        if isinstance(r, Read) and len(fs) == 1:
-            write_fastq_record(fs[0], r)
-        elif isinstance(r, tuple) and len(fs) == 2:
-            write_fastq_record(fs[0], r[0])
-            write_fastq_record(fs[1], r[1])
-        else:
-            raise ValueError("Mixing paired/unpaired inputs with files")
+    """Write reads or read pairs, one writer thread per file
+
+    Reads are collected into chunks of chunk_size per file and handed to
+    the writers. With queue_size=0, everything is written in the calling
+    thread.
+    """
+    with _chunk_writers(fs, queue_size, timing) as writers:
+        chunks: list[list[Read]] = [[] for _ in fs]
+        for r in reads:
+            if isinstance(r, Read) and len(fs) == 1:
+                chunks[0].append(r)
+            elif isinstance(r, tuple) and len(fs) == 2:
+                chunks[0].append(r[0])
+                chunks[1].append(r[1])
+            else:
+                raise ValueError("Mixing paired/unpaired inputs with files")
+            if len(chunks[0]) >= chunk_size:
+                for w, chunk in zip(writers, chunks):
+                    w.put(chunk)
+                chunks = [[] for _ in fs]
+        if chunks[0]:
+            for w, chunk in zip(writers, chunks):
+                w.put(chunk)
+
 
+def write_fastq_batches(
+    fs: Union[tuple[TextIO], tuple[TextIO, TextIO]],
+    batches: Iterator[Union[Batch, SerializedChunk]],
+    queue_size: int = WRITE_QUEUE_SIZE,
+    timing: Optional[TimingDict] = None,
+) -> None:
+    """Write batches, one writer thread per file
+
+    Batches that were already serialized, one string per mate, are written
+    as they are, with one write per file. Each file gets the batches in the
+    same order, so mates stay in step. With queue_size=0, everything is
+    written in the calling thread.
+    """
+    with _chunk_writers(fs, queue_size, timing) as writers:
+        for b in batches:
+            if len(b) != len(fs):
+                raise ValueError("Mixing paired/unpaired inputs with files")
+            for w, rb in zip(writers, b):
+                w.put(rb)
+
+
+def _shard_parts(
+    b: Batch, first_index: int, num_shards: int
+) -> Iterator[tuple[int, Batch]]:
+    """Split a batch round-robin, read i of the whole output going to shard
+    i % num_shards. first_index is the index of the batch's first read."""
+    n = len(b[0])
+    for s in range(num_shards):
+        start = (s - first_index) % num_shards
+        if start >= n:
+            continue
+        keep = bytearray(n)
+        keep[start::num_shards] = b"\x01" * len(range(start, n, num_shards))
+        yield s, select_batch(b, keep)
+
+
+def write_fastq_shards(
+    shards: list[tuple[TextIO, ...]],
+    batches: Iterator[Batch],
+    by: str = "chunk",
+    queue_size: int = WRITE_QUEUE_SIZE,
+    timing: Optional[TimingDict] = None,
+) -> list[dict[str, int]]:
+    """Write batches across several sets of output files, one set per shard
 
-def count_reads(f: TextIO) -> int:
-    line_count = sum(1 for _ in f)
+    With by="chunk", whole batches go to the shards in turn. With by="read",
+    the reads are dealt out one at a time. Either way, both reads of a pair
+    go to the same shard. Returns the number of reads and bases written to
+    each shard.
+    """
+    if by not in SHARD_MODES:
+        raise ValueError(f"by must be one of {', '.join(SHARD_MODES)}")
+    num_shards = len(shards)
+    counters = [{"output_reads": 0, "output_bases": 0} for _ in shards]
+    files = [f for shard in shards for f in shard]
+    with _chunk_writers(files, queue_size, timing) as ws:
+        shard_writers = [
+            ws[i * len(shard) : (i + 1) * len(shard)] for i, shard in enumerate(shards)
+        ]
+        index = 0
+        for b in batches:
+            if len(b) != len(shards[0]):
+                raise ValueError("Mixing paired/unpaired inputs with files")
+            if by == "chunk":
+                parts = [(index % num_shards, b)]
+                index += 1
+            else:
+                parts = _shard_parts(b, index, num_shards)
+                index += len(b[0])
+            for s, part in parts:
+                for w, rb in zip(shard_writers[s], part):
+                    w.put(rb)
+                counters[s]["output_reads"] += len(part[0])
+                counters[s]["output_bases"] += count_batch_bases(part)
+    return counters
+
+
+def count_reads(f: Union[TextIO, BinaryIO], block_size: int = COUNT_BLOCK_SIZE) -> int:
+    """Count reads by counting newlines in large blocks of the raw stream"""
+    binary = _binary_stream(f)
+    stream = f if binary is None else binary
+    line_count = 0
+    last = None
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        line_count += block.count(b"\n" if isinstance(block, bytes) else "\n")
+        last = block[-1:]
+    if last is not None and last not in (b"\n", "\n"):
+        # The last line has no newline
+        line_count += 1
     return line_count // 4
 
 
+def count_fastq_reads(
+    fs: Union[tuple[TextIO], tuple[TextIO, TextIO]],
+    block_size: int = COUNT_BLOCK_SIZE,
+) -> int:
+    """Count reads in single or paired FASTQ files
+
+    Paired files are counted at the same time, one thread each, and must have
+    the same number of reads.
+    """
+    if len(fs) == 1:
+        return count_reads(fs[0], block_size)
+    elif len(fs) != 2:
+        raise ValueError("Only single or paired-end FASTQ files are supported.")
+    with ThreadPool(processes=len(fs)) as pool:
+        counts = pool.map(lambda f: count_reads(f, block_size), fs)
+    if counts[0] != counts[1]:
+        raise ValueError(
+            f"Paired FASTQ files have different numbers of reads: "
+            f"{counts[0]} and {counts[1]}"
+        )
+    return counts[0]
+
+
 def parse_seq_ids(f: TextIO) -> Generator[str, None, None]:
     for line in f:
         line = line.strip()
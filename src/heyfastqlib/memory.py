@@ -0,0 +1,179 @@
+"""Sizing chunks to fit a memory budget
+
+Most of the memory a run uses goes to the chunks of reads it holds at once:
+the chunk being parsed, the chunks in flight at the workers, each with its
+input and output, and the chunks queued for writing. Given a budget and the
+mean size of a FASTQ record, plan_memory picks the number of chunks in
+flight and the chunk size so that all of them fit. With worker processes,
+each also holds the chunk it's working on, and an interpreter of its own.
+
+The estimate is deliberately rough and on the high side. Python strings
+and lists cost more than the bytes of the reads they hold, which
+READ_OVERHEAD allows for, and BASE_MEMORY covers the interpreter itself.
+Compressed files take memory of their own when they're handled in this
+process rather than by pigz or the zstd program: BGZF files hold two pieces
+per thread in flight, and zstd files a context for each thread. file_memory
+estimates it for each file.
+"""
+
+from dataclasses import dataclass
+import os
+import re
+import shutil
+import stat
+from typing import Optional
+
+from .argparse_types import GZIP_MAGIC, ZSTD_MAGIC, GzipFileType, zstd, zstd_threads
+from .bgzf import BLOCK_DATA_SIZE, BLOCKS_PER_TASK, READ_SIZE, is_bgzf
+from .io import WRITE_QUEUE_SIZE, parse_fastq_single
+from .pipelines import IN_FLIGHT_PER_THREAD
+
+BASE_MEMORY = 64 << 20
+# Inflated size of BGZF data for each compressed byte, a little more than
+# FASTQ usually compresses by
+BGZF_INFLATE_RATIO = 5
+# A zstd context with its window, for reading a file or for each thread
+# writing one
+ZSTD_MEMORY = 32 << 20
+# A gzip file read without pigz or BGZF, which inflates a little at a time
+GZIP_MEMORY = 1 << 20
+# Bytes per read on top of the record itself, while it's parsed and held
+READ_OVERHEAD = 200
+# Record size to assume for input that can't be sampled, such as stdin
+DEFAULT_RECORD_SIZE = 400
+SAMPLE_READS = 1000
+MIN_CHUNK_SIZE = 100
+# The chunk size without a budget, and the most a budget picks by itself
+DEFAULT_CHUNK_SIZE = 1000
+_UNITS = {"": 0, "K": 10, "M": 20, "G": 30, "T": 40}
+
+
+def parse_memory_size(size: str) -> int:
+    """Parse a size in bytes, such as 500M or 2G, with binary units"""
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", size, re.IGNORECASE)
+    if m is None:
+        raise ValueError(f"invalid memory size: {size}")
+    return int(float(m.group(1)) * (1 << _UNITS[m.group(2).upper()]))
+
+
+def mean_record_size(filename: str, n: int = SAMPLE_READS) -> int:
+    """Mean size in bytes of the first n records of a FASTQ file
+
+    Returns DEFAULT_RECORD_SIZE for stdin, a pipe or an empty file.
+    """
+    # A pipe, such as from process substitution, can only be read once, and
+    # the reads taken here would be lost to the run itself
+    if filename == "-" or not stat.S_ISREG(os.stat(filename).st_mode):
+        return DEFAULT_RECORD_SIZE
+    # Only the start is read, so BGZF blocks are inflated as they're needed
+    f, close = GzipFileType("r", threads=0)(filename)
+    try:
+        total = 0
+        count = 0
+        for read in parse_fastq_single(f):
+            # The @, the + line, and the four newlines
+            total += len(read.desc) + len(read.seq) + len(read.qual) + 6
+            count += 1
+            if count == n:
+                break
+    finally:
+        if close is not None:
+            close()
+    return total // count if count else DEFAULT_RECORD_SIZE
+
+
+def _bgzf_reader_memory(filename: str, threads: int) -> int:
+    # Each piece in flight holds its compressed and inflated data, and one
+    # more is being read from. A small file has fewer pieces.
+    pieces = min(2 * threads + 1, os.path.getsize(filename) // READ_SIZE + 1)
+    return pieces * (1 + BGZF_INFLATE_RATIO) * READ_SIZE + READ_SIZE
+
+
+def _bgzf_writer_memory(threads: int) -> int:
+    # Each piece in flight holds its data and the deflated blocks, which are
+    # no larger, and one more piece is collected before it's sent
+    task_size = BLOCK_DATA_SIZE * BLOCKS_PER_TASK
+    return (4 * threads + 1) * task_size + READ_SIZE
+
+
+def file_memory(filename: str, mode: str, threads: int) -> int:
+    """Memory taken to read or write a file in this process, past its reads
+
+    Gzipped files piped through pigz and zstd files piped through the zstd
+    program take none here. threads is the threads given to GzipFileType.
+    """
+    if filename == "-":
+        return 0
+    if "r" in mode:
+        try:
+            if not stat.S_ISREG(os.stat(filename).st_mode):
+                # Reading the magic bytes would take them from the run
+                return 0
+            with open(filename, "rb") as f:
+                magic = f.read(4)
+        except FileNotFoundError:
+            return 0
+        gzipped = magic[:2] == GZIP_MAGIC
+        zstd_compressed = magic == ZSTD_MAGIC
+    else:
+        gzipped = filename.endswith(".gz")
+        zstd_compressed = filename.endswith(".zst")
+    if gzipped:
+        if shutil.which("pigz"):
+            return 0
+        if "r" not in mode:
+            return _bgzf_writer_memory(threads)
+        if is_bgzf(filename):
+            return _bgzf_reader_memory(filename, threads)
+        return GZIP_MEMORY
+    if zstd_compressed and zstd is not None:
+        if "r" in mode:
+            return ZSTD_MEMORY
+        return ZSTD_MEMORY * (zstd_threads(threads) or os.cpu_count() or 1)
+    return 0
+
+
+@dataclass
+class MemoryPlan:
+    chunk_size: int
+    max_in_flight: int
+
+
+def _chunks_held(max_in_flight: int, outputs: int) -> int:
+    # Chunks in flight hold their input and output, and one chunk is being
+    # parsed while another is written
+    return 2 * max_in_flight + WRITE_QUEUE_SIZE * outputs + 2
+
+
+def plan_memory(
+    max_memory: int,
+    record_sizes: list[int],
+    threads: int,
+    outputs: int = 1,
+    chunk_size: Optional[int] = None,
+    io_memory: int = 0,
+    processes: int = 0,
+) -> MemoryPlan:
+    """Pick a chunk size and number of chunks in flight within max_memory
+
+    record_sizes has the mean record size of each input file. outputs is
+    the number of output files, and io_memory the memory taken to read and
+    write all the files, from file_memory(). processes is the number of
+    worker processes, if any. The chunk size is no more than chunk_size, if
+    given, or DEFAULT_CHUNK_SIZE. With a tight budget, the chunks in flight
+    go down to one per thread before chunks get smaller than
+    MIN_CHUNK_SIZE. Raises ValueError if even that won't fit.
+    """
+    read_bytes = sum(size + READ_OVERHEAD for size in record_sizes)
+    base = BASE_MEMORY * (1 + processes) + io_memory
+    available = max_memory - base
+    largest = DEFAULT_CHUNK_SIZE if chunk_size is None else chunk_size
+    smallest = min(MIN_CHUNK_SIZE, largest)
+    for max_in_flight in [IN_FLIGHT_PER_THREAD * threads, threads]:
+        # Each worker process holds the input and output of its chunk
+        held = _chunks_held(max_in_flight, outputs) + 2 * processes
+        size = min(available // (held * read_bytes), largest)
+        if size >= smallest:
+            return MemoryPlan(size, max_in_flight)
+    needed = base + smallest * held * read_bytes
+    raise ValueError(f"needs at least {needed >> 20} MiB of memory")
@@ -1,10 +1,35 @@
+from collections import deque
+from dataclasses import dataclass, field
+from functools import partial
 from itertools import islice
+import multiprocessing
 from multiprocessing.pool import ThreadPool
-from typing import Callable, Iterable, Iterator
+from typing import Callable, Iterable, Iterator, Optional, Union
 
-from .read import count_bases, R, ReadPipe
+from .batch import (
+    BATCH_FUNCTIONS,
+    Batch,
+    SerializedChunk,
+    batch_reads,
+    count_batch_bases,
+    reads_batch,
+    select_batch,
+    serialize_batch,
+    serialize_reads,
+)
+from .profiling import Profiler, profiled_call
+from .read import count_bases, R, Read, ReadPipe
+from .timing import Stopwatch, TimingDict, add_timing, timing_dict
+from .util import stream_sample
 
 CounterDict = dict[str, int]
+PackedChunk = tuple[int, str]
+"""A chunk of reads packed into a single string, with the number of reads per
+record. This is how chunks travel to and from worker processes."""
+
+EXECUTORS = ("thread", "process")
+# Chunks sent to the workers and not yet taken back, per worker
+IN_FLIGHT_PER_THREAD = 2
 
 
 def _merge_counters(dest: CounterDict, src: CounterDict) -> None:
@@ -12,6 +37,22 @@ def _merge_counters(dest: CounterDict, src: CounterDict) -> None:
         dest[key] = dest.get(key, 0) + value
 
 
+def _merge_stage_counters(dests: list[CounterDict], srcs: list[CounterDict]) -> None:
+    for dest, src in zip(dests, srcs):
+        _merge_counters(dest, src)
+
+
+def _merge_stage_timings(
+    dests: list[TimingDict], srcs: list[TimingDict], serialize_timing=None
+) -> None:
+    """Add each stage's time on a chunk to its total. A worker that also
+    serialized its output reports the time for that last."""
+    for dest, src in zip(dests, srcs):
+        add_timing(dest, src)
+    if serialize_timing is not None and len(srcs) > len(dests):
+        add_timing(serialize_timing, srcs[-1])
+
+
 def _chunk_reads(rs: Iterable[R], chunk_size: int) -> Iterator[list[R]]:
     iterator = iter(rs)
     while True:
@@ -21,6 +62,28 @@ def _chunk_reads(rs: Iterable[R], chunk_size: int) -> Iterator[list[R]]:
         yield chunk
 
 
+def _pack_chunk(chunk: list[R]) -> PackedChunk:
+    mates = 2 if chunk and isinstance(chunk[0], tuple) else 1
+    fields: list[str] = []
+    for r in chunk:
+        for read in r if isinstance(r, tuple) else (r,):
+            fields.append(read.desc)
+            fields.append(read.seq)
+            fields.append(read.qual)
+    return mates, "\n".join(fields)
+
+
+def _unpack_chunk(packed: PackedChunk) -> list[R]:
+    mates, text = packed
+    if not text:
+        return []
+    fields = text.split("\n")
+    reads = [Read(*fields[i : i + 3]) for i in range(0, len(fields), 3)]
+    if mates == 1:
+        return reads
+    return list(zip(reads[0::2], reads[1::2]))
+
+
 def _filter_worker(
     args: tuple[list[R], Callable[[R], bool], dict],
 ) -> tuple[list[R], CounterDict]:
@@ -65,6 +128,339 @@ def _map_worker(
     return out, chunk_counter
 
 
+_STAGE_WORKERS: dict[str, Callable] = {"map": _map_worker, "filter": _filter_worker}
+
+StageSpec = tuple[str, Callable, dict]
+
+
+WorkerResult = tuple[list[CounterDict], list[TimingDict]]
+
+
+def _stages_worker(
+    args: tuple[list[R], list[StageSpec]],
+) -> tuple[list[R], WorkerResult]:
+    chunk, specs = args
+    counters: list[CounterDict] = []
+    timings: list[TimingDict] = []
+    for kind, f, kwargs in specs:
+        timing = timing_dict()
+        with Stopwatch(timing):
+            chunk, chunk_counter = _STAGE_WORKERS[kind]((chunk, f, kwargs))
+        counters.append(chunk_counter)
+        timings.append(timing)
+    return chunk, (counters, timings)
+
+
+def _timed_serialize(f: Callable, result: WorkerResult, *args) -> SerializedChunk:
+    timing = timing_dict()
+    with Stopwatch(timing):
+        out = f(*args)
+    result[1].append(timing)
+    return out
+
+
+def _mates(chunk: list[R]) -> int:
+    return len(chunk[0]) if chunk and isinstance(chunk[0], tuple) else 1
+
+
+def _serialized_stages_worker(
+    args: tuple[list[R], list[StageSpec]],
+) -> tuple[SerializedChunk, WorkerResult]:
+    out, result = _stages_worker(args)
+    return _timed_serialize(serialize_reads, result, out, _mates(args[0])), result
+
+
+def _process_worker(
+    args: tuple[PackedChunk, list[StageSpec]],
+) -> tuple[PackedChunk, WorkerResult]:
+    packed, specs = args
+    out, result = _stages_worker((_unpack_chunk(packed), specs))
+    return _pack_chunk(out), result
+
+
+def _serialized_process_worker(
+    args: tuple[PackedChunk, list[StageSpec]],
+) -> tuple[SerializedChunk, WorkerResult]:
+    packed, specs = args
+    return _serialized_stages_worker((_unpack_chunk(packed), specs))
+
+
+BatchStageSpec = tuple[str, Callable, Optional[Callable], dict]
+
+
+def _batch_stages_worker(
+    args: tuple[Batch, list[BatchStageSpec]],
+) -> tuple[Batch, WorkerResult]:
+    b, specs = args
+    mates = len(b)
+    # Stages without a batch version work on a list of reads. Consecutive
+    # stages of that kind share the list rather than converting back and forth.
+    # Converting counts towards the time of the stage that needed it.
+    rs: Optional[list] = None
+    counters: list[CounterDict] = []
+    timings: list[TimingDict] = []
+    for kind, f, batch_f, kwargs in specs:
+        timing = timing_dict()
+        with Stopwatch(timing):
+            if batch_f is None:
+                if rs is None:
+                    rs = batch_reads(b)
+                rs, chunk_counter = _STAGE_WORKERS[kind]((rs, f, kwargs))
+            else:
+                if rs is not None:
+                    b = reads_batch(rs, mates)
+                    rs = None
+                chunk_counter = {
+                    "input_reads": len(b[0]),
+                    "input_bases": count_batch_bases(b),
+                }
+                if kind == "filter":
+                    b = select_batch(b, batch_f(b, **kwargs))
+                else:
+                    b = batch_f(b, **kwargs)
+                chunk_counter["output_reads"] = len(b[0])
+                chunk_counter["output_bases"] = count_batch_bases(b)
+        counters.append(chunk_counter)
+        timings.append(timing)
+    if rs is not None:
+        with Stopwatch(timings[-1]):
+            b = reads_batch(rs, mates)
+    return b, (counters, timings)
+
+
+def _serialized_batch_stages_worker(
+    args: tuple[Batch, list[BatchStageSpec]],
+) -> tuple[SerializedChunk, WorkerResult]:
+    b, result = _batch_stages_worker(args)
+    return _timed_serialize(serialize_batch, result, b), result
+
+
+def _bounded_imap(pool, worker: Callable, tasks: Iterator, window: int) -> Iterator:
+    """Like pool.imap, but with at most window tasks in flight
+
+    pool.imap takes tasks as fast as it can, so with a slow consumer the
+    whole input can end up waiting in memory. Here the next task is only
+    taken once the oldest result has been handed on.
+    """
+    pending: deque = deque()
+    for task in tasks:
+        if len(pending) >= window:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(worker, (task,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+# Stage specs of the pipeline run by a worker process, set once as it starts
+_process_specs: Optional[list] = None
+
+# By the time a pipeline runs, writer, heartbeat and BGZF threads are going,
+# and forking then can leave a worker holding a lock that no thread will ever
+# release. Worker processes are started fresh instead, which is fine since
+# they get everything they need through _set_process_specs.
+PROCESS_START_METHOD = (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+
+def _set_process_specs(specs: list) -> None:
+    global _process_specs
+    _process_specs = specs
+
+
+def _process_pool(threads: int, specs: list):
+    context = multiprocessing.get_context(PROCESS_START_METHOD)
+    return context.Pool(threads, _set_process_specs, (specs,))
+
+
+def _process_task(worker: Callable, chunk):
+    return worker((chunk, _process_specs))
+
+
+def _imap(
+    worker: Callable,
+    chunks: Iterator,
+    specs: list,
+    threads: int,
+    executor: str,
+    profiler: Optional[Profiler] = None,
+    max_in_flight: Optional[int] = None,
+) -> Iterator:
+    """Run worker((chunk, specs)) on each chunk, in order"""
+    if threads == 1 or executor == "thread":
+        tasks = ((chunk, specs) for chunk in chunks)
+        if threads == 1:
+            yield from map(worker, tasks)
+            return
+        # A profiler sees worker threads as they start, without any help
+        with ThreadPool(processes=threads) as pool:
+            yield from _bounded_imap(
+                pool, worker, tasks, max_in_flight or IN_FLIGHT_PER_THREAD * threads
+            )
+        return
+    # Stage kwargs, such as a large SeqIdIndex, can be costly to pickle, so
+    # each worker process gets them once as it starts rather than with every
+    # chunk
+    task = partial(_process_task, worker)
+    if profiler is not None:
+        # Worker processes profile each task and send back the stats
+        task = partial(profiled_call, task)
+        with profiler.paused():
+            pool = _process_pool(threads, specs)
+    else:
+        pool = _process_pool(threads, specs)
+    with pool:
+        results = _bounded_imap(
+            pool, task, chunks, max_in_flight or IN_FLIGHT_PER_THREAD * threads
+        )
+        if profiler is None:
+            yield from results
+            return
+        for result, stats in results:
+            profiler.add(stats)
+            yield result
+
+
+def _check_options(
+    threads: int, chunk_size: int, executor: str, max_in_flight: Optional[int]
+) -> None:
+    if threads < 1:
+        raise ValueError("threads must be at least 1")
+    if max_in_flight is not None and max_in_flight < 1:
+        raise ValueError("max_in_flight must be at least 1")
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    if executor not in EXECUTORS:
+        raise ValueError(f"executor must be one of {', '.join(EXECUTORS)}")
+
+
+@dataclass(slots=True)
+class Stage:
+    """One map or filter step in a pipeline
+
+    batch_functions, if given, is used for this stage in place of the batch
+    functions given to run_batch_pipeline.
+    """
+
+    kind: str
+    f: Callable
+    counter: CounterDict
+    kwargs: dict = field(default_factory=dict)
+    timing: TimingDict = field(default_factory=timing_dict)
+    batch_functions: Optional[dict[Callable, Callable]] = None
+
+    def __post_init__(self):
+        if self.kind not in _STAGE_WORKERS:
+            raise ValueError(f"stage kind must be one of {', '.join(_STAGE_WORKERS)}")
+
+
+def run_pipeline(
+    rs: ReadPipe[R],
+    stages: list[Stage],
+    *,
+    threads: int = 1,
+    chunk_size: int = 1000,
+    executor: str = "thread",
+    serialize: bool = False,
+    serialize_timing: Optional[TimingDict] = None,
+    profiler: Optional[Profiler] = None,
+    max_in_flight: Optional[int] = None,
+) -> Union[ReadPipe[R], Iterator[SerializedChunk]]:
+    """
+    Run each chunk of reads through all stages, in order, in a single worker
+    task. Each stage keeps its own counter, and adds the time its worker
+    spent on each chunk to its timing.
+
+    With serialize=True, workers also format their output as FASTQ text and
+    each chunk comes back as one string per mate, ready for
+    write_fastq_batches. The time for that is added to serialize_timing.
+
+    With executor="process", stage functions and kwargs must be picklable.
+    A running Profiler sees worker threads by itself; pass it as profiler
+    to profile worker processes too.
+
+    At most max_in_flight chunks (by default IN_FLIGHT_PER_THREAD per
+    thread) are sent to the workers before the oldest comes back, so that
+    a slow consumer holds up the input rather than letting it pile up.
+    """
+    _check_options(threads, chunk_size, executor, max_in_flight)
+    specs = [(s.kind, s.f, s.kwargs) for s in stages]
+    stage_counters = [s.counter for s in stages]
+    stage_timings = [s.timing for s in stages]
+    chunks = _chunk_reads(rs, chunk_size)
+    if executor == "process" and threads > 1:
+        # Everything sent to worker processes is pickled, so ship each chunk
+        # as one string rather than a list of Read objects
+        packed = (_pack_chunk(chunk) for chunk in chunks)
+        if serialize:
+            worker = _serialized_process_worker
+        else:
+            worker = _process_worker
+        for out, (counters, timings) in _imap(
+            worker, packed, specs, threads, executor, profiler, max_in_flight
+        ):
+            _merge_stage_counters(stage_counters, counters)
+            _merge_stage_timings(stage_timings, timings, serialize_timing)
+            if serialize:
+                yield out
+            else:
+                yield from _unpack_chunk(out)
+    else:
+        worker = _serialized_stages_worker if serialize else _stages_worker
+        for out, (counters, timings) in _imap(
+            worker, chunks, specs, threads, executor, profiler, max_in_flight
+        ):
+            _merge_stage_counters(stage_counters, counters)
+            _merge_stage_timings(stage_timings, timings, serialize_timing)
+            if serialize:
+                yield out
+            else:
+                yield from out
+
+
+def stage_batch_function(stage: Stage, batch_functions: dict) -> Optional[Callable]:
+    """The batch version of a stage's function, if there is one"""
+    if stage.batch_functions is not None:
+        batch_functions = stage.batch_functions
+    return batch_functions.get(stage.f)
+
+
+def run_batch_pipeline(
+    batches: Iterable[Batch],
+    stages: list[Stage],
+    *,
+    threads: int = 1,
+    executor: str = "thread",
+    batch_functions: Optional[dict[Callable, Callable]] = None,
+    serialize: bool = False,
+    serialize_timing: Optional[TimingDict] = None,
+    profiler: Optional[Profiler] = None,
+    max_in_flight: Optional[int] = None,
+) -> Iterator[Union[Batch, SerializedChunk]]:
+    """
+    Like run_pipeline, but for batches from parse_fastq_batches. Stage
+    functions with an entry in batch_functions (BATCH_FUNCTIONS by default),
+    or in the stage's own batch_functions, work on whole batches; all others
+    are called once per read or pair.
+    """
+    _check_options(threads, 1, executor, max_in_flight)
+    if batch_functions is None:
+        batch_functions = BATCH_FUNCTIONS
+    specs = [
+        (s.kind, s.f, stage_batch_function(s, batch_functions), s.kwargs)
+        for s in stages
+    ]
+    stage_counters = [s.counter for s in stages]
+    stage_timings = [s.timing for s in stages]
+    worker = _serialized_batch_stages_worker if serialize else _batch_stages_worker
+    for out, (counters, timings) in _imap(
+        worker, iter(batches), specs, threads, executor, profiler, max_in_flight
+    ):
+        _merge_stage_counters(stage_counters, counters)
+        _merge_stage_timings(stage_timings, timings, serialize_timing)
+        yield out
+
+
 def filter_reads(
     rs: ReadPipe[R],
     f: Callable[[R], bool],
@@ -72,32 +468,21 @@ def filter_reads(
     *,
     threads: int = 1,
     chunk_size: int = 1000,
+    executor: str = "thread",
     **kwargs,
 ) -> ReadPipe[R]:
     """
     Primary filtering pipeline
-    """
-    if threads < 1:
-        raise ValueError("threads must be at least 1")
-    if chunk_size < 1:
-        raise ValueError("chunk_size must be at least 1")
 
-    if threads == 1:
-        for chunk in _chunk_reads(rs, chunk_size):
-            out_chunk, chunk_counter = _filter_worker((chunk, f, kwargs))
-            _merge_counters(counter, chunk_counter)
-            for r in out_chunk:
-                yield r
-        return
-
-    task_iter = ((chunk, f, kwargs) for chunk in _chunk_reads(rs, chunk_size))
-    with ThreadPool(processes=threads) as pool:
-        for out_chunk, chunk_counter in pool.imap(
-            _filter_worker, task_iter, chunksize=1
-        ):
-            _merge_counters(counter, chunk_counter)
-            for r in out_chunk:
-                yield r
+    With executor="process", f and kwargs must be picklable.
+    """
+    return run_pipeline(
+        rs,
+        [Stage("filter", f, counter, kwargs)],
+        threads=threads,
+        chunk_size=chunk_size,
+        executor=executor,
+    )
 
 
 def map_reads(
@@ -107,27 +492,53 @@ def map_reads(
     *,
     threads: int = 1,
     chunk_size: int = 1000,
+    executor: str = "thread",
     **kwargs,
 ) -> ReadPipe[R]:
     """
     Primary mapping pipeline
+
+    With executor="process", f and kwargs must be picklable.
     """
-    if threads < 1:
-        raise ValueError("threads must be at least 1")
-    if chunk_size < 1:
-        raise ValueError("chunk_size must be at least 1")
+    return run_pipeline(
+        rs,
+        [Stage("map", f, counter, kwargs)],
+        threads=threads,
+        chunk_size=chunk_size,
+        executor=executor,
+    )
 
-    if threads == 1:
-        for chunk in _chunk_reads(rs, chunk_size):
-            out_chunk, chunk_counter = _map_worker((chunk, f, kwargs))
-            _merge_counters(counter, chunk_counter)
-            for r in out_chunk:
-                yield r
-        return
 
-    task_iter = ((chunk, f, kwargs) for chunk in _chunk_reads(rs, chunk_size))
-    with ThreadPool(processes=threads) as pool:
-        for out_chunk, chunk_counter in pool.imap(_map_worker, task_iter, chunksize=1):
-            _merge_counters(counter, chunk_counter)
-            for r in out_chunk:
-                yield r
+def sample_reads(
+    rs: ReadPipe[R],
+    n: int,
+    counter: CounterDict,
+    *,
+    seed: Optional[int] = None,
+    keep_order: bool = False,
+) -> ReadPipe[R]:
+    """
+    Reservoir sampling pipeline
+
+    Reads the whole input once, holding at most n reads in memory, then
+    yields the sample. With the same seed, the reads are the ones that
+    sample_indexes picks after counting the reads.
+    """
+    # The input is counted as it's read, so that progress shows while the
+    # whole input goes through
+    counter.setdefault("input_reads", 0)
+    counter.setdefault("input_bases", 0)
+
+    def counted(rs: ReadPipe[R]) -> ReadPipe[R]:
+        for r in rs:
+            counter["input_reads"] += 1
+            counter["input_bases"] += count_bases(r)
+            yield r
+
+    sample = stream_sample(counted(rs), n, seed, keep_order)
+    output_counter: CounterDict = {
+        "output_reads": len(sample),
+        "output_bases": sum(map(count_bases, sample)),
+    }
+    _merge_counters(counter, output_counter)
+    yield from sample
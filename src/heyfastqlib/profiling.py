@@ -0,0 +1,153 @@
+"""Profiling a run across the main thread and its workers
+
+cProfile only sees the thread that turns it on, so a plain python -m
+cProfile misses the work done in worker threads and processes. A Profiler
+runs one cProfile profiler in the main thread and starts another in each
+new thread as it begins. Worker processes profile each task they run and
+send the stats back with its result. Everything is then added up into one
+set of pstats stats.
+
+From Python 3.12, cProfile can only be on in one thread at a time, so worker
+threads aren't profiled there. Worker processes still are.
+"""
+
+import cProfile
+from contextlib import contextmanager
+import pstats
+import sys
+import threading
+from typing import Any, Callable, Iterator, Optional
+
+PROFILE_TOP = 20
+# Whether cProfile can run in several threads at once
+THREADS_PROFILABLE = sys.version_info < (3, 12)
+
+# Raw stats as made by cProfile: function key to call counts and times
+RawStats = dict[tuple[str, int, str], tuple]
+
+
+class _RawStatsSource:
+    """Raw stats in the form that pstats.Stats.add takes"""
+
+    def __init__(self, stats: RawStats):
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+def profiled_call(f: Callable, arg: Any) -> tuple[Any, RawStats]:
+    """Call f(arg) under its own profiler and return the result with the stats"""
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        result = f(arg)
+    finally:
+        profile.disable()
+    profile.create_stats()
+    return result, profile.stats
+
+
+def _function_key(f: Callable) -> Optional[tuple[str, int, str]]:
+    code = getattr(f, "__code__", None)
+    if code is None:
+        return None
+    return (code.co_filename, code.co_firstlineno, code.co_name)
+
+
+def _function_name(key: tuple[str, int, str]) -> str:
+    return pstats.func_std_string(key)
+
+
+class Profiler:
+    """cProfile stats for the main thread and every worker"""
+
+    def __init__(self):
+        self._main = cProfile.Profile()
+        self._profiles: list[cProfile.Profile] = []
+        self._raw: list[RawStats] = []
+        self._lock = threading.Lock()
+        self.stats: Optional[pstats.Stats] = None
+
+    def _start_thread(self, *_) -> None:
+        # Called on the first profile event in each new thread
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        profile.enable()
+        with self._lock:
+            self._profiles.append(profile)
+
+    def add(self, stats: RawStats) -> None:
+        """Add stats from a worker process"""
+        with self._lock:
+            self._raw.append(stats)
+
+    def start(self) -> None:
+        if THREADS_PROFILABLE:
+            threading.setprofile(self._start_thread)
+        self._main.enable()
+
+    def stop(self) -> None:
+        self._main.disable()
+        threading.setprofile(None)
+        stats = pstats.Stats(self._main)
+        with self._lock:
+            for source in self._profiles:
+                stats.add(source)
+            for raw in self._raw:
+                stats.add(_RawStatsSource(raw))
+        self.stats = stats
+
+    @contextmanager
+    def paused(self) -> Iterator[None]:
+        """Turn off the main thread's profiler, so that forked worker
+        processes don't start with it on"""
+        self._main.disable()
+        try:
+            yield
+        finally:
+            self._main.enable()
+
+    def __enter__(self) -> "Profiler":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def dump(self, filename) -> None:
+        """Write the stats to a file that pstats and snakeviz can read"""
+        assert self.stats is not None
+        self.stats.dump_stats(filename)
+
+    def stage_summary(self, stage_functions: dict[str, list[Callable]]) -> dict:
+        """Calls and time for each stage, over the functions that run it"""
+        assert self.stats is not None
+        raw = self.stats.stats
+        summary = {}
+        for name, fs in stage_functions.items():
+            calls, tottime, cumtime = 0, 0.0, 0.0
+            for f in fs:
+                entry = raw.get(_function_key(f))
+                if entry is not None:
+                    calls += entry[1]
+                    tottime += entry[2]
+                    cumtime += entry[3]
+            summary[name] = {"calls": calls, "tottime": tottime, "cumtime": cumtime}
+        return summary
+
+    def top(self, n: int = PROFILE_TOP) -> list[dict]:
+        """The n functions with the most time spent in them, not counting
+        the functions they call"""
+        assert self.stats is not None
+        raw = self.stats.stats
+        keys = sorted(raw, key=lambda k: raw[k][2], reverse=True)[:n]
+        return [
+            {
+                "function": _function_name(key),
+                "calls": raw[key][1],
+                "tottime": raw[key][2],
+                "cumtime": raw[key][3],
+            }
+            for key in keys
+        ]
@@ -0,0 +1,108 @@
+"""Progress lines written while a long run goes on
+
+A Heartbeat runs in a background thread and writes one line of JSON at a
+fixed interval, with the number of reads processed so far, the reads per
+second since the last line, the share of reads that passed each stage, and
+the time since the run started. It reads the stage counters that the
+pipeline keeps up to date as chunks come back from the workers, so the
+pipeline itself never waits on it. The values are copied without a lock,
+and may be a chunk out of step with each other.
+"""
+
+import json
+import threading
+import time
+from typing import Optional, TextIO
+
+from .pipelines import CounterDict
+
+PROGRESS_INTERVAL = 10.0
+
+
+def _pass_rate(counter: CounterDict) -> Optional[float]:
+    input_reads = counter.get("input_reads", 0)
+    if not input_reads or "output_reads" not in counter:
+        return None
+    return counter["output_reads"] / input_reads
+
+
+class Heartbeat:
+    """Write progress as JSON lines to f every interval seconds
+
+    counters maps stage names to their counters. It can be filled in after
+    the heartbeat starts, as the stages are made. A last line is written
+    when the heartbeat stops, with done set to true unless the run failed.
+    """
+
+    def __init__(
+        self,
+        f: TextIO,
+        counters: dict[str, CounterDict],
+        interval: float = PROGRESS_INTERVAL,
+    ):
+        if interval <= 0:
+            raise ValueError("interval must be more than 0")
+        self.f = f
+        self.counters = counters
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start = 0.0
+        self._last_time = 0.0
+        self._last_reads = 0
+
+    def reads(self) -> int:
+        """Reads processed so far, which is the most that any stage has seen"""
+        counters = list(self.counters.values())
+        return max((c.get("input_reads", 0) for c in counters), default=0)
+
+    def status(self, done: bool = False) -> dict:
+        now = time.perf_counter()
+        reads = self.reads()
+        seconds = now - self._last_time
+        rate = (reads - self._last_reads) / seconds if seconds > 0 else 0.0
+        self._last_time = now
+        self._last_reads = reads
+        stages = {}
+        for name, counter in list(self.counters.items()):
+            counter = dict(counter)
+            stages[name] = {
+                "input_reads": counter.get("input_reads", 0),
+                "output_reads": counter.get("output_reads", 0),
+                "pass_rate": _pass_rate(counter),
+            }
+        return {
+            "elapsed_seconds": round(now - self._start, 3),
+            "reads": reads,
+            "reads_per_second": round(rate, 1),
+            "stages": stages,
+            "done": done,
+        }
+
+    def _write(self, done: bool = False) -> None:
+        self.f.write(json.dumps(self.status(done)) + "\n")
+        self.f.flush()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._write()
+
+    def start(self) -> None:
+        self._start = self._last_time = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, done: bool = True) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._write(done)
+
+    def __enter__(self) -> "Heartbeat":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, *exc) -> None:
+        self.stop(done=exc_type is None)
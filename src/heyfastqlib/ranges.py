@@ -0,0 +1,229 @@
+"""Reading one part of a FASTQ file, or a pair of files, by byte range
+
+To split the work on a big input across several processes, each process
+opens the same files with open_part() and gets its own part of the reads.
+Part k of n starts at the first record at or after k/n of the way through
+the first file. Records are found by looking for a line that starts with
+"@" followed two lines later by a line that starts with "+". A quality line
+can start with "@", but the line two after it is a sequence, so this can't
+be mistaken for a record. Every record belongs to exactly one part.
+
+For paired files, the second file is split at the same record numbers as
+the first, which takes a scan for newlines through the first file up to the
+end of the part, and likewise through the second file.
+
+If every file has an index from heyfastq index, parts start at indexed
+records instead, with no scanning.
+
+Plain files are split by offset. BGZF files are split by offset in the
+uncompressed data, and reading starts at the block holding the offset.
+Other compressed files can't be split.
+"""
+
+from bisect import bisect_right
+import io
+from typing import BinaryIO, Optional
+
+from .argparse_types import GZIP_MAGIC, ZSTD_MAGIC
+from .bgzf import BgzfReader, block_offsets, is_bgzf
+from .fqindex import FastqIndex, load_index
+
+SCAN_BLOCK_SIZE = 1 << 22
+
+
+class _FastqFile:
+    """A plain or BGZF file that can be opened at any uncompressed offset"""
+
+    def __init__(self, filename, threads: Optional[int] = None):
+        self.filename = filename
+        self.threads = threads
+        with open(filename, "rb") as f:
+            magic = f.read(4)
+        if magic[:2] == GZIP_MAGIC:
+            if not is_bgzf(filename):
+                raise ValueError(f"can't split {filename}: gzip files must be BGZF")
+            self.compressed, self.uncompressed = block_offsets(filename)
+            self.size = self.uncompressed[-1]
+        elif magic == ZSTD_MAGIC:
+            raise ValueError(f"can't split {filename}: zstd files aren't supported")
+        else:
+            self.compressed = self.uncompressed = None
+            with open(filename, "rb") as f:
+                self.size = f.seek(0, io.SEEK_END)
+
+    def open_at(self, offset: int) -> BinaryIO:
+        if self.uncompressed is None:
+            f = open(self.filename, "rb")
+            f.seek(offset)
+            return f
+        block = bisect_right(self.uncompressed, offset) - 1
+        raw = BgzfReader(self.filename, self.threads, start=self.compressed[block])
+        f = io.BufferedReader(raw)
+        skip = offset - self.uncompressed[block]
+        while skip:
+            skipped = len(f.read(min(skip, SCAN_BLOCK_SIZE)))
+            if not skipped:
+                break
+            skip -= skipped
+        return f
+
+    def record_start(self, offset: int) -> int:
+        """Offset of the first record that starts at or after offset"""
+        if offset <= 0:
+            return 0
+        if offset >= self.size:
+            return self.size
+        with self.open_at(offset - 1) as f:
+            # Skip to the start of the next line
+            pos = offset - 1 + len(f.readline())
+            lines: list[bytes] = []
+            starts: list[int] = []
+            while True:
+                while len(lines) < 3:
+                    line = f.readline()
+                    if not line:
+                        return self.size
+                    starts.append(pos)
+                    lines.append(line)
+                    pos += len(line)
+                if lines[0].startswith(b"@") and lines[2].startswith(b"+"):
+                    return starts[0]
+                del lines[0], starts[0]
+
+    def newline_offsets(self, counts: list[int]) -> list[int]:
+        """Offset just after the nth newline, for each n in sorted counts
+
+        Past the end of the file, the offset is the size of the file.
+        """
+        offsets = []
+        pending = iter(counts)
+        target = next(pending, None)
+        while target is not None and target == 0:
+            offsets.append(0)
+            target = next(pending, None)
+        if target is None:
+            return offsets
+        seen = 0
+        pos = 0
+        with self.open_at(0) as f:
+            while target is not None:
+                block = f.read(SCAN_BLOCK_SIZE)
+                if not block:
+                    break
+                block_newlines = block.count(b"\n")
+                i = -1
+                while target is not None and seen + block_newlines >= target:
+                    for _ in range(target - seen):
+                        i = block.find(b"\n", i + 1)
+                    block_newlines -= target - seen
+                    seen = target
+                    offsets.append(pos + i + 1)
+                    target = next(pending, None)
+                seen += block_newlines
+                pos += len(block)
+        offsets.extend(self.size for _ in range(len(counts) - len(offsets)))
+        return offsets
+
+    def count_newlines(self, offsets: list[int]) -> list[int]:
+        """Number of newlines before each of the sorted offsets"""
+        counts = []
+        seen = 0
+        pos = 0
+        with self.open_at(0) as f:
+            for offset in offsets:
+                while pos < offset:
+                    block = f.read(min(offset - pos, SCAN_BLOCK_SIZE))
+                    if not block:
+                        break
+                    seen += block.count(b"\n")
+                    pos += len(block)
+                counts.append(seen)
+        return counts
+
+
+class _RangeReader(io.RawIOBase):
+    """Raw stream of the next n bytes of another binary stream"""
+
+    def __init__(self, f: BinaryIO, n: int):
+        self._f = f
+        self._remaining = n
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if self._remaining <= 0:
+            return 0
+        data = self._f.read(min(len(b), self._remaining))
+        n = len(data)
+        b[:n] = data
+        self._remaining -= n
+        return n
+
+    def close(self) -> None:
+        if not self.closed:
+            self._f.close()
+        super().close()
+
+
+def _indexed_part_ranges(
+    files: list[_FastqFile], indexes: list[FastqIndex], part: int, parts: int
+) -> list[tuple[int, int]]:
+    num_indexed = len(indexes[0].offsets)
+    # Split the indexed records evenly
+    start = num_indexed * part // parts
+    end = num_indexed * (part + 1) // parts
+    return [
+        (
+            index.offsets[start] if start < num_indexed else f.size,
+            index.offsets[end] if end < num_indexed else f.size,
+        )
+        for f, index in zip(files, indexes)
+    ]
+
+
+def _part_ranges(
+    files: list[_FastqFile], part: int, parts: int
+) -> list[tuple[int, int]]:
+    if parts < 1 or not 0 <= part < parts:
+        raise ValueError("part must be between 0 and parts - 1")
+    try:
+        indexes = [load_index(f.filename) for f in files]
+    except ValueError:
+        indexes = [None]
+    if all(indexes) and len({(i.num_reads, i.interval) for i in indexes}) == 1:
+        return _indexed_part_ranges(files, indexes, part, parts)
+    first = files[0]
+    start = first.record_start(first.size * part // parts)
+    end = first.record_start(first.size * (part + 1) // parts)
+    ranges = [(start, end)]
+    if len(files) > 1:
+        # Align the other files by record number, four lines per record
+        line_counts = first.count_newlines([start, end])
+        for f in files[1:]:
+            f_start, f_end = f.newline_offsets(line_counts)
+            # The last line of a file may have no newline
+            if end == first.size:
+                f_end = f.size
+            ranges.append((f_start, f_end))
+    return ranges
+
+
+def part_ranges(
+    filenames: list, part: int, parts: int, threads: Optional[int] = None
+) -> list[tuple[int, int]]:
+    """Uncompressed byte range of each file for part (counting from 0) of
+    parts. The ranges start and end on record boundaries."""
+    return _part_ranges([_FastqFile(name, threads) for name in filenames], part, parts)
+
+
+def open_part(
+    filenames: list, part: int, parts: int, threads: Optional[int] = None
+) -> list[BinaryIO]:
+    """Open part (counting from 0) of parts of each FASTQ file as a binary
+    stream"""
+    files = [_FastqFile(name, threads) for name in filenames]
+    return [
+        io.BufferedReader(_RangeReader(f.open_at(start), end - start))
+        for f, (start, end) in zip(files, _part_ranges(files, part, parts))
+    ]
@@ -1,6 +1,6 @@
 from dataclasses import dataclass
 import operator
-from typing import Callable, Generator, Tuple, TypeVar
+from typing import Callable, Container, Generator, Tuple, TypeVar
 from .seqs import kscore
 from .util import sliding_sum
 
@@ -71,16 +71,16 @@ def length_ok(r: R, threshold: int = 100, cmp: Callable = operator.ge) -> bool:
         return all(length_ok(read, threshold=threshold, cmp=cmp) for read in r)
 
 
-def seq_id_ok(r: R, seq_ids: set[str] = set(), keep: bool = False) -> bool:
+def seq_id_ok(r: R, seq_ids: Container[str] = set(), keep: bool = False) -> bool:
     if isinstance(r, Read):
-        ids = set([seq_id(r)])
+        found = [seq_id(r) in seq_ids]
     elif isinstance(r, tuple):
-        ids = set([seq_id(read) for read in r])
+        found = [seq_id(read) in seq_ids for read in r]
 
     if keep:
-        return all(id in seq_ids for id in ids)
+        return all(found)
     else:
-        return all(id not in seq_ids for id in ids)
+        return not any(found)
 
 
 def trim_read_moving_average(read: Read, k: int = 4, threshold: int = 15) -> Read:
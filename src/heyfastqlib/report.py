@@ -0,0 +1,54 @@
+"""Merging the reports of runs over separate parts of the same input
+
+Counters, the dicts of read and base counts, are added up. Everything else,
+such as the version and the options, must be the same in every report. The
+part number, timing and profile of each run are dropped.
+"""
+
+from typing import Any
+
+# Top-level keys that differ between parts and are left out of the merged
+# report
+MERGE_EXCLUDE = ("part", "timing", "profile")
+
+
+def _is_counter(value: Any) -> bool:
+    return (
+        isinstance(value, dict)
+        and bool(value)
+        and all(isinstance(v, int) and not isinstance(v, bool) for v in value.values())
+    )
+
+
+def _merge(values: list, path: str) -> Any:
+    first = values[0]
+    if all(_is_counter(v) for v in values):
+        merged: dict = {}
+        for counter in values:
+            for k, v in counter.items():
+                merged[k] = merged.get(k, 0) + v
+        return merged
+    if isinstance(first, dict):
+        if any(not isinstance(v, dict) or v.keys() != first.keys() for v in values):
+            raise ValueError(f"reports have different keys at {path or 'top level'}")
+        return {
+            k: _merge([v[k] for v in values], f"{path}/{k}")
+            for k in first
+            if path or k not in MERGE_EXCLUDE
+        }
+    if isinstance(first, list):
+        if any(not isinstance(v, list) or len(v) != len(first) for v in values):
+            raise ValueError(f"reports have lists of different lengths at {path}")
+        return [
+            _merge(list(items), f"{path}/{i}") for i, items in enumerate(zip(*values))
+        ]
+    if any(v != first for v in values):
+        raise ValueError(f"reports have different values at {path}")
+    return first
+
+
+def merge_reports(reports: list[dict]) -> dict:
+    """Merge reports from runs over parts of the same input into one"""
+    if not reports:
+        raise ValueError("no reports to merge")
+    return _merge(reports, "")
@@ -1,8 +1,62 @@
+_AMBIGUOUS = 255
+_BASE_CODES = bytes(
+    {ord("A"): 0, ord("C"): 1, ord("G"): 2, ord("T"): 3}.get(i, _AMBIGUOUS)
+    for i in range(256)
+)
+
+
 def kmers(seq, k=4):
     n_kmers = len(seq) - k + 1
     for i in range(n_kmers):
         yield seq[i : (i + k)]
 
 
+def encode_bases(seq):
+    """Encode A, C, G and T as 0-3 and every other character as 255"""
+    return seq.encode("ascii", "replace").translate(_BASE_CODES)
+
+
+def count_kmers(seq, k=4):
+    """Count distinct k-mers in seq
+
+    Each k-mer is packed 2 bits per base into an integer that is updated as
+    the window rolls along the sequence, so no substrings are created. K-mers
+    containing anything other than A, C, G or T can't be packed and are
+    compared as strings instead, the same way kmers() would.
+    """
+    if k < 1:
+        raise ValueError("k must be at least 1")
+    if len(seq) < k:
+        return 0
+    codes = encode_bases(seq)
+    mask = (1 << (2 * k)) - 1
+    seen = set()
+    add = seen.add
+    h = 0
+    if _AMBIGUOUS not in codes:
+        for c in codes[: k - 1]:
+            h = (h << 2) | c
+        for c in codes[k - 1 :]:
+            h = ((h << 2) | c) & mask
+            add(h)
+        return len(seen)
+
+    ambiguous = set()
+    # Number of unambiguous bases at the end of the current window
+    run = 0
+    for i, c in enumerate(codes):
+        if c == _AMBIGUOUS:
+            run = 0
+        else:
+            h = ((h << 2) | c) & mask
+            run += 1
+        if i >= k - 1:
+            if run >= k:
+                add(h)
+            else:
+                ambiguous.add(seq[i - k + 1 : i + 1])
+    return len(seen) + len(ambiguous)
+
+
 def kscore(seq, k=4):
-    return len(set(kmers(seq))) / len(seq)
+    return count_kmers(seq, k=k) / len(seq)
@@ -0,0 +1,205 @@
+"""Synthetic FASTQ reads for load testing and benchmarks
+
+Reads are made a chunk at a time. The bases for a whole chunk come from a
+single call to randbytes(), mapped onto ACGT with bytes.translate(), and
+then cut up into reads. Quality strings are cut from a pool of noisy
+quality lines made up front. Each chunk is built as FASTQ text in one go,
+so that the generator keeps well ahead of heyfastq itself.
+
+With the same settings and seed, the same reads come out every time.
+"""
+
+from dataclasses import dataclass, field
+from itertools import accumulate
+import random
+from typing import Iterator, Optional
+
+from .batch import SerializedChunk
+
+CHUNK_SIZE = 10000
+# Number of quality lines to choose from, one for each byte value
+QUALITY_POOL_SIZE = 256
+QUALITY_OFFSET = 33
+MAX_QUALITY = 41
+LENGTH_KINDS = ("fixed", "uniform", "normal")
+QUALITY_PROFILES = ("flat", "linear", "tail")
+_BASES = bytes(b"ACGT"[i % 4] for i in range(256))
+
+
+@dataclass
+class LengthDistribution:
+    """Distribution of read lengths
+
+    fixed: every read is a bases long. uniform: lengths from a to b. normal:
+    mean a and standard deviation b, rounded and kept at 1 or more.
+    """
+
+    kind: str = "fixed"
+    a: float = 150
+    b: float = 0
+
+    def __post_init__(self):
+        if self.kind not in LENGTH_KINDS:
+            raise ValueError(f"length kind must be one of {', '.join(LENGTH_KINDS)}")
+        if self.a < 1 or self.b < 0 or (self.kind == "uniform" and self.b < self.a):
+            raise ValueError(f"invalid {self.kind} length distribution")
+
+    @classmethod
+    def from_string(cls, spec: str) -> "LengthDistribution":
+        """Parse a length given as 150, 100-150 (uniform), or 150~20 (normal)"""
+        try:
+            if "-" in spec:
+                a, b = spec.split("-")
+                return cls("uniform", int(a), int(b))
+            if "~" in spec:
+                a, b = spec.split("~")
+                return cls("normal", float(a), float(b))
+            return cls("fixed", int(spec))
+        except ValueError:
+            raise ValueError(f"invalid read length: {spec}")
+
+    def max_length(self) -> int:
+        if self.kind == "fixed":
+            return int(self.a)
+        if self.kind == "uniform":
+            return int(self.b)
+        return int(self.a + 6 * self.b)
+
+    def sample(self, rng: random.Random, n: int) -> list[int]:
+        if self.kind == "fixed":
+            return [int(self.a)] * n
+        if self.kind == "uniform":
+            a, b = int(self.a), int(self.b)
+            return [rng.randint(a, b) for _ in range(n)]
+        hi = self.max_length()
+        gauss = rng.gauss
+        return [min(max(round(gauss(self.a, self.b)), 1), hi) for _ in range(n)]
+
+
+def quality_means(profile: str, length: int, start: int, end: int) -> list[float]:
+    """Mean quality score at each position of a read
+
+    flat: start everywhere. linear: from start to end along the read. tail:
+    start for most of the read, then dropping to end over the last quarter,
+    as with Illumina reads.
+    """
+    if profile not in QUALITY_PROFILES:
+        raise ValueError(
+            f"quality profile must be one of {', '.join(QUALITY_PROFILES)}"
+        )
+    if profile == "flat" or length < 2:
+        return [float(start)] * length
+    if profile == "linear":
+        return [start + (end - start) * i / (length - 1) for i in range(length)]
+    knee = length * 3 // 4
+    drop = max(length - 1 - knee, 1)
+    return [
+        start if i < knee else start + (end - start) * ((i - knee) / drop) ** 2
+        for i in range(length)
+    ]
+
+
+@dataclass
+class SyntheticReads:
+    """Settings for a set of synthetic reads
+
+    low_complexity is the fraction of reads that are a repeated unit of one
+    or two bases, which filter-kscore removes. duplicate_rate is the
+    fraction of reads that copy the sequence of an earlier read.
+    """
+
+    num_reads: int
+    paired: bool = False
+    lengths: LengthDistribution = field(default_factory=LengthDistribution)
+    quality_profile: str = "tail"
+    quality_start: int = 37
+    quality_end: int = 20
+    quality_noise: float = 3.0
+    low_complexity: float = 0.0
+    duplicate_rate: float = 0.0
+    seed: Optional[int] = None
+    prefix: str = "read"
+
+    def __post_init__(self):
+        if self.num_reads < 0:
+            raise ValueError("num_reads must be at least 0")
+        for name in ["low_complexity", "duplicate_rate"]:
+            if not 0 <= getattr(self, name) <= 1:
+                raise ValueError(f"{name} must be between 0 and 1")
+        for name in ["quality_start", "quality_end"]:
+            if not 0 <= getattr(self, name) <= MAX_QUALITY:
+                raise ValueError(f"{name} must be between 0 and {MAX_QUALITY}")
+
+
+def _quality_pool(settings: SyntheticReads, rng: random.Random) -> list[str]:
+    means = quality_means(
+        settings.quality_profile,
+        settings.lengths.max_length(),
+        settings.quality_start,
+        settings.quality_end,
+    )
+    pool = []
+    for _ in range(QUALITY_POOL_SIZE):
+        scores = (round(rng.gauss(m, settings.quality_noise)) for m in means)
+        pool.append(
+            "".join(chr(min(max(q, 2), MAX_QUALITY) + QUALITY_OFFSET) for q in scores)
+        )
+    return pool
+
+
+def _cut(text: str, lengths: list[int]) -> list[str]:
+    ends = list(accumulate(lengths))
+    return [text[end - n : end] for end, n in zip(ends, lengths)]
+
+
+def _random_seqs(rng: random.Random, lengths: list[int]) -> list[str]:
+    text = rng.randbytes(sum(lengths)).translate(_BASES).decode("ascii")
+    return _cut(text, lengths)
+
+
+def _low_complexity_seq(rng: random.Random, length: int) -> str:
+    unit = "".join(rng.choices("ACGT", k=rng.randint(1, 2)))
+    return (unit * (length // len(unit) + 1))[:length]
+
+
+def _fastq_text(headers: list[str], seqs: list[str], quals: list[str]) -> str:
+    lines = [""] * (4 * len(seqs))
+    lines[0::4] = headers
+    lines[1::4] = seqs
+    lines[2::4] = ["+"] * len(seqs)
+    lines[3::4] = quals
+    lines.append("")
+    return "\n".join(lines)
+
+
+def synthetic_chunks(settings: SyntheticReads) -> Iterator[SerializedChunk]:
+    """Generate synthetic reads as FASTQ text, one string per mate per chunk"""
+    rng = random.Random(settings.seed)
+    pool = _quality_pool(settings, rng)
+    mates = 2 if settings.paired else 1
+    # Sequences that duplicates can copy, from this chunk or the last one
+    previous: list[tuple[str, ...]] = []
+    for first in range(0, settings.num_reads, CHUNK_SIZE):
+        n = min(CHUNK_SIZE, settings.num_reads - first)
+        lengths = settings.lengths.sample(rng, n)
+        seqs = [_random_seqs(rng, lengths) for _ in range(mates)]
+        if settings.low_complexity:
+            for i in range(n):
+                if rng.random() < settings.low_complexity:
+                    for mate_seqs in seqs:
+                        mate_seqs[i] = _low_complexity_seq(rng, lengths[i])
+        if settings.duplicate_rate:
+            for i in range(n):
+                if rng.random() < settings.duplicate_rate and (i or previous):
+                    j = rng.randrange(-len(previous), i)
+                    source = previous[j] if j < 0 else tuple(s[j] for s in seqs)
+                    for mate_seqs, seq in zip(seqs, source):
+                        mate_seqs[i] = seq
+            previous = list(zip(*seqs))
+        chunk = []
+        for mate, mate_seqs in enumerate(seqs, start=1):
+            picks = rng.randbytes(n)
+            quals = [pool[p][: len(s)] for p, s in zip(picks, mate_seqs)]
+            headers = [f"@{settings.prefix}{i} {mate}" for i in range(first, first + n)]
+            chunk.append(_fastq_text(headers, mate_seqs, quals))
+        yield tuple(chunk)
@@ -0,0 +1,97 @@
+"""Wall and CPU time spent in each part of a run
+
+Each part of a run, such as reading the input or one pipeline stage, adds
+to its own TimingDict of wall and CPU seconds. CPU time is counted per
+thread, with time.thread_time(), so a stage's CPU time is the sum over the
+worker threads or processes that ran it. Timing is kept per chunk of reads,
+not per read, so it costs little enough to leave on.
+"""
+
+from time import perf_counter, thread_time
+from typing import Iterable, Iterator, TypeVar
+
+TimingDict = dict[str, float]
+T = TypeVar("T")
+
+
+def timing_dict() -> TimingDict:
+    return {"wall_seconds": 0.0, "cpu_seconds": 0.0}
+
+
+def add_timing(dest: TimingDict, src: TimingDict) -> None:
+    for key, value in src.items():
+        dest[key] = dest.get(key, 0.0) + value
+
+
+def sum_timings(timings: Iterable[TimingDict]) -> TimingDict:
+    total = timing_dict()
+    for t in timings:
+        add_timing(total, t)
+    return total
+
+
+def subtract_timing(a: TimingDict, b: TimingDict) -> TimingDict:
+    """Time in a that wasn't in b, for timings that include others"""
+    return {key: max(value - b.get(key, 0.0), 0.0) for key, value in a.items()}
+
+
+class Stopwatch:
+    """Context manager that adds the time spent inside it to a TimingDict"""
+
+    __slots__ = ("timing", "_wall", "_cpu")
+
+    def __init__(self, timing: TimingDict):
+        self.timing = timing
+
+    def __enter__(self) -> "Stopwatch":
+        self._wall = perf_counter()
+        self._cpu = thread_time()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.timing["wall_seconds"] += perf_counter() - self._wall
+        self.timing["cpu_seconds"] += thread_time() - self._cpu
+
+
+def timed_iter(items: Iterable[T], timing: TimingDict) -> Iterator[T]:
+    """Pass items through, timing how long each one takes to produce"""
+    it = iter(items)
+    watch = Stopwatch(timing)
+    while True:
+        with watch:
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+        yield item
+
+
+class TimedReader:
+    """Binary stream under an input file that times every read from it
+
+    Reads that decompress the input are timed as well, so this is the time
+    spent reading and decompressing.
+    """
+
+    def __init__(self, f):
+        self._f = getattr(f, "buffer", f)
+        self.encoding = getattr(f, "encoding", None)
+        self.timing = timing_dict()
+        self._watch = Stopwatch(self.timing)
+
+    def read(self, size: int = -1):
+        with self._watch:
+            return self._f.read(size)
+
+    def readline(self, size: int = -1):
+        with self._watch:
+            return self._f.readline(size)
+
+    def seekable(self) -> bool:
+        return self._f.seekable()
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._f.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._f.tell()
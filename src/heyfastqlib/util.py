@@ -1,26 +1,82 @@
 import collections
 import itertools
+import math
+import operator
 import random
-from typing import Generator, Optional
-
-
-def subsample(xs: list[int], n: int, seed: Optional[int] = None) -> list[int]:
-    random.seed(seed)
-    # https://en.wikipedia.org/wiki/Reservoir_sampling
-    reservoir: list[Optional[int]] = [None for _ in range(n)]
-    for i, x in enumerate(xs):
-        if i < n:
-            reservoir[i] = x
-        else:
-            idx = random.randint(0, i)
-            if idx < n:
-                reservoir[idx] = x
-
-    full_reservoir = [x for x in reservoir if x is not None]
-    assert (
-        len(full_reservoir) == n
-    ), f"Expected reservoir of size {n}, got {len(full_reservoir)}"
-    return full_reservoir
+from array import array
+from typing import Generator, Iterable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+def sample_indexes(num_items: int, n: int, seed: Optional[int] = None) -> array:
+    """Select n of the indexes 0, ..., num_items - 1 at random
+
+    Uses Algorithm L (Li, 1994), which jumps directly to the next index that
+    enters the reservoir. Memory is O(n) whatever num_items is, and time is
+    O(n log(num_items / n)). Returns the indexes in sorted order.
+    """
+    if n >= num_items:
+        return array("Q", range(num_items))
+    if n <= 0:
+        return array("Q")
+    reservoir = array("Q", range(n))
+    for i, slot in _replacements(n, random.Random(seed)):
+        if i >= num_items:
+            break
+        reservoir[slot] = i
+    return array("Q", sorted(reservoir))
+
+
+def _replacements(n: int, rng: random.Random) -> Iterator[tuple[int, int]]:
+    """The indexes that enter a reservoir of n under Algorithm L, each with
+    the slot it replaces, going on forever
+
+    The choices don't depend on the number of items, so a pass that stops
+    at the end of the items picks the same ones as knowing the number first.
+    """
+    uniform = rng.random
+    log = math.log
+    expm1 = math.expm1
+    # 1 - random() is in (0, 1], so its log is always defined. log(w) must
+    # be below zero, though, or the first skip would be infinite.
+    log_w = 0.0
+    while log_w == 0.0:
+        log_w = log(1.0 - uniform()) / n
+    i = n - 1
+    while True:
+        # log(1 - w) is computed as log(-expm1(log(w))) to keep precision
+        # when w is close to 1
+        skip = log(1.0 - uniform()) / log(-expm1(log_w))
+        i += int(skip) + 1
+        yield i, int(uniform() * n)
+        log_w += log(1.0 - uniform()) / n
+
+
+def stream_sample(
+    xs: Iterable[T], n: int, seed: Optional[int] = None, keep_order: bool = False
+) -> list[T]:
+    """Select up to n items at random in a single pass over xs
+
+    Picks the same positions as sample_indexes with the same seed, without
+    knowing the number of items. xs is always read to the end. With
+    keep_order, items are returned in the order they appeared in xs rather
+    than in reservoir order.
+    """
+    it = iter(xs)
+    if n <= 0:
+        collections.deque(it, maxlen=0)
+        return []
+    reservoir = list(zip(range(n), it))
+    replacements = _replacements(n, random.Random(seed))
+    next_i, slot = next(replacements)
+    for i, x in enumerate(it, n):
+        if i == next_i:
+            reservoir[slot] = (i, x)
+            next_i, slot = next(replacements)
+    if keep_order:
+        reservoir.sort(key=operator.itemgetter(0))
+    return [x for _, x in reservoir]
 
 
 def sliding_sum(xs: list[int], k: int = 4) -> Generator[int, None, None]:
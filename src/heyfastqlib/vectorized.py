@@ -0,0 +1,160 @@
+"""Batch stage functions that use NumPy, if it is installed
+
+Each function here gives exactly the same result as running the matching
+function from heyfastqlib.read on every read in the batch.
+"""
+
+from array import array
+from typing import Callable, Optional
+
+from .batch import Batch, ReadBatch
+from .read import trim_ends, trim_moving_average
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+HAVE_NUMPY = np is not None
+BACKENDS = ("auto", "python", "numpy")
+
+
+def _qvals(rb: ReadBatch, offset: int = 33):
+    buf = np.frombuffer(rb.qual.encode("ascii"), dtype=np.uint8)
+    return buf.astype(np.int64) - offset
+
+
+def _is_ascii_batch(rb: ReadBatch) -> bool:
+    return rb.seq.isascii() and rb.qual.isascii() and rb.seq_offsets == rb.qual_offsets
+
+
+def _first_at_or_after(positions, starts, missing: int):
+    """For each start, the first value in positions >= start, or missing"""
+    idx = np.searchsorted(positions, starts)
+    found = np.full(len(starts), missing, dtype=np.int64)
+    has = idx < len(positions)
+    found[has] = positions[idx[has]]
+    return found
+
+
+def _last_before(positions, ends, missing: int):
+    """For each end, the last value in positions < end, or missing"""
+    idx = np.searchsorted(positions, ends) - 1
+    found = np.full(len(ends), missing, dtype=np.int64)
+    has = idx >= 0
+    found[has] = positions[idx[has]]
+    return found
+
+
+def _slice_batch(rb: ReadBatch, starts, ends) -> ReadBatch:
+    """Slice read i to [starts[i]:ends[i]], with starts/ends relative to the
+    read and already clipped to 0 <= starts <= ends <= read length"""
+    offsets = np.frombuffer(rb.seq_offsets, dtype=np.uint32).astype(np.int64)
+    lengths = np.diff(offsets)
+    new_lengths = ends - starts
+    if np.array_equal(new_lengths, lengths):
+        return rb
+    read_starts = np.repeat(offsets[:-1], lengths)
+    rel = np.arange(offsets[-1], dtype=np.int64) - read_starts
+    keep = (rel >= np.repeat(starts, lengths)) & (rel < np.repeat(ends, lengths))
+    seq = np.frombuffer(rb.seq.encode("ascii"), dtype=np.uint8)[keep]
+    qual = np.frombuffer(rb.qual.encode("ascii"), dtype=np.uint8)[keep]
+    new_offsets = np.zeros(len(new_lengths) + 1, dtype=np.uint32)
+    np.cumsum(new_lengths, out=new_offsets[1:])
+    seq_offsets = array("I", new_offsets.tobytes())
+    return ReadBatch(
+        rb.desc,
+        seq.tobytes().decode("ascii"),
+        qual.tobytes().decode("ascii"),
+        rb.desc_offsets,
+        seq_offsets,
+        array("I", seq_offsets),
+    )
+
+
+def _trim_moving_average_readbatch(
+    rb: ReadBatch, k: int = 4, threshold: float = 15
+) -> ReadBatch:
+    if not _is_ascii_batch(rb):
+        return ReadBatch.from_reads(
+            [trim_moving_average(r, k=k, threshold=threshold) for r in rb.reads()]
+        )
+    qs = _qvals(rb)
+    offsets = np.frombuffer(rb.seq_offsets, dtype=np.uint32).astype(np.int64)
+    starts, ends = offsets[:-1], offsets[1:]
+    cumsum = np.zeros(len(qs) + 1, dtype=np.int64)
+    np.cumsum(qs, out=cumsum[1:])
+    # Sum of the window starting at each position in the concatenated qualities
+    window_sums = cumsum[k:] - cumsum[:-k] if len(qs) >= k else cumsum[:0]
+    failing = np.flatnonzero(window_sums < threshold * k)
+    # Windows that run past the end of a read come after all of the read's
+    # own windows, so the first failing window at or after the start of a
+    # read is the one to trim at, as long as it fits in the read
+    window_idx = _first_at_or_after(failing, starts, -1)
+    trimmed = (window_idx >= 0) & (window_idx <= ends - k)
+    new_ends = ends.copy()
+    window_idx = window_idx[trimmed]
+    trim_at = window_idx.copy()
+    # Extend to include last qval in window meeting threshold
+    for j in range(k):
+        ok = qs[window_idx + j] >= threshold
+        trim_at[ok] = window_idx[ok] + j + 1
+    new_ends[trimmed] = trim_at
+    return _slice_batch(rb, np.zeros(len(starts), dtype=np.int64), new_ends - starts)
+
+
+def _trim_ends_readbatch(
+    rb: ReadBatch, threshold_start: float = 3, threshold_end: float = 3
+) -> ReadBatch:
+    if not _is_ascii_batch(rb):
+        return ReadBatch.from_reads(
+            [
+                trim_ends(
+                    r, threshold_start=threshold_start, threshold_end=threshold_end
+                )
+                for r in rb.reads()
+            ]
+        )
+    qs = _qvals(rb)
+    offsets = np.frombuffer(rb.seq_offsets, dtype=np.uint32).astype(np.int64)
+    starts, ends = offsets[:-1], offsets[1:]
+    first_ok = _first_at_or_after(np.flatnonzero(qs >= threshold_start), starts, -1)
+    last_ok = _last_before(np.flatnonzero(qs >= threshold_end), ends, -1)
+    # With no base passing the threshold, everything is trimmed
+    new_starts = np.where((first_ok >= 0) & (first_ok < ends), first_ok, ends)
+    new_ends = np.where(last_ok >= starts, last_ok + 1, starts)
+    new_ends = np.maximum(new_ends, new_starts)
+    return _slice_batch(rb, new_starts - starts, new_ends - starts)
+
+
+def trim_moving_average_batch(b: Batch, k: int = 4, threshold: float = 15) -> Batch:
+    return tuple(_trim_moving_average_readbatch(rb, k, threshold) for rb in b)
+
+
+def trim_ends_batch(
+    b: Batch, threshold_start: float = 3, threshold_end: float = 3
+) -> Batch:
+    return tuple(_trim_ends_readbatch(rb, threshold_start, threshold_end) for rb in b)
+
+
+NUMPY_BATCH_FUNCTIONS: dict[Callable, Callable] = {
+    trim_moving_average: trim_moving_average_batch,
+    trim_ends: trim_ends_batch,
+}
+"""Batch versions of quality trimming functions, for use in place of the
+pure Python ones when NumPy is available"""
+
+
+def resolve_backend(backend: str) -> Optional[dict[Callable, Callable]]:
+    """Return the batch functions to add for a backend name
+
+    "python" always uses the pure Python functions, "numpy" requires NumPy,
+    and "auto" uses NumPy if it can be imported.
+    """
+    if backend == "python":
+        return None
+    if backend == "numpy" and not HAVE_NUMPY:
+        raise ValueError("the numpy backend requires numpy to be installed")
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {', '.join(BACKENDS)}")
+    return NUMPY_BATCH_FUNCTIONS if HAVE_NUMPY else None
@@ -1,7 +1,12 @@
+import argparse
 import gzip
+import shutil
 from contextlib import contextmanager
 from pathlib import Path
 
+import pytest
+
+from heyfastqlib import argparse_types
 from heyfastqlib.argparse_types import GzipFileType
 
 
@@ -50,3 +55,63 @@ def test_gzipfiletype_call_gz(tmp_path):
         handle.write("test")
     with gzft_open(gzft, gz_dest) as handle:
         assert handle.read() == "test"
+
+
+needs_zstd = pytest.mark.skipif(
+    argparse_types.zstd is None and shutil.which("zstd") is None,
+    reason="needs Python 3.14 or the zstd program",
+)
+
+
+@needs_zstd
+def test_gzipfiletype_call_zstd(tmp_path):
+    gzftw = GzipFileType(mode="w")
+    zst_dest = tmp_path / "test_out.txt.zst"
+    with gzft_open(gzftw, zst_dest) as handle:
+        handle.write("test")
+    assert zst_dest.read_bytes()[:4] == argparse_types.ZSTD_MAGIC
+
+    # Detected by magic number, not extension
+    zst_source = tmp_path / "test_in.txt"
+    zst_dest.rename(zst_source)
+    with gzft_open(GzipFileType(), zst_source) as handle:
+        assert handle.read() == "test"
+
+
+def test_gzipfiletype_zstd_program(tmp_path, monkeypatch):
+    if shutil.which("zstd") is None:
+        pytest.skip("needs the zstd program")
+    monkeypatch.setattr(argparse_types, "zstd", None)
+    monkeypatch.setenv("HFQ_ZSTD_COMPRESSION", "19")
+    monkeypatch.setenv("HFQ_ZSTD_THREADS", "2")
+    zst_dest = tmp_path / "test_out.txt.zst"
+    with gzft_open(GzipFileType(mode="w"), zst_dest) as handle:
+        handle.write("test")
+    with gzft_open(GzipFileType(), zst_dest) as handle:
+        assert handle.read() == "test"
+
+
+def test_gzipfiletype_zstd_program_threads(tmp_path, monkeypatch):
+    if shutil.which("zstd") is None:
+        pytest.skip("needs the zstd program")
+    monkeypatch.setattr(argparse_types, "zstd", None)
+    monkeypatch.delenv("HFQ_ZSTD_THREADS", raising=False)
+    commands = []
+    popen = argparse_types.sp.Popen
+
+    def recording_popen(cmd, *args, **kwargs):
+        commands.append(cmd)
+        return popen(cmd, *args, **kwargs)
+
+    monkeypatch.setattr(argparse_types.sp, "Popen", recording_popen)
+    zst_dest = tmp_path / "test_out.txt.zst"
+    with gzft_open(GzipFileType(mode="w", threads=3), zst_dest) as handle:
+        handle.write("test")
+    assert "-T3" in commands[0]
+
+
+def test_gzipfiletype_zstd_unavailable(tmp_path, monkeypatch):
+    monkeypatch.setattr(argparse_types, "zstd", None)
+    monkeypatch.setattr(shutil, "which", lambda cmd: None)
+    with pytest.raises(argparse.ArgumentTypeError):
+        GzipFileType(mode="w")(str(tmp_path / "test_out.txt.zst"))
@@ -0,0 +1,121 @@
+import operator
+
+from heyfastqlib.batch import (
+    ReadBatch,
+    batch_reads,
+    kscore_ok_batch,
+    length_ok_batch,
+    reads_batch,
+    select_batch,
+    seq_id_ok_batch,
+    serialize_batch,
+    serialize_reads,
+    trim_batch,
+)
+from heyfastqlib.idindex import SeqIdIndex
+from heyfastqlib.read import Read, seq_id_ok
+
+READS = [
+    Read("a 1", "ACGTA", "FFFFF"),
+    Read("b", "GG", "#F"),
+    Read("c x", "", ""),
+    Read("d", "TTAC", "!!!!"),
+]
+
+
+def test_read_batch_round_trip():
+    rb = ReadBatch.from_reads(READS)
+    assert len(rb) == 4
+    assert rb.seq == "ACGTAGGTTAC"
+    assert list(rb.seq_offsets) == [0, 5, 7, 7, 11]
+    assert rb.reads() == READS
+
+
+def test_read_batch_lengths():
+    rb = ReadBatch.from_reads(READS)
+    assert list(rb.lengths()) == [5, 2, 0, 4]
+    assert rb.total_bases() == 11
+
+
+def test_read_batch_select():
+    rb = ReadBatch.from_reads(READS)
+    assert rb.select([True, False, True, True]).reads() == [
+        READS[0],
+        READS[2],
+        READS[3],
+    ]
+    assert rb.select([False, True, False, True]).reads() == [READS[1], READS[3]]
+    assert rb.select([False] * 4).reads() == []
+    assert rb.select([True] * 4) is rb
+
+
+def test_read_batch_trim():
+    rb = ReadBatch.from_reads(READS).trim(1, 3)
+    assert rb.reads() == [
+        Read("a 1", "CG", "FF"),
+        Read("b", "G", "F"),
+        Read("c x", "", ""),
+        Read("d", "TA", "!!"),
+    ]
+
+
+def test_read_batch_to_fastq():
+    rb = ReadBatch.from_reads(READS[:2])
+    assert rb.to_fastq() == "@a 1\nACGTA\n+\nFFFFF\n@b\nGG\n+\n#F\n"
+
+
+def test_paired_batches():
+    pairs = list(zip(READS, reversed(READS)))
+    b = reads_batch(pairs, 2)
+    assert len(b) == 2
+    assert batch_reads(b) == pairs
+    assert batch_reads(select_batch(b, [False, True, True, False])) == pairs[1:3]
+
+
+def test_length_ok_batch():
+    single = reads_batch(READS, 1)
+    assert length_ok_batch(single, 4) == [True, False, False, True]
+    assert length_ok_batch(single, 4, cmp=operator.lt) == [False, True, True, False]
+    paired = reads_batch(list(zip(READS, reversed(READS))), 2)
+    assert length_ok_batch(paired, 4) == [True, False, False, True]
+    assert length_ok_batch(paired, 3, cmp=operator.lt) == [False, True, True, False]
+
+
+def test_kscore_ok_batch():
+    b = reads_batch([Read("a", "AAAAC", "!!!!!"), Read("b", "ACGTTG", "!!!!!!")], 1)
+    assert kscore_ok_batch(b, min_kscore=0.5) == [False, True]
+    assert kscore_ok_batch(b, min_kscore=0.3) == [True, True]
+    assert kscore_ok_batch(b, k=6, min_kscore=0.1) == [False, True]
+
+
+def test_trim_batch():
+    paired = reads_batch(list(zip(READS, READS)), 2)
+    trimmed = trim_batch(paired, end_idx=2)
+    assert [r.seq for r, _ in batch_reads(trimmed)] == ["AC", "GG", "", "TT"]
+
+
+def test_serialize():
+    pairs = list(zip(READS[:2], READS[2:]))
+    expected = (
+        "@a 1\nACGTA\n+\nFFFFF\n@b\nGG\n+\n#F\n",
+        "@c x\n\n+\n\n@d\nTTAC\n+\n!!!!\n",
+    )
+    assert serialize_reads(pairs, 2) == expected
+    assert serialize_batch(reads_batch(pairs, 2)) == expected
+    assert serialize_reads(READS[:2], 1) == expected[:1]
+    assert serialize_reads([], 2) == ("", "")
+
+
+def test_seq_id_ok_batch():
+    pairs = list(zip(READS, [Read("a", "", ""), Read("z", "", "")] * 2))
+    b = reads_batch(pairs, 2)
+    for ids in [{"a", "c", "z"}, SeqIdIndex.from_ids(["a", "c", "z"])]:
+        for keep in [False, True]:
+            expected = [seq_id_ok(rp, ids, keep) for rp in pairs]
+            assert seq_id_ok_batch(b, ids, keep) == expected
+    assert seq_id_ok_batch(reads_batch(READS, 1), {"b", "d"}) == [
+        True,
+        False,
+        True,
+        False,
+    ]
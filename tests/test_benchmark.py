@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+from heyfastqlib.benchmark import (
+    benchmark_main,
+    make_inputs,
+    run_benchmarks,
+    run_heyfastq,
+    run_id_index_benchmark,
+)
+from heyfastqlib.io import parse_fastq
+
+
+def test_make_inputs(tmp_path):
+    inputs = make_inputs(tmp_path, 25, 10)
+    assert len(inputs[("single", "gzip")]) == 1
+    assert inputs[("paired", "plain")] == [
+        tmp_path / "reads_1.fastq",
+        tmp_path / "reads_2.fastq",
+    ]
+    with open(tmp_path / "reads_1.fastq") as f1, open(tmp_path / "reads_2.fastq") as f2:
+        pairs = list(parse_fastq((f1, f2)))
+    assert len(pairs) == 25
+    assert all(
+        len(r1.seq) == 10 and r1.desc.split()[0] == r2.desc.split()[0]
+        for r1, r2 in pairs
+    )
+    assert (tmp_path / "ids.txt").read_text().split() == ["read0", "read10", "read20"]
+    # The same seed gives the same reads
+    first = (tmp_path / "reads_1.fastq").read_text()
+    make_inputs(tmp_path, 25, 10)
+    assert (tmp_path / "reads_1.fastq").read_text() == first
+
+
+def test_run_heyfastq_lots_of_stderr(tmp_path):
+    reads = tmp_path / "reads.fastq"
+    reads.write_text("@a\nACGT\n+\nIIII\n" * 20000)
+    progress = ["--progress", "-", "--progress-interval", "0.0001"]
+    args = ["trim-fixed", "--input", str(reads), "--output", str(tmp_path / "o.fq")]
+
+    # More progress lines than a pipe holds, which would block a child
+    # writing to a pipe that isn't read until it exits
+    result = run_heyfastq(args + progress + ["--chunk-size", "1"])
+    assert result["seconds"] > 0
+
+    with pytest.raises(RuntimeError, match="unrecognized arguments"):
+        run_heyfastq(args + ["--no-such-option"])
+
+
+def test_id_index_smaller_than_set(tmp_path):
+    result = run_id_index_benchmark(tmp_path, 1000000)
+    assert result["ids"] == 1000000
+    assert 0 < result["index"]["peak_rss_bytes"] < result["set"]["peak_rss_bytes"]
+
+
+def test_run_benchmarks(tmp_path):
+    results = run_benchmarks(
+        tmp_path,
+        num_reads=50,
+        read_length=20,
+        commands=["filter-seqids", "subsample"],
+        layouts=["paired"],
+        compressions=["gzip"],
+        threads=[1, 2],
+    )
+    runs = results["runs"]
+    assert len(runs) == 4
+    for run in runs:
+        assert run["reads_per_second"] > 0
+        assert run["peak_rss_bytes"] > 0
+    assert runs[0]["report"]["filter_seq_ids"]["output_reads"] == 45
+    assert runs[2]["report"]["subsample"]["output_reads"] == 5
+
+
+def test_benchmark_main(tmp_path):
+    output = tmp_path / "results.json"
+    benchmark_main(
+        [
+            "--reads",
+            "20",
+            "--commands",
+            "trim-fixed",
+            "--layouts",
+            "single",
+            "--compressions",
+            "plain",
+            "--threads",
+            "1",
+            "--chunk-sizes",
+            "7",
+            "--index-ids",
+            "100",
+            "--output",
+            str(output),
+        ]
+    )
+    results = json.loads(output.read_text())
+    assert results["settings"]["reads"] == 20
+    assert results["id_index"]["ids"] == 100
+    assert [(r["command"], r["chunk_size"]) for r in results["runs"]] == [
+        ("trim-fixed", 7)
+    ]
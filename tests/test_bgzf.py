@@ -0,0 +1,122 @@
+import gzip
+import os
+
+import pytest
+
+from heyfastqlib.argparse_types import GzipFileType
+from heyfastqlib.bgzf import (
+    EOF_BLOCK,
+    BgzfReader,
+    BgzfWriter,
+    block_offsets,
+    compress_block,
+    is_bgzf,
+    open_bgzf,
+)
+
+
+def write_bgzf(path, data, block_size=100):
+    with open(path, "wb") as f:
+        for i in range(0, len(data), block_size):
+            f.write(compress_block(data[i : i + block_size]))
+        f.write(EOF_BLOCK)
+
+
+DATA = b"".join(b"@r%d\nACGT\n+\nFFFF\n" % i for i in range(500))
+
+
+def test_is_bgzf(tmp_path):
+    bgzf_path = tmp_path / "a.fastq.gz"
+    write_bgzf(bgzf_path, DATA)
+    gz_path = tmp_path / "b.fastq.gz"
+    with gzip.open(gz_path, "wb") as f:
+        f.write(DATA)
+    assert is_bgzf(bgzf_path)
+    assert not is_bgzf(gz_path)
+
+
+@pytest.mark.parametrize("threads", [0, 1, 3])
+@pytest.mark.parametrize("read_size", [7, 256, 1 << 20])
+def test_bgzf_reader(tmp_path, threads, read_size):
+    path = tmp_path / "a.fastq.gz"
+    write_bgzf(path, DATA)
+    with BgzfReader(path, threads, read_size) as f:
+        assert f.readall() == DATA
+
+
+def test_open_bgzf_text(tmp_path):
+    path = tmp_path / "a.fastq.gz"
+    write_bgzf(path, DATA, block_size=33)
+    with open_bgzf(path, threads=2) as f:
+        assert f.read() == DATA.decode()
+    with pytest.raises(ValueError):
+        open_bgzf(path, "r+")
+
+
+def test_bgzf_reader_truncated(tmp_path):
+    path = tmp_path / "a.fastq.gz"
+    write_bgzf(path, DATA)
+    path.write_bytes(path.read_bytes()[:-40])
+    with BgzfReader(path, 2) as f:
+        with pytest.raises(gzip.BadGzipFile):
+            f.readall()
+
+
+def test_gzipfiletype_bgzf(tmp_path, monkeypatch):
+    monkeypatch.setattr("shutil.which", lambda cmd: None)
+    path = tmp_path / "a.fastq.gz"
+    write_bgzf(path, DATA)
+    handle, closer = GzipFileType()(str(path))
+    assert isinstance(handle.buffer.raw, BgzfReader)
+    assert handle.read() == DATA.decode()
+    closer()
+
+
+def test_compress_block_incompressible():
+    data = os.urandom(1 << 16)
+    block = compress_block(data, 9)
+    assert len(block) > 1 << 16
+    assert gzip.decompress(block) == data
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_bgzf_writer(tmp_path, threads, monkeypatch):
+    monkeypatch.setattr("heyfastqlib.bgzf.BLOCKS_PER_TASK", 2)
+    monkeypatch.setattr("heyfastqlib.bgzf.BLOCK_DATA_SIZE", 1000)
+    path = tmp_path / "a.fastq.gz"
+    with BgzfWriter(path, threads, level=1) as f:
+        for i in range(0, len(DATA), 777):
+            f.write(DATA[i : i + 777])
+    assert path.read_bytes().endswith(EOF_BLOCK)
+    assert is_bgzf(path)
+    assert gzip.decompress(path.read_bytes()) == DATA
+    with BgzfReader(path, threads, 100) as f:
+        assert f.readall() == DATA
+
+
+def test_open_bgzf_write_text(tmp_path):
+    path = tmp_path / "a.fastq.gz"
+    with open_bgzf(path, "w", threads=2) as f:
+        f.write(DATA.decode())
+    assert gzip.decompress(path.read_bytes()) == DATA
+
+
+def test_gzipfiletype_writes_bgzf(tmp_path, monkeypatch):
+    monkeypatch.setattr("shutil.which", lambda cmd: None)
+    path = tmp_path / "a.fastq.gz"
+    handle, closer = GzipFileType("w")(str(path))
+    handle.write(DATA.decode())
+    closer()
+    assert is_bgzf(path)
+    with gzip.open(path) as f:
+        assert f.read() == DATA
+
+
+def test_block_offsets(tmp_path):
+    path = tmp_path / "a.fastq.gz"
+    write_bgzf(path, DATA, 1000)
+    compressed, uncompressed = block_offsets(path)
+    assert list(uncompressed) == [*range(0, len(DATA), 1000), len(DATA), len(DATA)]
+    assert compressed[-1] == os.path.getsize(path)
+    with BgzfReader(path, 1, start=compressed[3]) as f:
+        assert f.readall() == DATA[3000:]
@@ -1,7 +1,13 @@
 import gzip
+import io
+import json
 import shutil
+import sys
 from pathlib import Path
 
+import pytest
+
+from heyfastqlib.bgzf import open_bgzf
 from heyfastqlib.command import fastq_io_parser, heyfastq_main
 
 DATA_DIR = Path(__file__).parent / "data"
@@ -109,6 +115,63 @@ def test_trim_qual_command(tmp_path):
     assert out2.read_text() == "@a\nCGTTCGTT\n+\n55555555\n"
 
 
+def test_trim_qual_command_python_backend(tmp_path):
+    in1 = copy_data(tmp_path, "trim_qual_input_1.fastq")
+    in2 = copy_data(tmp_path, "trim_qual_input_2.fastq")
+    out1 = tmp_path / "output_1.fastq"
+    out2 = tmp_path / "output_2.fastq"
+
+    heyfastq_main(
+        [
+            "trim-qual",
+            "--window-width",
+            "4",
+            "--window-threshold",
+            "7",
+            "--start-threshold",
+            "6",
+            "--min-length",
+            "4",
+            "--backend",
+            "python",
+            "--input",
+            str(in1),
+            str(in2),
+            "--output",
+            str(out1),
+            str(out2),
+        ]
+    )
+
+    assert out1.read_text() == "@a\nACGTACGT\n+\n55555555\n"
+    assert out2.read_text() == "@a\nCGTTCGTT\n+\n55555555\n"
+
+
+@pytest.mark.parametrize("backends", [["numpy", "python"], ["python", "numpy"]])
+def test_run_command_backend_per_step(tmp_path, monkeypatch, backends):
+    pytest.importorskip("numpy")
+    from heyfastqlib import vectorized
+
+    calls = []
+    trim_ends = vectorized.trim_ends
+    trim_ends_batch = vectorized.NUMPY_BATCH_FUNCTIONS[trim_ends]
+
+    def recorded_batch(*args, **kwargs):
+        calls.append(1)
+        return trim_ends_batch(*args, **kwargs)
+
+    monkeypatch.setitem(vectorized.NUMPY_BATCH_FUNCTIONS, trim_ends, recorded_batch)
+    in1 = copy_data(tmp_path, "trim_qual_input_1.fastq")
+    steps = []
+    for backend in backends:
+        steps.extend(["--step", f"trim-qual --backend {backend}"])
+
+    heyfastq_main(["run", *steps, "--input", str(in1)])
+
+    # Only the numpy step runs the batch function, on the one batch
+    assert len(calls) == 1
+
+
 def test_filter_kscore_command(tmp_path):
     in1 = copy_data(tmp_path, "filter_kscore_input_1.fastq")
     in2 = copy_data(tmp_path, "filter_kscore_input_2.fastq")
@@ -133,6 +196,63 @@ def test_filter_kscore_command(tmp_path):
     assert out2.read_text() == "@b\nGCTGAGCTACGGTC\n+\n==============\n"
 
 
+def test_filter_kscore_command_kmer_size(tmp_path):
+    in1 = copy_data(tmp_path, "filter_kscore_input_1.fastq")
+    in2 = copy_data(tmp_path, "filter_kscore_input_2.fastq")
+    out1 = tmp_path / "output_1.fastq"
+    out2 = tmp_path / "output_2.fastq"
+
+    heyfastq_main(
+        [
+            "filter-kscore",
+            "--kmer-size",
+            "3",
+            "--min-kscore",
+            "0.55",
+            "--input",
+            str(in1),
+            str(in2),
+            "--output",
+            str(out1),
+            str(out2),
+        ]
+    )
+
+    # With 3-mers, read b scores 10 / 19 and is removed too
+    assert out1.read_text() == ""
+    assert out2.read_text() == ""
+
+
+def test_filter_kscore_command_process_executor(tmp_path):
+    in1 = copy_data(tmp_path, "filter_kscore_input_1.fastq")
+    in2 = copy_data(tmp_path, "filter_kscore_input_2.fastq")
+    out1 = tmp_path / "output_1.fastq"
+    out2 = tmp_path / "output_2.fastq"
+
+    heyfastq_main(
+        [
+            "filter-kscore",
+            "--min-kscore",
+            "0.55",
+            "--threads",
+            "2",
+            "--chunk-size",
+            "1",
+            "--executor",
+            "process",
+            "--input",
+            str(in1),
+            str(in2),
+            "--output",
+            str(out1),
+            str(out2),
+        ]
+    )
+
+    assert out1.read_text() == "@b\nGCTAGCTAGCATGCATCTA\n+\n===================\n"
+    assert out2.read_text() == "@b\nGCTGAGCTACGGTC\n+\n==============\n"
+
+
 def test_filter_length_command(tmp_path):
     in1 = copy_data(tmp_path, "filter_length_input_1.fastq")
     in2 = copy_data(tmp_path, "filter_length_input_2.fastq")
@@ -181,6 +301,27 @@ def test_filter_seq_ids_command(tmp_path):
     assert out2.read_text() == "@b\nCCGG\n+\n####\n"
 
 
+def test_filter_seq_ids_command_gzipped_ids(tmp_path):
+    seqids = tmp_path / "ids.txt.gz"
+    seqids.write_bytes(gzip.compress(read_expected("filter_seqids_ids.txt").encode()))
+    in1 = copy_data(tmp_path, "filter_seqids_input.fastq")
+    out1 = tmp_path / "output_1.fastq"
+
+    heyfastq_main(
+        [
+            "filter-seqids",
+            str(seqids),
+            "--keep-ids",
+            "--input",
+            str(in1),
+            "--output",
+            str(out1),
+        ]
+    )
+
+    assert out1.read_text() == "@a\nCGTA\n+\n1234\n"
+
+
 def test_subsample_command(tmp_path):
     in1 = copy_data(tmp_path, "subsample_input_1.fastq")
     in2 = copy_data(tmp_path, "subsample_input_2.fastq")
@@ -203,4 +344,551 @@ def test_subsample_command(tmp_path):
         ]
     )
 
-    assert out1.read_text() == "@a\nAGC\n+\n123\n@c\nCTG\n+\n***\n"
+    assert out1.read_text() == "@a\nAGC\n+\n123\n@b\nGCT\n+\n.o.\n"
+
+
+def test_subsample_command_single_pass(tmp_path):
+    in1 = copy_data(tmp_path, "subsample_input_1.fastq")
+    in2 = copy_data(tmp_path, "subsample_input_2.fastq")
+    out1 = tmp_path / "output_1.fastq"
+    out2 = tmp_path / "output_2.fastq"
+
+    heyfastq_main(
+        [
+            "subsample",
+            "--n",
+            "2",
+            "--seed",
+            "500",
+            "--single-pass",
+            "--keep-order",
+            "--input",
+            str(in1),
+            str(in2),
+            "--output",
+            str(out1),
+            str(out2),
+        ]
+    )
+
+    # The same reads as counting the reads first
+    assert out1.read_text() == "@a\nAGC\n+\n123\n@b\nGCT\n+\n.o.\n"
+    assert out2.read_text().startswith("@a\n")
+
+
+class UnseekableBytesIO(io.BytesIO):
+    def seekable(self):
+        return False
+
+
+def test_subsample_command_stdin(tmp_path, monkeypatch):
+    data = (DATA_DIR / "subsample_input_1.fastq").read_bytes()
+    monkeypatch.setattr(sys, "stdin", io.TextIOWrapper(UnseekableBytesIO(data)))
+    out1 = tmp_path / "output_1.fastq"
+
+    heyfastq_main(
+        [
+            "subsample",
+            "--n",
+            "2",
+            "--seed",
+            "500",
+            "--keep-order",
+            "--input",
+            "-",
+            "--output",
+            str(out1),
+        ]
+    )
+
+    assert out1.read_text() == "@a\nAGC\n+\n123\n@b\nGCT\n+\n.o.\n"
+
+
+def test_subsample_command_stdin_matches_file(tmp_path, monkeypatch):
+    in1 = tmp_path / "input_1.fastq"
+    write_many_reads(in1, 500, 1)
+    args = ["subsample", "--n", "50", "--seed", "3", "--input"]
+    expected = tmp_path / "expected.fastq"
+    heyfastq_main(args + [str(in1), "--output", str(expected)])
+
+    stdin = io.TextIOWrapper(UnseekableBytesIO(in1.read_bytes()))
+    monkeypatch.setattr(sys, "stdin", stdin)
+    out1 = tmp_path / "output_1.fastq"
+    heyfastq_main(args + ["-", "--output", str(out1)])
+
+    assert out1.read_text() == expected.read_text()
+
+
+def test_run_command(tmp_path):
+    in1 = copy_data(tmp_path, "trim_qual_input_1.fastq")
+    in2 = copy_data(tmp_path, "trim_qual_input_2.fastq")
+    out1 = tmp_path / "output_1.fastq"
+    out2 = tmp_path / "output_2.fastq"
+    report = tmp_path / "report.json"
+
+    heyfastq_main(
+        [
+            "run",
+            "--step",
+            "trim-qual --window-width 4 --window-threshold 7 --start-threshold 6 "
+            "--min-length 4 --backend python",
+            "--step",
+            "trim-fixed --length 6",
+            "--step",
+            "filter-length --length 6",
+            "--input",
+            str(in1),
+            str(in2),
+            "--output",
+            str(out1),
+            str(out2),
+            "--report",
+            str(report),
+        ]
+    )
+
+    assert out1.read_text() == "@a\nACGTAC\n+\n555555\n"
+    assert out2.read_text() == "@a\nCGTTCG\n+\n555555\n"
+    steps = json.loads(report.read_text())["steps"]
+    assert [s["step"] for s in steps] == ["trim-qual", "trim-fixed", "filter-length"]
+    assert list(steps[0]) == [
+        "step",
+        "window_width",
+        "window_threshold",
+        "start_threshold",
+        "end_threshold",
+        "min_length",
+        "trim_avg",
+        "trim_ends",
+        "filter_length",
+    ]
+    assert steps[1]["length"] == 6
+    assert steps[1]["trim_fixed"]["output_bases"] == 6
+    assert steps[2]["filter_length"]["output_reads"] == 1
+
+
+def test_report_timing(tmp_path):
+    in1 = copy_data(tmp_path, "trim_qual_input_1.fastq")
+    in2 = copy_data(tmp_path, "trim_qual_input_2.fastq")
+    report = tmp_path / "report.json"
+
+    heyfastq_main(
+        [
+            "run",
+            "--step",
+            "trim-fixed --length 6",
+            "--step",
+            "filter-length --length 6",
+            "--input",
+            str(in1),
+            str(in2),
+            "--output",
+            str(tmp_path / "output_1.fastq"),
+            str(tmp_path / "output_2.fastq"),
+            "--report",
+            str(report),
+        ]
+    )
+
+    timing = json.loads(report.read_text())["timing"]
+    assert list(timing) == [
+        "read",
+        "parse",
+        "steps",
+        "serialize",
+        "write",
+        "total",
+        "reads",
+        "reads_per_second",
+    ]
+    assert [list(step) for step in timing["steps"]] == [
+        ["trim_fixed"],
+        ["filter_length"],
+    ]
+    assert set(timing["total"]) == {"wall_seconds", "cpu_seconds"}
+    assert timing["total"]["wall_seconds"] > 0
+    assert timing["reads"] == 1
+
+
+def test_progress(tmp_path):
+    in1 = copy_data(tmp_path, "trim_qual_input_1.fastq")
+    progress = tmp_path / "progress.jsonl"
+
+    heyfastq_main(
+        [
+            "filter-length",
+            "--length",
+            "15",
+            "--input",
+            str(in1),
+            "--output",
+            str(tmp_path / "output_1.fastq"),
+            "--progress",
+            str(progress),
+            "--report",
+            str(tmp_path / "report.json"),
+        ]
+    )
+
+    status = json.loads(progress.read_text().splitlines()[-1])
+    assert status["done"]
+    assert status["reads"] == 1
+    assert status["stages"]["filter_length"]["input_reads"] == 1
+    report = json.loads((tmp_path / "report.json").read_text())
+    assert "progress" not in report
+
+
+def test_profile(tmp_path):
+    in1 = copy_data(tmp_path, "trim_qual_input_1.fastq")
+    profile = tmp_path / "heyfastq.prof"
+
+    heyfastq_main(
+        [
+            "filter-kscore",
+            "--input",
+            str(in1),
+            "--output",
+            str(tmp_path / "output_1.fastq"),
+            "--profile",
+            str(profile),
+            "--profile-top",
+            "3",
+            "--report",
+            str(tmp_path / "report.json"),
+        ]
+    )
+
+    assert profile.stat().st_size > 0
+    report = json.loads((tmp_path / "report.json").read_text())
+    assert "profile_top" not in report
+    assert list(report["profile"]["stages"]) == ["kscore_ok"]
+    assert report["profile"]["stages"]["kscore_ok"]["calls"] == 1
+    assert len(report["profile"]["top"]) == 3
+
+
+def test_max_memory(tmp_path):
+    in1 = tmp_path / "input_1.fastq"
+    write_many_reads(in1, 500, 1)
+    out1 = tmp_path / "output_1.fastq"
+    report = tmp_path / "report.json"
+
+    heyfastq_main(
+        [
+            "filter-length",
+            "--length",
+            "4",
+            "--input",
+            str(in1),
+            "--output",
+            str(out1),
+            "--threads",
+            "2",
+            "--chunk-size",
+            "300",
+            "--max-memory",
+            "1G",
+            "--report",
+            str(report),
+        ]
+    )
+
+    assert out1.read_text() == in1.read_text()
+    options = json.loads(report.read_text())
+    assert options["chunk_size"] == 300
+    assert options["max_memory"] == "1G"
+
+    with pytest.raises(SystemExit):
+        heyfastq_main(["filter-length", "--input", str(in1), "--max-memory", "1M"])
+
+
+def test_run_command_bad_step(tmp_path):
+    in1 = copy_data(tmp_path, "trim_qual_input_1.fastq")
+    with pytest.raises(SystemExit):
+        heyfastq_main(["run", "--step", "subsample", "--input", str(in1)])
+
+
+def test_sharded_output(tmp_path):
+    in1 = copy_data(tmp_path, "subsample_input_1.fastq")
+    in2 = copy_data(tmp_path, "subsample_input_2.fastq")
+    report = tmp_path / "report.json"
+
+    heyfastq_main(
+        [
+            "trim-fixed",
+            "--length",
+            "2",
+            "--shards",
+            "2",
+            "--shard-by",
+            "read",
+            "--input",
+            str(in1),
+            str(in2),
+            "--output",
+            str(tmp_path / "out_{shard}_1.fastq"),
+            str(tmp_path / "out_{shard}_2.fastq"),
+            "--report",
+            str(report),
+        ]
+    )
+
+    shard_counts = json.loads(report.read_text())["shard_counts"]
+    ids = []
+    for shard, counts in enumerate(shard_counts):
+        text1 = (tmp_path / f"out_{shard}_1.fastq").read_text()
+        text2 = (tmp_path / f"out_{shard}_2.fastq").read_text()
+        ids1 = text1.splitlines()[0::4]
+        assert ids1 == text2.splitlines()[0::4]
+        assert counts["output_reads"] == len(ids1)
+        ids.extend(ids1)
+    assert sorted(ids) == sorted(
+        read_expected("subsample_input_1.fastq").splitlines()[0::4]
+    )
+
+
+def test_sharded_output_needs_placeholder(tmp_path):
+    in1 = copy_data(tmp_path, "subsample_input_1.fastq")
+    with pytest.raises(SystemExit):
+        heyfastq_main(
+            [
+                "trim-fixed",
+                "--shards",
+                "2",
+                "--input",
+                str(in1),
+                "--output",
+                str(tmp_path / "out.fastq"),
+            ]
+        )
+    assert not (tmp_path / "out.fastq").exists()
+
+
+def test_part_and_merge_reports(tmp_path, capsys):
+    in1 = copy_data(tmp_path, "subsample_input_1.fastq")
+    in2 = copy_data(tmp_path, "subsample_input_2.fastq")
+    reports = []
+    for part in ["1/3", "2/3", "3/3"]:
+        k = part[0]
+        reports.append(str(tmp_path / f"report_{k}.json"))
+        heyfastq_main(
+            [
+                "trim-fixed",
+                "--length",
+                "2",
+                "--part",
+                part,
+                "--input",
+                str(in1),
+                str(in2),
+                "--output",
+                str(tmp_path / f"out_{k}_1.fastq"),
+                str(tmp_path / f"out_{k}_2.fastq"),
+                "--report",
+                reports[-1],
+            ]
+        )
+
+    out1 = "".join((tmp_path / f"out_{k}_1.fastq").read_text() for k in "123")
+    out2 = "".join((tmp_path / f"out_{k}_2.fastq").read_text() for k in "123")
+    input_ids = read_expected("subsample_input_1.fastq").splitlines()[0::4]
+    assert out1.splitlines()[0::4] == input_ids
+    assert out2.splitlines()[0::4] == input_ids
+
+    merged = tmp_path / "merged.json"
+    heyfastq_main(["merge-reports", *reports, "--output", str(merged)])
+    report = json.loads(merged.read_text())
+    assert "part" not in report
+    assert report["trim_fixed"]["input_reads"] == len(input_ids)
+    assert report["trim_fixed"]["output_bases"] == 2 * len(input_ids)
+
+
+def test_merge_profile_reports(tmp_path):
+    in1 = copy_data(tmp_path, "subsample_input_1.fastq")
+    reports = []
+    for k in "12":
+        reports.append(str(tmp_path / f"report_{k}.json"))
+        heyfastq_main(
+            [
+                "trim-fixed",
+                "--part",
+                f"{k}/2",
+                "--input",
+                str(in1),
+                "--output",
+                str(tmp_path / f"out_{k}_1.fastq"),
+                "--profile",
+                str(tmp_path / f"heyfastq_{k}.prof"),
+                "--report",
+                reports[-1],
+            ]
+        )
+
+    merged = tmp_path / "merged.json"
+    heyfastq_main(["merge-reports", *reports, "--output", str(merged)])
+    report = json.loads(merged.read_text())
+    assert "profile" not in report
+    assert report["trim_fixed"]["input_reads"] == 3
+
+
+def test_part_bad_value(tmp_path):
+    in1 = copy_data(tmp_path, "subsample_input_1.fastq")
+    with pytest.raises(SystemExit):
+        heyfastq_main(["trim-fixed", "--part", "3/2", "--input", str(in1)])
+
+
+def write_many_reads(path, n, mate):
+    path.write_text(
+        "".join(
+            f"@r{i} {mate}\nACGT{'A' * (i % 5)}\n+\nFFFF{'F' * (i % 5)}\n"
+            for i in range(n)
+        )
+    )
+
+
+def test_subsample_command_indexed(tmp_path):
+    in1 = tmp_path / "input_1.fastq"
+    in2 = tmp_path / "input_2.fastq"
+    write_many_reads(in1, 500, 1)
+    write_many_reads(in2, 500, 2)
+    args = ["subsample", "--n", "20", "--seed", "3", "--input", str(in1), str(in2)]
+
+    out = [str(tmp_path / "expected_1.fastq"), str(tmp_path / "expected_2.fastq")]
+    heyfastq_main(args + ["--output", *out, "--report", str(tmp_path / "e.json")])
+    heyfastq_main(["index", "--interval", "16", str(in1), str(in2)])
+    assert (tmp_path / "input_1.fastq.fqi").exists()
+    out_indexed = [str(tmp_path / "out_1.fastq"), str(tmp_path / "out_2.fastq")]
+    heyfastq_main(
+        args + ["--output", *out_indexed, "--report", str(tmp_path / "i.json")]
+    )
+
+    for expected, got in zip(out, out_indexed):
+        assert Path(got).read_text() == Path(expected).read_text()
+    reports = [json.loads((tmp_path / f).read_text()) for f in ["i.json", "e.json"]]
+    for report in reports:
+        del report["timing"]
+    assert reports[0] == reports[1]
+
+
+@pytest.mark.parametrize("n", ["20", "400"])
+@pytest.mark.parametrize("bgzf", [False, True])
+def test_subsample_command_indexed_any_fraction(tmp_path, n, bgzf):
+    suffix = ".fastq.gz" if bgzf else ".fastq"
+    inputs = [tmp_path / f"input_{mate}{suffix}" for mate in (1, 2)]
+    for mate, path in enumerate(inputs, 1):
+        text = tmp_path / f"input_{mate}.txt"
+        write_many_reads(text, 500, mate)
+        with open_bgzf(path, "wt") if bgzf else open(path, "w") as f:
+            f.write(text.read_text())
+    args = ["subsample", "--n", n, "--seed", "3", "--input", *map(str, inputs)]
+
+    out = [str(tmp_path / "expected_1.fastq"), str(tmp_path / "expected_2.fastq")]
+    heyfastq_main(args + ["--output", *out])
+    heyfastq_main(["index", "--interval", "16", *map(str, inputs)])
+    out_indexed = [str(tmp_path / "out_1.fastq"), str(tmp_path / "out_2.fastq")]
+    report = tmp_path / "report.json"
+    heyfastq_main(args + ["--output", *out_indexed, "--report", str(report)])
+
+    for expected, got in zip(out, out_indexed):
+        assert Path(got).read_text() == Path(expected).read_text()
+    # A large share of the reads is found by scanning, which times its stages
+    scanned = "stages" in json.loads(report.read_text())["timing"]
+    assert scanned == (n == "400" or bgzf)
+
+
+def test_filter_seq_ids_command_indexed(tmp_path):
+    in1 = tmp_path / "input_1.fastq"
+    in2 = tmp_path / "input_2.fastq"
+    write_many_reads(in1, 500, 1)
+    write_many_reads(in2, 500, 2)
+    seqids = tmp_path / "ids.txt"
+    seqids.write_text("r3\nr250\nr499\nmissing\n")
+    args = ["filter-seqids", str(seqids), "--keep-ids", "--input", str(in1), str(in2)]
+
+    heyfastq_main(["index", "--interval", "4", "--ids", str(in1), str(in2)])
+    out = [str(tmp_path / "out_1.fastq"), str(tmp_path / "out_2.fastq")]
+    report = tmp_path / "report.json"
+    heyfastq_main(args + ["--output", *out, "--report", str(report)])
+
+    assert Path(out[0]).read_text().splitlines()[0::4] == [
+        "@r3 1",
+        "@r250 1",
+        "@r499 1",
+    ]
+    assert Path(out[1]).read_text().splitlines()[0::4] == [
+        "@r3 2",
+        "@r250 2",
+        "@r499 2",
+    ]
+    counts = json.loads(report.read_text())["filter_seq_ids"]
+    assert counts["input_reads"] == 500
+    assert counts["output_reads"] == 3
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+def test_filter_seq_ids_command_same_key(tmp_path, indexed):
+    # These two IDs have the same key in the ID index
+    id1 = "A00123:45:HABCDEFXX:1:1101:39620:28825"
+    id2 = "A00123:45:HABCDEFXX:1:1101:67413:28437"
+    in1 = tmp_path / "input.fastq"
+    in1.write_text(
+        "".join(f"@r{i}\nACGT\n+\nFFFF\n" for i in range(200))
+        + f"@{id1}\nACGT\n+\nFFFF\n@{id2}\nACGT\n+\nFFFF\n"
+    )
+    seqids = tmp_path / "ids.txt"
+    seqids.write_text(f"{id1}\n")
+    if indexed:
+        heyfastq_main(["index", "--interval", "4", "--ids", str(in1)])
+    kept = tmp_path / "kept.fastq"
+    removed = tmp_path / "removed.fastq"
+
+    heyfastq_main(
+        ["filter-seqids", str(seqids), "--keep-ids"]
+        + ["--input", str(in1), "--output", str(kept)]
+    )
+    heyfastq_main(
+        ["filter-seqids", str(seqids), "--input", str(in1), "--output", str(removed)]
+    )
+
+    assert kept.read_text() == f"@{id1}\nACGT\n+\nFFFF\n"
+    assert removed.read_text().splitlines()[-4] == f"@{id2}"
+
+
+def test_part_indexed(tmp_path):
+    in1 = tmp_path / "input_1.fastq"
+    write_many_reads(in1, 100, 1)
+    heyfastq_main(["index", "--interval", "10", str(in1)])
+    outputs = []
+    for part in ["1/3", "2/3", "3/3"]:
+        out = tmp_path / f"out_{part[0]}.fastq"
+        heyfastq_main(
+            ["trim-fixed", "--part", part, "--input", str(in1), "--output", str(out)]
+        )
+        outputs.append(out.read_text())
+    assert [len(o.splitlines()) // 4 for o in outputs] == [30, 30, 40]
+    assert "".join(outputs) == in1.read_text()
+
+
+def test_index_command_gzip(tmp_path):
+    in1 = tmp_path / "input_1.fastq.gz"
+    in1.write_bytes(gzip.compress(b"@a\nA\n+\nF\n"))
+    with pytest.raises(SystemExit):
+        heyfastq_main(["index", str(in1)])
+
+
+def test_generate_command(tmp_path):
+    out1 = tmp_path / "gen_1.fastq.gz"
+    out2 = tmp_path / "gen_2.fastq.gz"
+    args = ["generate", "--n", "30", "--length", "20-40", "--seed", "4"]
+    heyfastq_main(args + ["--output", str(out1), str(out2)])
+
+    with gzip.open(out1, "rt") as f1, gzip.open(out2, "rt") as f2:
+        lines1 = f1.read().splitlines()
+        lines2 = f2.read().splitlines()
+    assert len(lines1) == len(lines2) == 120
+    assert lines1[0] == "@read0 1"
+    assert lines2[0] == "@read0 2"
+    assert all(20 <= len(s) <= 40 for s in lines1[1::4])
+
+    out = tmp_path / "gen.fastq"
+    heyfastq_main(args + ["--output", str(out)])
+    assert out.read_text().splitlines()[1::4] == lines1[1::4]
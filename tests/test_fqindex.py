@@ -0,0 +1,95 @@
+import gzip
+
+import pytest
+
+from heyfastqlib.fqindex import (
+    FastqIndex,
+    IndexedFastq,
+    build_index,
+    index_path,
+    load_index,
+)
+from heyfastqlib.idindex import id_key
+from heyfastqlib.read import Read
+from test_bgzf import write_bgzf
+
+READS = [Read(f"r{i} x", "ACGT"[: i % 5], "FFFF"[: i % 5]) for i in range(100)]
+DATA = "".join(f"@{r.desc}\n{r.seq}\n+\n{r.qual}\n" for r in READS).encode()
+
+
+@pytest.fixture(params=["plain", "bgzf"])
+def fastq(request, tmp_path):
+    path = tmp_path / "reads.fastq"
+    if request.param == "bgzf":
+        write_bgzf(path, DATA, 100)
+    else:
+        path.write_bytes(DATA)
+    return path
+
+
+def test_build_index(fastq):
+    index = build_index(fastq, interval=7)
+    assert index.num_reads == 100
+    assert index.num_bases == sum(len(r.seq) for r in READS)
+    assert len(index.offsets) == 15
+    for i, offset in enumerate(index.offsets):
+        assert DATA[offset:].startswith(f"@r{7 * i} x\n".encode())
+    assert bool(index.virtual_offsets) == (fastq.read_bytes()[:2] == b"\x1f\x8b")
+
+
+def test_build_index_small_blocks(fastq, monkeypatch):
+    monkeypatch.setattr("heyfastqlib.fqindex.SCAN_BLOCK_SIZE", 10)
+    expected = build_index(fastq, interval=3, ids=True)
+    monkeypatch.undo()
+    assert build_index(fastq, interval=3, ids=True) == expected
+
+
+def test_index_round_trip(fastq):
+    index = build_index(fastq, interval=5, ids=True)
+    index.write(index_path(fastq))
+    assert load_index(fastq) == index
+
+
+def test_load_index_missing_or_stale(tmp_path):
+    path = tmp_path / "reads.fastq"
+    path.write_bytes(DATA)
+    assert load_index(path) is None
+    build_index(path).write(index_path(path))
+    path.write_bytes(DATA + DATA)
+    with pytest.raises(ValueError):
+        load_index(path)
+
+
+def test_indexed_fastq_reads(fastq):
+    index = build_index(fastq, interval=8)
+    records = [0, 3, 4, 17, 40, 41, 99, 150]
+    with IndexedFastq(fastq, index) as f:
+        assert list(f.reads(records)) == [READS[i] for i in records[:-1]]
+        # Going back seeks again
+        assert list(f.reads([2, 1])) == [READS[2], READS[1]]
+
+
+def test_records_for_keys(fastq):
+    index = build_index(fastq, ids=True)
+    keys = [id_key("r5"), id_key("r77"), id_key("r5 x"), id_key("nope")]
+    assert index.records_for_keys(keys) == [5, 77]
+
+
+def test_build_index_gzip(tmp_path):
+    path = tmp_path / "reads.fastq.gz"
+    path.write_bytes(gzip.compress(DATA))
+    with pytest.raises(ValueError):
+        build_index(path)
+
+
+def test_read_bad_index(tmp_path):
+    path = tmp_path / "reads.fastq.fqi"
+    path.write_bytes(b"nope")
+    with pytest.raises(ValueError):
+        FastqIndex.read(path)
+    fastq = tmp_path / "reads.fastq"
+    fastq.write_bytes(DATA)
+    build_index(fastq).write(path)
+    path.write_bytes(path.read_bytes()[:-8])
+    with pytest.raises(ValueError):
+        FastqIndex.read(path)
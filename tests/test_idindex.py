@@ -0,0 +1,78 @@
+import pytest
+
+from heyfastqlib import idindex
+from heyfastqlib.idindex import SeqIdIndex, id_key, id_keys
+
+# Two Illumina-style IDs with the same key
+COLLIDING = [
+    "A00123:45:HABCDEFXX:1:1101:39620:28825",
+    "A00123:45:HABCDEFXX:1:1101:67413:28437",
+]
+IDS = ["read1", "read2", "M01:55:A:1:1101:15589:1332", "x", "read1", ""]
+
+
+def test_id_keys():
+    assert list(id_keys(IDS)) == [id_key(i) for i in IDS]
+    assert id_key("read1") != id_key("read2")
+    assert id_key("ab") != id_key("ba")
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_seq_id_index(monkeypatch, use_numpy):
+    if not use_numpy:
+        monkeypatch.setattr(idindex, "np", None)
+    elif idindex.np is None:
+        pytest.skip("needs numpy")
+    monkeypatch.setattr(idindex, "BUCKET_SIZE", 1)
+    index = SeqIdIndex.from_ids(IDS)
+    assert len(index) == 5
+    assert list(index.keys) == sorted(set(index.keys))
+    for seq_id in IDS:
+        assert seq_id in index
+    queries = ["read1", "read3", "x", "y", ""]
+    assert [q in index for q in queries] == [True, False, True, False, True]
+    assert index.contains_many(queries) == [True, False, True, False, True]
+
+
+def test_seq_id_index_empty():
+    index = SeqIdIndex.from_ids([])
+    assert len(index) == 0
+    assert "a" not in index
+    assert index.contains_many(["a", "b"]) == [False, False]
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_seq_id_index_same_key(monkeypatch, use_numpy):
+    if not use_numpy:
+        monkeypatch.setattr(idindex, "np", None)
+    elif idindex.np is None:
+        pytest.skip("needs numpy")
+    assert id_key(COLLIDING[0]) == id_key(COLLIDING[1])
+
+    index = SeqIdIndex.from_ids(COLLIDING[:1])
+    assert COLLIDING[0] in index
+    assert COLLIDING[1] not in index
+    assert index.contains_many(COLLIDING + ["x"]) == [True, False, False]
+
+    index = SeqIdIndex.from_ids(COLLIDING[::-1] + COLLIDING + ["x"])
+    assert len(index) == 3
+    assert list(index.keys) == sorted(index.keys)
+    assert index.contains_many(COLLIDING + ["x", "y"]) == [True, True, True, False]
+    assert all(seq_id in index for seq_id in COLLIDING)
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_seq_id_index_many_chunks(monkeypatch, use_numpy):
+    if not use_numpy:
+        monkeypatch.setattr(idindex, "np", None)
+    elif idindex.np is None:
+        pytest.skip("needs numpy")
+    monkeypatch.setattr(idindex, "KEY_CHUNK_SIZE", 3)
+    seq_ids = [f"r{i}" for i in range(50)] + COLLIDING + ["r7", COLLIDING[0]]
+
+    index = SeqIdIndex.from_ids(seq_ids)
+
+    assert len(index) == 52
+    assert list(index.keys) == sorted(index.keys)
+    assert all(seq_id in index for seq_id in seq_ids)
+    assert index.contains_many(["r49", "r50", COLLIDING[1]]) == [True, False, True]
@@ -1,6 +1,19 @@
-from io import StringIO
+from io import BytesIO, StringIO, TextIOWrapper
 
-from heyfastqlib.io import parse_fastq, parse_fastq_single, parse_seq_ids, write_fastq
+import pytest
+
+from heyfastqlib.io import (
+    count_fastq_reads,
+    count_reads,
+    parse_fastq,
+    parse_fastq_batches,
+    parse_fastq_blocks,
+    parse_fastq_single,
+    parse_seq_ids,
+    write_fastq,
+    write_fastq_batches,
+    write_fastq_shards,
+)
 from heyfastqlib.read import Read
 
 
@@ -28,6 +41,11 @@ def test_parse_fastq():
     ]
 
 
+def test_parse_fastq_unpaired():
+    fq = make_fastq(["@a", "TA", "+", "GG"])
+    assert list(parse_fastq((fq,))) == [Read("a", "TA", "GG")]
+
+
 def test_parse_fastq_paired():
     fq1 = make_fastq(["@a", "TA", "+", "GG", "@b", "CG", "+", "AB"])
     fq2 = make_fastq(["@a", "AG", "+", "FF", "@b", "TC", "+", "BC"])
@@ -38,6 +56,140 @@ def test_parse_fastq_paired():
     ]
 
 
+FASTQ_BYTES = b"@ab c\nGGCA\n+\n==;G\n@d:e:f\nCCGTA\n+\n1,4E@\n@g\nT\n+\nF\n"
+FASTQ_READS = [
+    Read("ab c", "GGCA", "==;G"),
+    Read("d:e:f", "CCGTA", "1,4E@"),
+    Read("g", "T", "F"),
+]
+
+
+@pytest.mark.parametrize("block_size", [1, 3, 7, 16, 1 << 16])
+def test_parse_fastq_blocks(block_size):
+    reads = parse_fastq_blocks(BytesIO(FASTQ_BYTES), block_size=block_size)
+    assert list(reads) == FASTQ_READS
+
+
+def test_parse_fastq_blocks_no_final_newline():
+    reads = parse_fastq_blocks(BytesIO(FASTQ_BYTES.rstrip()), block_size=5)
+    assert list(reads) == FASTQ_READS
+
+
+def test_parse_fastq_blocks_crlf():
+    data = FASTQ_BYTES.replace(b"\n", b"\r\n")
+    assert list(parse_fastq_blocks(BytesIO(data), block_size=6)) == FASTQ_READS
+
+
+def test_parse_fastq_blocks_trailing_whitespace():
+    data = FASTQ_BYTES.replace(b"\n", b" \t\n")
+    assert list(parse_fastq_blocks(BytesIO(data), block_size=6)) == FASTQ_READS
+    # The same reads as parsing text lines
+    text = StringIO(data.decode())
+    assert list(parse_fastq_single(text)) == FASTQ_READS
+
+
+def test_parse_fastq_single_uses_binary_buffer():
+    handle = TextIOWrapper(BytesIO(FASTQ_BYTES), encoding="utf-8")
+    assert list(parse_fastq_single(handle)) == FASTQ_READS
+    assert list(parse_fastq_single(BytesIO(FASTQ_BYTES))) == FASTQ_READS
+
+
+def test_parse_fastq_batches():
+    batches = list(parse_fastq_batches((BytesIO(FASTQ_BYTES),), chunk_size=2))
+    assert [len(b[0]) for b in batches] == [2, 1]
+    assert [r for b in batches for r in b[0].reads()] == FASTQ_READS
+
+
+def test_parse_fastq_batches_paired():
+    fq1 = make_fastq(["@a", "TA", "+", "GG", "@b", "CG", "+", "AB"])
+    fq2 = make_fastq(["@a", "AG", "+", "FF", "@b", "TC", "+", "BC", "@c", "A"])
+    (batch,) = parse_fastq_batches((fq1, fq2))
+    assert batch[0].reads() == [Read("a", "TA", "GG"), Read("b", "CG", "AB")]
+    assert batch[1].reads() == [Read("a", "AG", "FF"), Read("b", "TC", "BC")]
+
+
+def test_write_fastq_batches():
+    dest1 = StringIO()
+    dest2 = StringIO()
+    fq1 = make_fastq(["@a", "TA", "+", "GG", "@b", "CG", "+", "AB"])
+    fq2 = make_fastq(["@a", "AG", "+", "FF", "@b", "TC", "+", "BC"])
+    write_fastq_batches((dest1, dest2), parse_fastq_batches((fq1, fq2), 1))
+    assert dest1.getvalue() == "@a\nTA\n+\nGG\n@b\nCG\n+\nAB\n"
+    assert dest2.getvalue() == "@a\nAG\n+\nFF\n@b\nTC\n+\nBC\n"
+    fq1.seek(0)
+    fq2.seek(0)
+    with pytest.raises(ValueError):
+        write_fastq_batches((dest1,), parse_fastq_batches((fq1, fq2)))
+
+
+class FailingWriter(StringIO):
+    def write(self, s):
+        raise OSError("disk full")
+
+
+@pytest.mark.parametrize("queue_size", [0, 1, 2])
+def test_write_fastq_batches_queue_size(queue_size):
+    dest1 = StringIO()
+    dest2 = StringIO()
+    fq1 = make_fastq(
+        ["@a", "TA", "+", "GG", "@b", "CG", "+", "AB", "@c", "A", "+", "F"]
+    )
+    fq2 = make_fastq(
+        ["@a", "AG", "+", "FF", "@b", "TC", "+", "BC", "@c", "G", "+", "F"]
+    )
+    batches = parse_fastq_batches((fq1, fq2), 1)
+    write_fastq_batches((dest1, dest2), batches, queue_size=queue_size)
+    assert dest1.getvalue() == "@a\nTA\n+\nGG\n@b\nCG\n+\nAB\n@c\nA\n+\nF\n"
+    assert dest2.getvalue() == "@a\nAG\n+\nFF\n@b\nTC\n+\nBC\n@c\nG\n+\nF\n"
+
+
+def test_write_fastq_batches_serialized():
+    dest1 = StringIO()
+    dest2 = StringIO()
+    chunks = [("@a\nA\n+\nF\n", "@a\nC\n+\nF\n"), ("@b\nG\n+\nF\n", "")]
+    write_fastq_batches((dest1, dest2), iter(chunks))
+    assert dest1.getvalue() == "@a\nA\n+\nF\n@b\nG\n+\nF\n"
+    assert dest2.getvalue() == "@a\nC\n+\nF\n"
+
+
+def test_write_fastq_batches_error():
+    batches = parse_fastq_batches((BytesIO(FASTQ_BYTES),), chunk_size=1)
+    with pytest.raises(OSError, match="disk full"):
+        write_fastq_batches((FailingWriter(),), batches, queue_size=1)
+
+
+def fastq_text(ids):
+    return "".join(f"@{i}\nA\n+\nF\n" for i in ids)
+
+
+def test_write_fastq_shards_by_chunk():
+    shards = [(StringIO(), StringIO()) for _ in range(2)]
+    fq1 = make_fastq(fastq_text("abcde").splitlines())
+    fq2 = make_fastq(fastq_text("abcde").splitlines())
+    counts = write_fastq_shards(shards, parse_fastq_batches((fq1, fq2), 2))
+    assert [f.getvalue() for f in shards[0]] == [fastq_text("abe")] * 2
+    assert [f.getvalue() for f in shards[1]] == [fastq_text("cd")] * 2
+    assert counts == [
+        {"output_reads": 3, "output_bases": 3},
+        {"output_reads": 2, "output_bases": 2},
+    ]
+
+
+def test_write_fastq_shards_by_read():
+    shards = [(StringIO(),) for _ in range(3)]
+    fq = make_fastq(fastq_text("abcdefg").splitlines())
+    batches = parse_fastq_batches((fq,), 2)
+    counts = write_fastq_shards(shards, batches, by="read", queue_size=0)
+    assert [s[0].getvalue() for s in shards] == [
+        fastq_text("adg"),
+        fastq_text("be"),
+        fastq_text("cf"),
+    ]
+    assert [c["output_reads"] for c in counts] == [3, 2, 2]
+    with pytest.raises(ValueError):
+        write_fastq_shards(shards, iter([]), by="pair")
+
+
 def test_write_fastq():
     dest = StringIO()
     reads = [Read("a", "CGT", "BBC"), Read("b", "TAC", "CCD")]
@@ -57,6 +209,35 @@ def test_write_fastq_paired():
     assert dest2.getvalue() == "@a\nACG\n+\nCCD\n@b\nTAC\n+\nEEF\n"
 
 
+@pytest.mark.parametrize("queue_size", [0, 2])
+def test_write_fastq_chunks(queue_size):
+    dest = StringIO()
+    write_fastq((dest,), iter(FASTQ_READS), queue_size=queue_size, chunk_size=2)
+    assert dest.getvalue() == FASTQ_BYTES.decode()
+    with pytest.raises(ValueError):
+        write_fastq((dest,), iter([(FASTQ_READS[0], FASTQ_READS[1])]))
+    with pytest.raises(OSError):
+        write_fastq((FailingWriter(),), iter(FASTQ_READS), chunk_size=1)
+
+
+@pytest.mark.parametrize("block_size", [1, 5, 1 << 16])
+def test_count_reads(block_size):
+    assert count_reads(BytesIO(FASTQ_BYTES), block_size) == 3
+    assert count_reads(BytesIO(FASTQ_BYTES.rstrip()), block_size) == 3
+    handle = TextIOWrapper(BytesIO(FASTQ_BYTES), encoding="utf-8")
+    assert count_reads(handle, block_size) == 3
+    assert count_reads(StringIO(FASTQ_BYTES.decode()), block_size) == 3
+    assert count_reads(BytesIO(b""), block_size) == 0
+
+
+def test_count_fastq_reads():
+    assert count_fastq_reads((BytesIO(FASTQ_BYTES),)) == 3
+    assert count_fastq_reads((BytesIO(FASTQ_BYTES), BytesIO(FASTQ_BYTES))) == 3
+    fq2 = make_fastq(["@a", "AG", "+", "FF"])
+    with pytest.raises(ValueError):
+        count_fastq_reads((BytesIO(FASTQ_BYTES), fq2))
+
+
 def test_parse_seq_ids():
     handle = StringIO("Id1\n\tId2|345 678  \n   \n   # a comment\n  id3")
     assert list(parse_seq_ids(handle)) == ["Id1", "Id2|345", "id3"]
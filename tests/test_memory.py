@@ -0,0 +1,128 @@
+import gzip
+import os
+import shutil
+
+import pytest
+
+from heyfastqlib import memory
+from heyfastqlib.benchmark import run_heyfastq
+from heyfastqlib.bgzf import open_bgzf
+from heyfastqlib.command import heyfastq_main
+from heyfastqlib.memory import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_RECORD_SIZE,
+    GZIP_MEMORY,
+    file_memory,
+    mean_record_size,
+    parse_memory_size,
+    plan_memory,
+)
+
+
+def test_parse_memory_size():
+    assert parse_memory_size("1024") == 1024
+    assert parse_memory_size("500M") == 500 << 20
+    assert parse_memory_size("2g") == 2 << 30
+    assert parse_memory_size("1.5GiB") == 3 << 29
+    with pytest.raises(ValueError):
+        parse_memory_size("lots")
+
+
+def test_mean_record_size(tmp_path):
+    fp = tmp_path / "reads.fastq"
+    fp.write_text("@a\nACGT\n+\nIIII\n@bc\nACGTAC\n+\nIIIIII\n")
+    # The records are 15 and 20 bytes long
+    assert mean_record_size(str(fp)) == 17
+    assert mean_record_size(str(fp), n=1) == 15
+    assert mean_record_size("-") == DEFAULT_RECORD_SIZE
+
+
+def test_mean_record_size_fifo(tmp_path):
+    fifo = tmp_path / "reads.fastq"
+    os.mkfifo(fifo)
+    # Opening the FIFO to read it would block, with no writer
+    assert mean_record_size(str(fifo)) == DEFAULT_RECORD_SIZE
+    assert file_memory(str(fifo), "r", 4) == 0
+
+
+def test_plan_memory():
+    plan = plan_memory(1 << 30, [300, 300], threads=2, outputs=2)
+    assert plan.chunk_size == DEFAULT_CHUNK_SIZE
+    assert plan.max_in_flight == 4
+
+    assert plan_memory(1 << 30, [300], threads=2, chunk_size=500).chunk_size == 500
+    # A larger chunk size is used only when asked for
+    assert plan_memory(1 << 30, [300], threads=2, chunk_size=5000).chunk_size == 5000
+
+    small = plan_memory(70 << 20, [300, 300], threads=2, outputs=2)
+    assert 100 <= small.chunk_size < DEFAULT_CHUNK_SIZE
+    assert small.max_in_flight == 4
+
+
+def test_plan_memory_processes():
+    threads = plan_memory(400 << 20, [300], threads=4, chunk_size=50000)
+    processes = plan_memory(400 << 20, [300], threads=4, chunk_size=50000, processes=4)
+    assert processes.chunk_size < threads.chunk_size
+    with pytest.raises(ValueError):
+        plan_memory(300 << 20, [300], threads=4, processes=4)
+
+
+def test_plan_memory_tight():
+    # Too little for 4 chunks in flight, so the window drops to 1 per thread
+    plan = plan_memory(80 << 20, [10000], threads=4)
+    assert plan.max_in_flight == 4
+    assert plan.chunk_size >= 100
+    with pytest.raises(ValueError):
+        plan_memory(70 << 20, [10000], threads=4)
+    with pytest.raises(ValueError):
+        plan_memory(100 << 20, [300], threads=1, io_memory=40 << 20)
+
+
+def test_file_memory(tmp_path, monkeypatch):
+    monkeypatch.setattr(memory.shutil, "which", lambda _: None)
+    plain = tmp_path / "reads.fastq"
+    plain.write_text("@a\nACGT\n+\nIIII\n")
+    gzipped = tmp_path / "reads.fastq.gz"
+    with gzip.open(gzipped, "wt") as f:
+        f.write(plain.read_text())
+    bgzf = tmp_path / "reads.bgzf.gz"
+    with open_bgzf(bgzf, "wt") as f:
+        f.write(plain.read_text())
+
+    assert file_memory(str(plain), "r", 4) == 0
+    assert file_memory("-", "r", 4) == 0
+    assert file_memory(str(gzipped), "r", 4) == GZIP_MEMORY
+    # A small BGZF file is read in one piece, whatever the threads
+    assert file_memory(str(bgzf), "r", 1) == file_memory(str(bgzf), "r", 8) > 0
+    assert 0 < file_memory("out.fastq.gz", "w", 1) < file_memory("out.fastq.gz", "w", 8)
+    assert file_memory("out.fastq", "w", 8) == 0
+
+    # pigz does the work in its own process
+    monkeypatch.setattr(memory.shutil, "which", lambda _: "/usr/bin/pigz")
+    assert file_memory(str(bgzf), "r", 8) == 0
+    assert file_memory("out.fastq.gz", "w", 8) == 0
+
+
+@pytest.mark.skipif(shutil.which("pigz") is not None, reason="pigz is used")
+def test_max_memory_bgzf_rss(tmp_path):
+    reads = tmp_path / "reads.fastq.gz"
+    heyfastq_main(["generate", "--n", "50000", "--seed", "1", "--output", str(reads)])
+    max_memory = 300 << 20
+
+    result = run_heyfastq(
+        [
+            "filter-length",
+            "--length",
+            "4",
+            "--threads",
+            "4",
+            "--max-memory",
+            str(max_memory),
+            "--input",
+            str(reads),
+            "--output",
+            str(tmp_path / "out.fastq.gz"),
+        ]
+    )
+
+    assert 0 < result["peak_rss_bytes"] < max_memory
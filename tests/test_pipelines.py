@@ -1,9 +1,19 @@
 from collections.abc import Iterable
 from itertools import count
 
-from heyfastqlib.pipelines import filter_reads, map_reads
-from heyfastqlib.read import Read, trim, length_ok
-from heyfastqlib.util import subsample as util_subsample
+import pytest
+
+from heyfastqlib.batch import batch_reads, reads_batch
+from heyfastqlib.pipelines import (
+    Stage,
+    filter_reads,
+    map_reads,
+    run_batch_pipeline,
+    run_pipeline,
+    sample_reads,
+)
+from heyfastqlib.read import Read, kscore_ok, trim, trim_ends, length_ok
+from heyfastqlib.util import sample_indexes
 
 
 def iter_pipe(items: Iterable):
@@ -103,6 +113,35 @@ def test_filter_reads_multiprocess_matches_single_thread():
     }
 
 
+def test_filter_reads_process_executor_matches_single_thread():
+    pairs = [
+        (Read("r1/1", "ATCG", "!!!!"), Read("r1/2", "GGCA", "####")),
+        (Read("r2/1", "AT", "!!"), Read("r2/2", "CCGT", "####")),
+        (Read("r3/1 x", "ATGGC", "!!!!!"), Read("r3/2 x", "TTAGC", "#####")),
+    ]
+    counter = make_counter()
+
+    kept = list(
+        filter_reads(
+            iter_pipe(pairs),
+            length_ok,
+            counter,
+            threshold=4,
+            threads=2,
+            chunk_size=2,
+            executor="process",
+        )
+    )
+
+    assert kept == [pairs[0], pairs[2]]
+    assert counter == {
+        "input_reads": 3,
+        "input_bases": 11,
+        "output_reads": 2,
+        "output_bases": 9,
+    }
+
+
 def test_map_reads_applies_function_and_counts():
     reads = [
         Read("r1", "ACGT", "!!!!"),
@@ -181,6 +220,40 @@ def test_map_reads_multiprocess_matches_single_thread():
     }
 
 
+def test_map_reads_process_executor_matches_single_thread():
+    reads = [
+        Read("r1", "ACGT", "!!!!"),
+        Read("r2", "GGGTT", "!!!!!"),
+        Read("r3", "", ""),
+    ]
+    counter = make_counter()
+
+    mapped = list(
+        map_reads(
+            iter_pipe(reads),
+            trim,
+            counter,
+            end_idx=3,
+            threads=2,
+            chunk_size=2,
+            executor="process",
+        )
+    )
+
+    assert mapped == [Read("r1", "ACG", "!!!"), Read("r2", "GGG", "!!!"), reads[2]]
+    assert counter == {
+        "input_reads": 3,
+        "input_bases": 9,
+        "output_reads": 3,
+        "output_bases": 6,
+    }
+
+
+def test_filter_reads_rejects_unknown_executor():
+    with pytest.raises(ValueError):
+        list(filter_reads(iter_pipe([]), length_ok, make_counter(), executor="gpu"))
+
+
 def test_filter_reads_supports_subsampling():
     reads = [
         Read("r0", "AAA", "!!!"),
@@ -192,7 +265,7 @@ def test_filter_reads_supports_subsampling():
     length = len(reads)
     sample_size = 3
     seed = 13
-    expected_indexes = util_subsample(list(range(length)), sample_size, seed)
+    expected_indexes = sample_indexes(length, sample_size, seed)
     indexes = set(expected_indexes)
     index_counter = count()
     counter = make_counter()
@@ -212,3 +285,273 @@ def test_filter_reads_supports_subsampling():
         "output_reads": sample_size,
         "output_bases": sampled_bases,
     }
+
+
+def test_sample_reads_single_pass():
+    pairs = [
+        (Read(f"r{i}", "A" * i, "F" * i), Read(f"r{i}", "C" * i, "F" * i))
+        for i in range(10)
+    ]
+    expected_indexes = list(sample_indexes(10, 3, 7))
+    counter = make_counter()
+
+    sampled = list(sample_reads(iter_pipe(pairs), 3, counter, seed=7))
+
+    assert sorted(sampled, key=pairs.index) == [pairs[i] for i in expected_indexes]
+    assert counter == {
+        "input_reads": 10,
+        "input_bases": 45,
+        "output_reads": 3,
+        "output_bases": sum(expected_indexes),
+    }
+
+    in_order = list(
+        sample_reads(iter_pipe(pairs), 3, make_counter(), seed=7, keep_order=True)
+    )
+    assert in_order == [pairs[i] for i in expected_indexes]
+
+
+def test_sample_reads_counts_as_it_reads():
+    reads = [Read(f"r{i}", "ACGT", "FFFF") for i in range(10)]
+    counter = make_counter()
+    seen = []
+
+    def watched():
+        for read in reads:
+            seen.append(counter["input_reads"])
+            yield read
+
+    list(sample_reads(watched(), 3, counter, seed=1))
+
+    assert seen == list(range(10))
+    assert counter["input_reads"] == 10
+    assert counter["output_reads"] == 3
+
+
+def test_run_pipeline_keeps_counters_per_stage():
+    reads = [
+        Read("r1", "ACGTAC", "!!!!!!"),
+        Read("r2", "GG", "!!"),
+        Read("r3", "GGGTTA", "!!!!!!"),
+    ]
+    trim_counter = make_counter()
+    length_counter = make_counter()
+
+    out = list(
+        run_pipeline(
+            iter_pipe(reads),
+            [
+                Stage("map", trim, trim_counter, {"end_idx": 4}),
+                Stage("filter", length_ok, length_counter, {"threshold": 3}),
+            ],
+        )
+    )
+
+    assert out == [Read("r1", "ACGT", "!!!!"), Read("r3", "GGGT", "!!!!")]
+    assert trim_counter == {
+        "input_reads": 3,
+        "input_bases": 14,
+        "output_reads": 3,
+        "output_bases": 10,
+    }
+    assert length_counter == {
+        "input_reads": 3,
+        "input_bases": 10,
+        "output_reads": 2,
+        "output_bases": 8,
+    }
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_run_pipeline_parallel_matches_single_thread(executor):
+    reads = [Read(f"r{i}", "ACGT" * (i % 5), "!!!!" * (i % 5)) for i in range(20)]
+
+    def run(**kwargs):
+        counters = [make_counter(), make_counter()]
+        stages = [
+            Stage("map", trim, counters[0], {"end_idx": 10}),
+            Stage("filter", length_ok, counters[1], {"threshold": 8}),
+        ]
+        return list(run_pipeline(iter_pipe(reads), stages, **kwargs)), counters
+
+    assert run(threads=3, chunk_size=3, executor=executor) == run()
+
+
+class PickleCounter:
+    pickled = 0
+
+    def __getstate__(self):
+        PickleCounter.pickled += 1
+        return {}
+
+
+def length_at_least(read: Read, threshold: int, unused: PickleCounter) -> bool:
+    return len(read.seq) >= threshold
+
+
+def test_run_pipeline_process_executor_sends_kwargs_once():
+    reads = [Read(f"r{i}", "ACGT" * (i % 5), "!!!!" * (i % 5)) for i in range(50)]
+    counter = make_counter()
+    stages = [
+        Stage(
+            "filter",
+            length_at_least,
+            counter,
+            {"threshold": 8, "unused": PickleCounter()},
+        )
+    ]
+    PickleCounter.pickled = 0
+
+    kept = list(
+        run_pipeline(
+            iter_pipe(reads), stages, threads=2, chunk_size=2, executor="process"
+        )
+    )
+
+    assert kept == [r for r in reads if len(r.seq) >= 8]
+    # At most once for each worker process, rather than once for each chunk
+    assert PickleCounter.pickled <= 2
+
+
+# Set only in the test process, so a worker sees it only if it was forked
+_parent_mark = None
+
+
+def _filter_unmarked(read):
+    return _parent_mark is None
+
+
+def test_process_workers_are_not_forked():
+    global _parent_mark
+    reads = [Read(f"r{i}", "ACGT", "FFFF") for i in range(6)]
+    stages = [Stage("filter", _filter_unmarked, make_counter())]
+    _parent_mark = "parent"
+    try:
+        kept = list(
+            run_pipeline(
+                iter_pipe(reads), stages, threads=2, chunk_size=2, executor="process"
+            )
+        )
+    finally:
+        _parent_mark = None
+
+    assert kept == reads
+
+
+def test_stage_rejects_unknown_kind():
+    with pytest.raises(ValueError):
+        Stage("reduce", trim, make_counter())
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_run_batch_pipeline_matches_run_pipeline(executor):
+    pairs = [
+        (
+            Read(f"r{i}", "ACGTTGCA"[: i % 8 + 1] * 3, "!5?I!5?I"[: i % 8 + 1] * 3),
+            Read(f"r{i}", "AAAACCGT"[: i % 7 + 1] * 4, "II!!II!!"[: i % 7 + 1] * 4),
+        )
+        for i in range(30)
+    ]
+
+    def make_stages():
+        # kscore_ok and trim_ends have no batch version, trim and length_ok do
+        return [
+            Stage("map", trim, make_counter(), {"end_idx": 20}),
+            Stage("filter", kscore_ok, make_counter(), {"min_kscore": 0.2}),
+            Stage("map", trim_ends, make_counter(), {"threshold_start": 10}),
+            Stage("filter", length_ok, make_counter(), {"threshold": 6}),
+        ]
+
+    expected_stages = make_stages()
+    expected = list(run_pipeline(iter_pipe(pairs), expected_stages))
+
+    stages = make_stages()
+    batches = (reads_batch(pairs[i : i + 4], 2) for i in range(0, len(pairs), 4))
+    out = run_batch_pipeline(batches, stages, threads=2, executor=executor)
+
+    assert [rp for b in out for rp in batch_reads(b)] == expected
+    assert [s.counter for s in stages] == [s.counter for s in expected_stages]
+
+
+@pytest.mark.parametrize("max_in_flight", [None, 1, 3])
+def test_run_batch_pipeline_in_flight(max_in_flight):
+    reads = [Read(f"r{i}", "ACGT", "IIII") for i in range(40)]
+    taken = []
+
+    def batches():
+        for i in range(0, len(reads), 2):
+            taken.append(i // 2)
+            yield reads_batch(reads[i : i + 2], 1)
+
+    stages = [Stage("filter", length_ok, make_counter(), {"threshold": 1})]
+    out = run_batch_pipeline(batches(), stages, threads=2, max_in_flight=max_in_flight)
+    window = 4 if max_in_flight is None else max_in_flight
+    for n, b in enumerate(out, start=1):
+        # Batches are only taken from the input as results are handed on
+        assert len(taken) <= n + window
+        assert len(b[0]) == 2
+    assert n == 20
+
+
+def test_run_batch_pipeline_bad_in_flight():
+    with pytest.raises(ValueError):
+        list(run_batch_pipeline(iter([]), [], threads=2, max_in_flight=0))
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_run_batch_pipeline_timing(executor):
+    reads = [Read(f"r{i}", "ACGT" * 10, "IIII" * 10) for i in range(20)]
+    stages = [
+        Stage("map", trim, make_counter(), {"end_idx": 20}),
+        Stage("filter", length_ok, make_counter(), {"threshold": 10}),
+    ]
+    serialize_timing = {"wall_seconds": 0.0, "cpu_seconds": 0.0}
+    batches = (reads_batch(reads[i : i + 5], 1) for i in range(0, len(reads), 5))
+    out = run_batch_pipeline(
+        batches,
+        stages,
+        threads=2,
+        executor=executor,
+        serialize=True,
+        serialize_timing=serialize_timing,
+    )
+    list(out)
+
+    for timing in [s.timing for s in stages] + [serialize_timing]:
+        assert timing["wall_seconds"] > 0
+        assert timing["cpu_seconds"] >= 0
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_pipelines_serialize(executor):
+    pairs = [
+        (Read(f"r{i}", "ACGT" * (i % 4), "!!!!" * (i % 4)), Read(f"r{i}", "GG", "II"))
+        for i in range(10)
+    ]
+
+    def fastq(reads):
+        return "".join(f"@{r.desc}\n{r.seq}\n+\n{r.qual}\n" for r in reads)
+
+    def make_stages():
+        return [Stage("filter", length_ok, make_counter(), {"threshold": 4})]
+
+    expected = list(run_pipeline(iter_pipe(pairs), make_stages()))
+    expected_text = (fastq(r1 for r1, _ in expected), fastq(r2 for _, r2 in expected))
+
+    out = run_pipeline(
+        iter_pipe(pairs),
+        make_stages(),
+        threads=2,
+        chunk_size=3,
+        executor=executor,
+        serialize=True,
+    )
+    chunks = list(out)
+    assert len(chunks) == 4
+    assert tuple(map("".join, zip(*chunks))) == expected_text
+
+    batches = (reads_batch(pairs[i : i + 3], 2) for i in range(0, len(pairs), 3))
+    out = run_batch_pipeline(
+        batches, make_stages(), threads=2, executor=executor, serialize=True
+    )
+    assert tuple(map("".join, zip(*out))) == expected_text
@@ -0,0 +1,56 @@
+from multiprocessing.pool import ThreadPool
+import pstats
+
+import pytest
+
+from heyfastqlib.batch import reads_batch
+from heyfastqlib.pipelines import Stage, run_batch_pipeline
+from heyfastqlib.profiling import THREADS_PROFILABLE, Profiler, profiled_call
+from heyfastqlib.read import Read, kscore_ok
+
+
+def busy(n):
+    return sum(i * i for i in range(n))
+
+
+def test_profiled_call():
+    result, stats = profiled_call(busy, 1000)
+    assert result == busy(1000)
+    assert any(name == "busy" for _, _, name in stats)
+
+
+@pytest.mark.skipif(not THREADS_PROFILABLE, reason="needs per-thread cProfile")
+def test_profiler_threads():
+    with Profiler() as profiler:
+        with ThreadPool(2) as pool:
+            pool.map(busy, [1000] * 4)
+    summary = profiler.stage_summary({"busy": [busy, None]})
+    assert summary["busy"]["calls"] == 4
+    assert summary["busy"]["cumtime"] > 0
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_profiler_pipeline(executor, tmp_path):
+    reads = [Read(f"r{i}", "ACGT" * 10, "IIII" * 10) for i in range(20)]
+    stages = [Stage("filter", kscore_ok, {}, {"min_kscore": 0.1})]
+    batches = (reads_batch(reads[i : i + 5], 1) for i in range(0, len(reads), 5))
+    with Profiler() as profiler:
+        # Without batch functions, kscore_ok is called once per read
+        out = run_batch_pipeline(
+            batches,
+            stages,
+            threads=2,
+            executor=executor,
+            batch_functions={},
+            profiler=profiler,
+        )
+        list(out)
+
+    if executor == "process" or THREADS_PROFILABLE:
+        summary = profiler.stage_summary({"kscore_ok": [kscore_ok]})
+        assert summary["kscore_ok"]["calls"] == 20
+    top = profiler.top(3)
+    assert len(top) == 3
+    assert top[0]["tottime"] >= top[1]["tottime"]
+    profiler.dump(tmp_path / "out.prof")
+    assert pstats.Stats(str(tmp_path / "out.prof")).total_calls > 0
@@ -0,0 +1,50 @@
+import io
+import json
+import time
+
+import pytest
+
+from heyfastqlib.progress import Heartbeat
+
+
+def test_heartbeat():
+    f = io.StringIO()
+    counters = {}
+    with Heartbeat(f, counters, interval=0.01) as heartbeat:
+        counters["trim"] = {"input_reads": 10, "output_reads": 10}
+        counters["filter"] = {"input_reads": 10, "output_reads": 4}
+        time.sleep(0.05)
+        assert heartbeat.reads() == 10
+    lines = [json.loads(line) for line in f.getvalue().splitlines()]
+    assert len(lines) > 1
+    assert [line["done"] for line in lines] == [False] * (len(lines) - 1) + [True]
+    last = lines[-1]
+    assert last["reads"] == 10
+    assert last["elapsed_seconds"] > 0
+    assert last["stages"] == {
+        "trim": {"input_reads": 10, "output_reads": 10, "pass_rate": 1.0},
+        "filter": {"input_reads": 10, "output_reads": 4, "pass_rate": 0.4},
+    }
+
+
+def test_heartbeat_no_reads():
+    f = io.StringIO()
+    with Heartbeat(f, {"trim": {"input_reads": 0, "output_reads": 0}}):
+        pass
+    (line,) = f.getvalue().splitlines()
+    status = json.loads(line)
+    assert status["reads"] == 0
+    assert status["stages"]["trim"]["pass_rate"] is None
+
+
+def test_heartbeat_failed_run():
+    f = io.StringIO()
+    with pytest.raises(RuntimeError):
+        with Heartbeat(f, {}):
+            raise RuntimeError()
+    assert json.loads(f.getvalue())["done"] is False
+
+
+def test_heartbeat_bad_interval():
+    with pytest.raises(ValueError):
+        Heartbeat(io.StringIO(), {}, interval=0)
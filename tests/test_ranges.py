@@ -0,0 +1,81 @@
+import gzip
+
+import pytest
+
+from heyfastqlib.ranges import open_part, part_ranges
+from test_bgzf import write_bgzf
+
+# Quality lines starting with "@" and "+" make resyncing harder
+DATA_1 = b"".join(
+    b"@r%d/1\nACGT%s\n+\n@+F%s\n" % (i, b"A" * (i % 7), b"F" * (i % 7 + 1))
+    for i in range(300)
+)
+DATA_2 = b"".join(
+    b"@r%d/2\nTT%s\n+\n+@%s\n" % (i, b"G" * (i % 11), b"@" * (i % 11))
+    for i in range(300)
+)
+
+
+def write_inputs(tmp_path, bgzf):
+    paths = [tmp_path / "r1.fastq", tmp_path / "r2.fastq"]
+    for path, data in zip(paths, [DATA_1, DATA_2]):
+        if bgzf:
+            write_bgzf(path, data, 500)
+        else:
+            path.write_bytes(data)
+    return paths
+
+
+def records(data):
+    lines = data.splitlines(keepends=True)
+    return [b"".join(lines[i : i + 4]) for i in range(0, len(lines), 4)]
+
+
+@pytest.mark.parametrize("bgzf", [False, True])
+@pytest.mark.parametrize("parts", [1, 2, 5, 13])
+def test_open_part(tmp_path, bgzf, parts):
+    paths = write_inputs(tmp_path, bgzf)
+    got_1 = []
+    got_2 = []
+    for part in range(parts):
+        f1, f2 = open_part(paths, part, parts, threads=1)
+        with f1, f2:
+            part_1 = records(f1.read())
+            part_2 = records(f2.read())
+        assert [r.split(b"/")[0] for r in part_1] == [r.split(b"/")[0] for r in part_2]
+        got_1.extend(part_1)
+        got_2.extend(part_2)
+    assert got_1 == records(DATA_1)
+    assert got_2 == records(DATA_2)
+
+
+def test_part_ranges_single_file(tmp_path):
+    path = tmp_path / "r1.fastq"
+    path.write_bytes(DATA_1)
+    ranges = [part_ranges([path], k, 3) for k in range(3)]
+    assert ranges[0][0][0] == 0
+    assert ranges[-1][0][1] == len(DATA_1)
+    for (r1,), (r2,) in zip(ranges, ranges[1:]):
+        assert r1[1] == r2[0]
+        assert DATA_1[r2[0] : r2[0] + 2] == b"@r"
+
+
+def test_part_ranges_no_final_newline(tmp_path):
+    paths = [tmp_path / "r1.fastq", tmp_path / "r2.fastq"]
+    paths[0].write_bytes(DATA_1[:-1])
+    paths[1].write_bytes(DATA_2[:-1])
+    assert part_ranges(paths, 1, 2)[1][1] == len(DATA_2) - 1
+
+
+def test_part_ranges_bad_part(tmp_path):
+    path = tmp_path / "r1.fastq"
+    path.write_bytes(DATA_1)
+    with pytest.raises(ValueError):
+        part_ranges([path], 2, 2)
+
+
+def test_open_part_plain_gzip(tmp_path):
+    path = tmp_path / "r1.fastq.gz"
+    path.write_bytes(gzip.compress(DATA_1))
+    with pytest.raises(ValueError):
+        open_part([path], 0, 2)
@@ -0,0 +1,66 @@
+import pytest
+
+from heyfastqlib.report import merge_reports
+
+
+def make_report(part, reads, shard_reads):
+    return {
+        "version": "1.0",
+        "length": 2,
+        "keep_order": False,
+        "part": [part, 2],
+        "steps": [
+            {
+                "step": "trim-fixed",
+                "trim_fixed": {"input_reads": reads, "output_reads": reads},
+            }
+        ],
+        "shard_counts": [{"output_reads": n} for n in shard_reads],
+    }
+
+
+def test_merge_reports():
+    merged = merge_reports([make_report(1, 3, [1, 2]), make_report(2, 4, [4, 0])])
+    assert merged == {
+        "version": "1.0",
+        "length": 2,
+        "keep_order": False,
+        "steps": [
+            {
+                "step": "trim-fixed",
+                "trim_fixed": {"input_reads": 7, "output_reads": 7},
+            }
+        ],
+        "shard_counts": [{"output_reads": 5}, {"output_reads": 2}],
+    }
+
+
+def test_merge_reports_different_options():
+    other = make_report(2, 4, [4, 0])
+    other["length"] = 3
+    with pytest.raises(ValueError, match="length"):
+        merge_reports([make_report(1, 3, [1, 2]), other])
+
+
+def test_merge_reports_different_keys():
+    other = make_report(2, 4, [4, 0])
+    del other["length"]
+    with pytest.raises(ValueError):
+        merge_reports([make_report(1, 3, [1, 2]), other])
+
+
+def test_merge_reports_empty():
+    with pytest.raises(ValueError):
+        merge_reports([])
+
+
+def test_merge_reports_nested_excluded_key():
+    # Only the top-level part is left out; the same key further in is merged
+    reports = [make_report(1, 3, [1, 2]), make_report(2, 4, [4, 0])]
+    for report in reports:
+        report["steps"][0]["part"] = "R1"
+    assert merge_reports(reports)["steps"][0]["part"] == "R1"
+
+    reports[1]["steps"][0]["part"] = "R2"
+    with pytest.raises(ValueError, match="steps/0/part"):
+        merge_reports(reports)
@@ -10,3 +10,22 @@ def test_kmers():
 def test_kscore():
     assert kscore("AAAAA", k=4) == 1 / 5
     assert kscore("AAAATAAAAT", k=4) == 5 / 10
+
+
+def test_kscore_uses_k():
+    assert kscore("ACGTACGT", k=1) == 4 / 8
+    assert kscore("ACGTACGT", k=4) == 4 / 8
+    assert kscore("ACGTACGT", k=6) == 3 / 8
+
+
+def test_count_kmers():
+    assert count_kmers("ATGCGCT", k=4) == 4
+    assert count_kmers("AAAAAAAA", k=3) == 1
+    assert count_kmers("ACG", k=4) == 0
+
+
+def test_count_kmers_ambiguous_bases():
+    # K-mers with an N count as distinct strings, like kmers()
+    seq = "ACGNACGNACGTT"
+    assert count_kmers(seq, k=3) == len(set(kmers(seq, k=3))) == 6
+    assert count_kmers("acgtACGT", k=4) == len(set(kmers("acgtACGT", k=4)))
@@ -0,0 +1,87 @@
+import io
+import random
+
+import pytest
+
+from heyfastqlib.io import parse_fastq
+from heyfastqlib.read import kscore_ok
+from heyfastqlib.synthetic import (
+    LengthDistribution,
+    SyntheticReads,
+    quality_means,
+    synthetic_chunks,
+)
+
+
+def synthetic_reads(settings):
+    chunks = list(synthetic_chunks(settings))
+    mates = 2 if settings.paired else 1
+    fs = tuple(io.StringIO("".join(c[i] for c in chunks)) for i in range(mates))
+    return list(parse_fastq(fs))
+
+
+def test_length_distribution_from_string():
+    assert LengthDistribution.from_string("150") == LengthDistribution("fixed", 150)
+    assert LengthDistribution.from_string("100-150") == LengthDistribution(
+        "uniform", 100, 150
+    )
+    assert LengthDistribution.from_string("150~20") == LengthDistribution(
+        "normal", 150, 20
+    )
+    for spec in ["abc", "150-100", "0"]:
+        with pytest.raises(ValueError):
+            LengthDistribution.from_string(spec)
+
+
+@pytest.mark.parametrize("spec", ["150", "20-40", "50~10"])
+def test_length_distribution_sample(spec):
+    dist = LengthDistribution.from_string(spec)
+    lengths = dist.sample(random.Random(1), 1000)
+    assert all(1 <= n <= dist.max_length() for n in lengths)
+    if dist.kind == "uniform":
+        assert min(lengths) == 20 and max(lengths) == 40
+
+
+def test_quality_means():
+    assert quality_means("flat", 3, 30, 10) == [30, 30, 30]
+    assert quality_means("linear", 3, 30, 10) == [30, 20, 10]
+    tail = quality_means("tail", 8, 30, 10)
+    assert tail[:6] == [30] * 6 and tail[-1] == 10
+    with pytest.raises(ValueError):
+        quality_means("bumpy", 3, 30, 10)
+
+
+def test_synthetic_chunks(monkeypatch):
+    monkeypatch.setattr("heyfastqlib.synthetic.CHUNK_SIZE", 7)
+    settings = SyntheticReads(
+        20, paired=True, lengths=LengthDistribution("uniform", 5, 30), seed=2
+    )
+    pairs = synthetic_reads(settings)
+    assert len(pairs) == 20
+    for i, (r1, r2) in enumerate(pairs):
+        assert r1.desc == f"read{i} 1"
+        assert r2.desc == f"read{i} 2"
+        assert len(r1.seq) == len(r1.qual) == len(r2.seq) == len(r2.qual)
+        assert set(r1.seq) <= set("ACGT")
+        assert all(35 <= ord(q) <= 74 for q in r1.qual)
+    # Same settings, same reads
+    assert synthetic_reads(settings) == pairs
+
+
+def test_synthetic_low_complexity_and_duplicates():
+    settings = SyntheticReads(
+        2000, seed=3, low_complexity=0.2, duplicate_rate=0.3, quality_noise=0
+    )
+    reads = synthetic_reads(settings)
+    low = sum(not kscore_ok(r) for r in reads)
+    assert 0.15 < low / len(reads) < 0.4
+    distinct = len({r.seq for r in reads})
+    assert distinct < 0.8 * len(reads)
+    assert all(r.qual == reads[0].qual for r in reads)
+
+
+def test_synthetic_reads_bad_settings():
+    with pytest.raises(ValueError):
+        SyntheticReads(10, duplicate_rate=2)
+    with pytest.raises(ValueError):
+        SyntheticReads(10, quality_start=60)
@@ -0,0 +1,59 @@
+import io
+
+from heyfastqlib.timing import (
+    Stopwatch,
+    TimedReader,
+    add_timing,
+    subtract_timing,
+    sum_timings,
+    timed_iter,
+    timing_dict,
+)
+
+
+def test_stopwatch():
+    timing = timing_dict()
+    watch = Stopwatch(timing)
+    with watch:
+        sum(range(10000))
+    first = dict(timing)
+    assert first["wall_seconds"] > 0
+    with watch:
+        sum(range(10000))
+    assert timing["wall_seconds"] > first["wall_seconds"]
+
+
+def test_add_and_subtract_timing():
+    a = {"wall_seconds": 2.0, "cpu_seconds": 1.0}
+    add_timing(a, {"wall_seconds": 1.0, "cpu_seconds": 0.5})
+    assert a == {"wall_seconds": 3.0, "cpu_seconds": 1.5}
+    assert sum_timings([a, a]) == {"wall_seconds": 6.0, "cpu_seconds": 3.0}
+    assert sum_timings([]) == timing_dict()
+    assert subtract_timing(a, {"wall_seconds": 1.0, "cpu_seconds": 2.0}) == {
+        "wall_seconds": 2.0,
+        "cpu_seconds": 0.0,
+    }
+
+
+def test_timed_iter():
+    timing = timing_dict()
+    assert list(timed_iter(iter([1, 2, 3]), timing)) == [1, 2, 3]
+    assert timing["wall_seconds"] > 0
+
+
+def test_timed_reader():
+    f = io.TextIOWrapper(io.BytesIO(b"ab\ncd\n"), encoding="ascii")
+    r = TimedReader(f)
+    assert r.encoding == "ascii"
+    assert r.readline() == b"ab\n"
+    assert r.read() == b"cd\n"
+    assert r.timing["wall_seconds"] > 0
+    assert r.seekable()
+    r.seek(1)
+    assert r.tell() == 1
+    assert r.read(2) == b"b\n"
+
+
+def test_timed_reader_text_stream():
+    r = TimedReader(io.StringIO("ab\n"))
+    assert r.read() == "ab\n"
@@ -1,15 +1,57 @@
 import random
 
+import pytest
+
 from heyfastqlib import util
 
 
-def test_subsample():
-    xs = ["a", "b", "c", "d", "e", "f"]
-    # sampling less than or equal to n is original list
-    assert util.subsample(xs[:4], n=4) == xs[:4]
-    # if any of the first n elements are in the resulting list,
-    # they should be in their original position
-    assert util.subsample(xs, n=3, seed=0) == ["f", "b", "c"]
+def test_sample_indexes():
+    idxs = util.sample_indexes(1000, 10, seed=3)
+    assert len(idxs) == 10
+    assert list(idxs) == sorted(set(idxs))
+    assert all(0 <= i < 1000 for i in idxs)
+    assert util.sample_indexes(1000, 10, seed=3) == idxs
+
+
+def test_sample_indexes_small_inputs():
+    assert list(util.sample_indexes(4, 4)) == [0, 1, 2, 3]
+    assert list(util.sample_indexes(3, 5)) == [0, 1, 2]
+    assert list(util.sample_indexes(3, 0)) == []
+
+
+def test_sample_indexes_is_uniform():
+    counts = [0] * 10
+    for seed in range(3000):
+        for i in util.sample_indexes(10, 3, seed=seed):
+            counts[i] += 1
+    # Each index is expected 900 times
+    assert all(800 < c < 1000 for c in counts)
+
+
+@pytest.mark.parametrize("num_items,n", [(1000, 10), (50, 49), (3, 5), (7, 0)])
+def test_stream_sample_matches_sample_indexes(num_items, n):
+    for seed in range(20):
+        expected = list(util.sample_indexes(num_items, n, seed=seed))
+        sampled = util.stream_sample(iter(range(num_items)), n, seed=seed)
+        assert sorted(sampled) == expected
+        assert (
+            util.stream_sample(range(num_items), n, seed=seed, keep_order=True)
+            == expected
+        )
+
+
+def test_stream_sample_reads_to_end():
+    xs = iter(range(10))
+    util.stream_sample(xs, 0, seed=1)
+    assert next(xs, None) is None
+
+
+def test_stream_sample_does_not_reseed_global_random():
+    random.seed(42)
+    expected = random.random()
+    random.seed(42)
+    util.stream_sample(range(100), n=3, seed=1)
+    assert random.random() == expected
 
 
 def test_sliding_sum():
@@ -0,0 +1,66 @@
+import random
+
+import pytest
+
+from heyfastqlib import vectorized
+from heyfastqlib.batch import batch_reads, reads_batch
+from heyfastqlib.read import Read, trim_ends, trim_moving_average
+
+
+def random_reads(rng, n):
+    reads = []
+    for i in range(n):
+        length = rng.randint(0, 25)
+        seq = "".join(rng.choices("ACGTN", k=length))
+        qual = "".join(rng.choices("!#%+5:?FI", k=length))
+        reads.append(Read(f"r{i}", seq, qual))
+    return reads
+
+
+def test_resolve_backend_python():
+    assert vectorized.resolve_backend("python") is None
+    with pytest.raises(ValueError):
+        vectorized.resolve_backend("fortran")
+
+
+def test_resolve_backend_auto():
+    if vectorized.HAVE_NUMPY:
+        assert vectorized.resolve_backend("auto") is vectorized.NUMPY_BATCH_FUNCTIONS
+    else:
+        assert vectorized.resolve_backend("auto") is None
+        with pytest.raises(ValueError):
+            vectorized.resolve_backend("numpy")
+
+
+@pytest.mark.parametrize("k,threshold", [(1, 15), (3, 15), (4, 25), (4, 7.5)])
+def test_trim_moving_average_batch(k, threshold):
+    pytest.importorskip("numpy")
+    rng = random.Random(k)
+    pairs = list(zip(random_reads(rng, 50), random_reads(rng, 50)))
+    expected = [trim_moving_average(rp, k=k, threshold=threshold) for rp in pairs]
+    observed = vectorized.trim_moving_average_batch(
+        reads_batch(pairs, 2), k=k, threshold=threshold
+    )
+    assert batch_reads(observed) == expected
+
+
+@pytest.mark.parametrize("start,end", [(3, 3), (20, 10), (30, 41)])
+def test_trim_ends_batch(start, end):
+    pytest.importorskip("numpy")
+    rng = random.Random(start)
+    reads = random_reads(rng, 100)
+    expected = [trim_ends(r, threshold_start=start, threshold_end=end) for r in reads]
+    observed = vectorized.trim_ends_batch(
+        reads_batch(reads, 1), threshold_start=start, threshold_end=end
+    )
+    assert batch_reads(observed) == expected
+
+
+def test_trim_ends_batch_non_ascii():
+    pytest.importorskip("numpy")
+    reads = [Read("é", "ACGT", "!FF!"), Read("b", "ACGTT", "F!FFé")]
+    expected = [trim_ends(r, threshold_start=10, threshold_end=10) for r in reads]
+    observed = vectorized.trim_ends_batch(
+        reads_batch(reads, 1), threshold_start=10, threshold_end=10
+    )
+    assert batch_reads(observed) == expected